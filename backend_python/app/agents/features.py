@@ -0,0 +1,129 @@
+"""
+输入特征 - 只看输入的形式（长度、时间、次数），不做语义理解
+
+独立成模块，供命运状态机、微扰缓存和提示词模板共用
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.utils.structured_logging import lazy
+
+logger = logging.getLogger(__name__)
+
+
+# 量化分桶（缓存键、判词库等按分桶而不是原始数值组织）
+HOUR_BUCKETS = ("midnight", "dawn", "morning", "worktime", "evening")
+ATTEMPT_BUCKETS = ("first", "second", "few", "many")
+
+
+class InputFeatures:
+    """输入特征（非语义！）"""
+    
+    def __init__(
+        self,
+        is_empty: bool,
+        char_length: int,
+        has_question_mark: bool,
+        hour: int,
+        attempt_count: int
+    ):
+        self.is_empty = is_empty
+        self.char_length = char_length
+        self.has_question_mark = has_question_mark
+        self.hour = hour
+        self.attempt_count = attempt_count
+        
+        # 派生特征
+        self.is_midnight = 23 <= hour or hour < 5
+        self.is_dawn = 5 <= hour < 7
+        self.is_worktime = 9 <= hour < 18
+        self.length_category = self._categorize_length()
+        self.hour_bucket = self._bucket_hour()
+        self.attempt_bucket = self._bucket_attempts()
+    
+    def _categorize_length(self) -> str:
+        """字符长度分类"""
+        if self.char_length == 0:
+            return "empty"
+        elif self.char_length <= 5:
+            return "very_short"
+        elif self.char_length <= 15:
+            return "short"
+        elif self.char_length <= 30:
+            return "medium"
+        else:
+            return "long"
+    
+    def _bucket_hour(self) -> str:
+        """时段分桶（用于缓存键等量化场景）"""
+        if self.is_midnight:
+            return "midnight"
+        elif self.is_dawn:
+            return "dawn"
+        elif self.hour < 9:
+            return "morning"
+        elif self.is_worktime:
+            return "worktime"
+        else:
+            return "evening"
+    
+    def _bucket_attempts(self) -> str:
+        """尝试次数分桶（用于缓存键等量化场景）"""
+        if self.attempt_count <= 1:
+            return "first"
+        elif self.attempt_count == 2:
+            return "second"
+        elif self.attempt_count <= 4:
+            return "few"
+        else:
+            return "many"
+    
+    @classmethod
+    def from_input(
+        cls,
+        question: str,
+        history_count: int = 0,
+        hour: Optional[int] = None
+    ) -> 'InputFeatures':
+        """
+        从用户输入提取特征
+        
+        Args:
+            question: 用户输入
+            history_count: 历史算命次数
+            hour: 当前小时，不指定则取系统时间（批量调用时共用一次）
+            
+        Returns:
+            特征对象
+        """
+        is_empty = len(question.strip()) == 0
+        char_length = len(question.strip())
+        has_question_mark = "?" in question or "？" in question
+        if hour is None:
+            hour = datetime.now().hour
+        
+        features = cls(
+            is_empty=is_empty,
+            char_length=char_length,
+            has_question_mark=has_question_mark,
+            hour=hour,
+            attempt_count=history_count + 1
+        )
+        
+        logger.info("Extracted features: %s", lazy(features.to_dict))
+        return features
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "is_empty": self.is_empty,
+            "char_length": self.char_length,
+            "has_question_mark": self.has_question_mark,
+            "hour": self.hour,
+            "attempt_count": self.attempt_count,
+            "is_midnight": self.is_midnight,
+            "is_dawn": self.is_dawn,
+            "length_category": self.length_category,
+            "hour_bucket": self.hour_bucket,
+            "attempt_bucket": self.attempt_bucket
+        }
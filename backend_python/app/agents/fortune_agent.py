@@ -2,11 +2,20 @@
 算命先生 AI Agent - 重构版
 核心理念：算命先生从命理书中【选择】判词，而不是【生成】判词
 """
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+import random
+from array import array
+from math import gcd
+from typing import AsyncIterator, Callable, Dict, List, Optional, Any, Sequence, Tuple
 from datetime import datetime
 from enum import Enum
 
+from app.agents.user_memory import UserMemoryStore
+from app.utils.deadline import Deadline
+from app.agents.features import ATTEMPT_BUCKETS, HOUR_BUCKETS, InputFeatures
+from app.agents.prompt_templates import BUILTIN_COMPILED, CompiledTemplate
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,88 +32,12 @@ class DestinyState(Enum):
     SEEKING_CONFIRMATION = "seeking_confirmation"  # 寻求确认
 
 
-class InputFeatures:
-    """输入特征（非语义！）"""
-    
-    def __init__(
-        self,
-        is_empty: bool,
-        char_length: int,
-        has_question_mark: bool,
-        hour: int,
-        attempt_count: int
-    ):
-        self.is_empty = is_empty
-        self.char_length = char_length
-        self.has_question_mark = has_question_mark
-        self.hour = hour
-        self.attempt_count = attempt_count
-        
-        # 派生特征
-        self.is_midnight = 23 <= hour or hour < 5
-        self.is_dawn = 5 <= hour < 7
-        self.is_worktime = 9 <= hour < 18
-        self.length_category = self._categorize_length()
-    
-    def _categorize_length(self) -> str:
-        """字符长度分类"""
-        if self.char_length == 0:
-            return "empty"
-        elif self.char_length <= 5:
-            return "very_short"
-        elif self.char_length <= 15:
-            return "short"
-        elif self.char_length <= 30:
-            return "medium"
-        else:
-            return "long"
-    
-    @classmethod
-    def from_input(cls, question: str, history_count: int = 0) -> 'InputFeatures':
-        """
-        从用户输入提取特征
-        
-        Args:
-            question: 用户输入
-            history_count: 历史算命次数
-            
-        Returns:
-            特征对象
-        """
-        is_empty = len(question.strip()) == 0
-        char_length = len(question.strip())
-        has_question_mark = "?" in question or "？" in question
-        hour = datetime.now().hour
-        
-        features = cls(
-            is_empty=is_empty,
-            char_length=char_length,
-            has_question_mark=has_question_mark,
-            hour=hour,
-            attempt_count=history_count + 1
-        )
-        
-        logger.info(f"Extracted features: {features.to_dict()}")
-        return features
-    
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            "is_empty": self.is_empty,
-            "char_length": self.char_length,
-            "has_question_mark": self.has_question_mark,
-            "hour": self.hour,
-            "attempt_count": self.attempt_count,
-            "is_midnight": self.is_midnight,
-            "is_dawn": self.is_dawn,
-            "length_category": self.length_category
-        }
-
-
-def determine_state(features: InputFeatures) -> DestinyState:
+def determine_state_by_rules(features: InputFeatures) -> DestinyState:
     """
-    命运状态机 - 根据特征判断用户状态
+    命运状态机 - 根据特征判断用户状态（规则原文）
     
     这是纯规则判断，不涉及语义理解
+    线上走预编译的决策表（见 DecisionTable），这里保留规则作为编译来源和对照
     """
     # 空输入
     if features.is_empty:
@@ -150,7 +83,12 @@ def determine_state(features: InputFeatures) -> DestinyState:
 
 
 class VerdictPool:
-    """固定判词池 - "命理书"中的判词"""
+    """
+    判词池 - "命理书"中的判词
+    
+    下面的类字面量是内置默认判词；部署了判词包（见 verdict_packs）时，
+    当前生效的判词池整体替换 _pools，不需要重启
+    """
     
     # 判词母句库（中文）
     VERDICTS_ZH = {
@@ -286,13 +224,231 @@ class VerdictPool:
         ],
     }
     
+    # 当前生效的判词池：语言 -> {状态: 判词列表}，只整体替换、不原地修改
+    _pools: Dict[str, Any] = {}
+    # 按需加载未预加载语言的回调：language -> 判词池或 None
+    _lazy_loader: Optional[Callable[[str], Optional[Any]]] = None
+    
+    @staticmethod
+    def builtin_pools() -> Dict[str, Dict[DestinyState, List[str]]]:
+        """内置判词池"""
+        return {'zh': VerdictPool.VERDICTS_ZH, 'en': VerdictPool.VERDICTS_EN}
+    
+    @staticmethod
+    def has_language(language: str) -> bool:
+        """是否有该语言的判词池（内置、已加载或可以按需加载的判词包）"""
+        if language in VerdictPool._pools:
+            return True
+        loader = VerdictPool._lazy_loader
+        return loader is not None and loader(language) is not None
+    
     @staticmethod
     def get_verdicts(state: DestinyState, language: str = 'zh') -> List[str]:
-        """获取指定状态的判词列表"""
-        if language == 'zh':
-            return VerdictPool.VERDICTS_ZH.get(state, VerdictPool.VERDICTS_ZH[DestinyState.FIRST_TIME])
-        else:
-            return VerdictPool.VERDICTS_EN.get(state, VerdictPool.VERDICTS_EN[DestinyState.FIRST_TIME])
+        """获取指定状态的判词列表（未知语言回退英文）"""
+        pools = VerdictPool._pools.get(language)
+        if pools is None:
+            loader = VerdictPool._lazy_loader
+            pools = (loader(language) if loader is not None else None) or VerdictPool._pools['en']
+        return pools.get(state) or pools[DestinyState.FIRST_TIME]
+
+
+VerdictPool._pools = VerdictPool.builtin_pools()
+
+
+def verdict_residue_by_rules(features: InputFeatures, modulus: int) -> int:
+    """
+    判词索引规则原文 - 对 modulus 取余的哈希值
+    
+    这里使用简单的哈希策略，确保相同特征得到相同判词
+    """
+    return (
+        features.attempt_count * 7 +
+        features.char_length * 3 +
+        features.hour * 5 +
+        (1 if features.has_question_mark else 0) * 11
+    ) % modulus
+
+
+_LENGTH_CATEGORIES = ("empty", "very_short", "short", "medium", "long")
+_LENGTH_CODES = {name: i for i, name in enumerate(_LENGTH_CATEGORIES)}
+_STATES = tuple(DestinyState)
+_STATE_CODES = 2 * len(_LENGTH_CATEGORIES) * 2 * 2 * 4
+# 表大小为 状态码数 × modulus³，modulus 过大时不再展开索引维度
+MAX_TABLE_MODULUS = 12
+
+
+def _attempt_class(attempt_count: int) -> int:
+    """状态规则只区分 <=0 / 1 / 2 / >=3 次"""
+    if attempt_count >= 3:
+        return 3
+    return max(attempt_count, 0)
+
+
+def _state_code(features: InputFeatures) -> int:
+    return (
+        (((1 if features.is_empty else 0) * len(_LENGTH_CATEGORIES)
+          + _LENGTH_CODES[features.length_category]) * 2
+         + (1 if features.has_question_mark else 0)) * 2
+        + (1 if features.is_midnight else 0)
+    ) * 4 + _attempt_class(features.attempt_count)
+
+
+class DecisionTable:
+    """
+    预编译决策表 - determine_state + 判词索引的查表实现
+    
+    特征空间有限（空输入、长度分类、问号、深夜、次数分类，以及次数/长度/小时对
+    modulus 的余数），导入时按规则原文把每个组合算一遍，存成一维数组，
+    每次请求只需一次数组下标访问。
+    
+    modulus 取所有判词池长度的最小公倍数，余数再对具体判词池长度取余即可得到索引。
+    """
+    
+    def __init__(self, modulus: int):
+        self.modulus = modulus
+        self.expand_residue = modulus <= MAX_TABLE_MODULUS
+        self._states, self._residues = self._compile()
+    
+    def _compile(self) -> Tuple[array, array]:
+        m = self.modulus if self.expand_residue else 1
+        size = _STATE_CODES * m * m * m
+        # 状态下标和余数分开存放：余数的上限是 modulus，打包成一个数会随判词池长度溢出
+        states = array('B', bytes(size))
+        residues = array('I', bytes(4 * size)) if self.expand_residue else array('I')
+        
+        for is_empty in (False, True):
+            for length_category in _LENGTH_CATEGORIES:
+                for has_question_mark in (False, True):
+                    for is_midnight in (False, True):
+                        for attempt_count in (0, 1, 2, 3):
+                            sample = InputFeatures(
+                                is_empty=is_empty,
+                                char_length=0,
+                                has_question_mark=has_question_mark,
+                                hour=0 if is_midnight else 12,
+                                attempt_count=attempt_count
+                            )
+                            sample.length_category = length_category
+                            code = _state_code(sample)
+                            state_index = _STATES.index(determine_state_by_rules(sample))
+                            for a in range(m):
+                                for c in range(m):
+                                    for h in range(m):
+                                        sample.attempt_count = a
+                                        sample.char_length = c
+                                        sample.hour = h
+                                        key = ((code * m + a) * m + c) * m + h
+                                        states[key] = state_index
+                                        if self.expand_residue:
+                                            residues[key] = verdict_residue_by_rules(sample, self.modulus)
+        return states, residues
+    
+    def lookup(self, features: InputFeatures) -> Tuple[DestinyState, int]:
+        """
+        查表
+        
+        Returns:
+            (状态, 对 modulus 取余的索引哈希)
+        """
+        m = self.modulus
+        code = _state_code(features)
+        if self.expand_residue:
+            key = ((code * m + features.attempt_count % m) * m + features.char_length % m) * m + features.hour % m
+            return _STATES[self._states[key]], self._residues[key]
+        
+        return _STATES[self._states[code]], verdict_residue_by_rules(features, m)
+
+
+def build_decision_table(pools_by_language: Dict[str, Any]) -> DecisionTable:
+    """按给定判词池编译决策表（不生效，可在后台线程执行）"""
+    sizes = {
+        len(pools.get(state) or pools[DestinyState.FIRST_TIME])
+        for pools in pools_by_language.values()
+        for state in _STATES
+    }
+    modulus = 1
+    for size in sizes:
+        modulus = modulus * size // gcd(modulus, size)
+    return DecisionTable(modulus)
+
+
+def compile_decision_table() -> DecisionTable:
+    """按当前判词池重新编译决策表"""
+    global _decision_table
+    _decision_table = build_decision_table(VerdictPool._pools)
+    return _decision_table
+
+
+def install_verdict_pools(
+    pools_by_language: Dict[str, Any],
+    table: Optional[DecisionTable] = None
+) -> DecisionTable:
+    """
+    原子替换判词池和决策表
+    
+    Args:
+        pools_by_language: 语言 -> {状态: 判词列表}
+        table: 已按这些判词池编译好的决策表，不指定则当场编译
+    """
+    global _decision_table
+    if table is None:
+        table = build_decision_table(pools_by_language)
+    VerdictPool._pools = pools_by_language
+    _decision_table = table
+    return table
+
+
+def _verdict_index(table: DecisionTable, residue: int, features: InputFeatures, pool_size: int) -> int:
+    """
+    把决策表余数换算为判词池索引
+    
+    按需加载的语言包可能不在编译决策表时的判词池里，池长度不整除 modulus 时按规则原文计算
+    """
+    if table.modulus % pool_size == 0:
+        return residue % pool_size
+    return verdict_residue_by_rules(features, pool_size)
+
+
+_decision_table: DecisionTable = None
+compile_decision_table()
+
+
+def determine_state(features: InputFeatures) -> DestinyState:
+    """
+    命运状态机 - 根据特征判断用户状态（查表）
+    
+    结果与 determine_state_by_rules 完全一致
+    """
+    return _decision_table.lookup(features)[0]
+
+
+def classify(features: InputFeatures, language: str = 'zh') -> Tuple[DestinyState, int]:
+    """
+    一次查表同时得到状态和判词索引
+    
+    Returns:
+        (状态, 判词池中的索引)
+    """
+    table = _decision_table
+    state, residue = table.lookup(features)
+    return state, _verdict_index(table, residue, features, len(VerdictPool.get_verdicts(state, language)))
+
+
+def classify_many(
+    features_list: Sequence[InputFeatures],
+    language: str = 'zh'
+) -> List[Tuple[DestinyState, int]]:
+    """批量分类，用于批量接口和离线模拟"""
+    table = _decision_table
+    lookup = table.lookup
+    pool_sizes = {
+        state: len(VerdictPool.get_verdicts(state, language)) for state in _STATES
+    }
+    results = []
+    for features in features_list:
+        state, residue = lookup(features)
+        results.append((state, _verdict_index(table, residue, features, pool_sizes[state])))
+    return results
 
 
 def select_verdict(
@@ -304,21 +460,14 @@ def select_verdict(
     判词选择器 - 从判词池中选择最合适的母句
     
     根据状态和特征，从判词池中选择最合适的一条
-    使用简单的规则选择，不涉及语义理解
+    使用简单的规则选择，不涉及语义理解（索引哈希来自预编译决策表）
     """
     verdicts = VerdictPool.get_verdicts(state, language)
-    
-    # 根据特征选择索引
-    # 这里使用简单的哈希策略，确保相同特征得到相同判词
-    index = (
-        features.attempt_count * 7 +
-        features.char_length * 3 +
-        features.hour * 5 +
-        (1 if features.has_question_mark else 0) * 11
-    ) % len(verdicts)
+    table = _decision_table
+    index = _verdict_index(table, table.lookup(features)[1], features, len(verdicts))
     
     selected = verdicts[index]
-    logger.info(f"Selected verdict from pool: state={state.value}, index={index}")
+    logger.info("Selected verdict from pool: state=%s, index=%d", state.value, index)
     
     return selected
 
@@ -326,15 +475,102 @@ def select_verdict(
 class LLMPerturbation:
     """LLM 微扰模块 - 被阉割的 LLM，只能改语气和节奏"""
     
-    def __init__(self, llm_service):
+    def __init__(self, llm_service, cache=None, templates=None, shared_cache=None, shared_cache_ttl: float = 86400):
         self.llm_service = llm_service
+        self.cache = cache  # 可选的 PerturbationCache
+        self.templates = templates  # 可选的 PromptTemplateRegistry，未设置时使用内置模板
+        self.shared_cache = shared_cache if cache is not None else None  # 可选的 CacheService，作为本地缓存的下一级
+        self.shared_cache_ttl = shared_cache_ttl
+        self._template_versions: Dict[str, int] = {}
     
-    async def perturb(
+    def get_template(self, language: str = 'zh') -> CompiledTemplate:
+        """
+        当前生效的微扰模板
+        
+        模板版本变化时清空微扰缓存，避免继续返回旧提示词生成的变体
+        """
+        if self.templates is None:
+            return BUILTIN_COMPILED.get(language) or BUILTIN_COMPILED['zh']
+        template = self.templates.get(language)
+        previous = self._template_versions.get(template.language)
+        if previous != template.version:
+            self._template_versions[template.language] = template.version
+            if previous is not None and self.cache is not None:
+                logger.info("Prompt template changed to %s, clearing perturbation cache", template.label)
+                self.cache.clear()
+        return template
+    
+    def build_prompt(
         self,
         mother_verdict: str,
         features: InputFeatures,
-        language: str = 'zh'
+        language: str = 'zh',
+        template: Optional[CompiledTemplate] = None
     ) -> str:
+        """用预编译模板构建严格限制的微扰提示词"""
+        if template is None:
+            template = self.get_template(language)
+        return template.render_features(mother_verdict, features)
+    
+    @staticmethod
+    def _shared_key(template: CompiledTemplate, cache_key: str) -> str:
+        # 共享缓存不会随模板更新被清空，键里带上模板版本
+        return f"perturb:{template.label}:{cache_key}"
+    
+    async def _cached_variant(self, cache_key: str, template: CompiledTemplate) -> Optional[str]:
+        """依次查询本地缓存和共享缓存"""
+        cached = await self.cache.get_variant(cache_key)
+        if cached is not None or self.shared_cache is None:
+            return cached
+        data = await self.shared_cache.get(self._shared_key(template, cache_key))
+        if data is None:
+            return None
+        return self.cache.import_entry(cache_key, data)
+    
+    def _store_variant(self, cache_key: str, template: CompiledTemplate, variant: str):
+        """写入本地缓存，并在后台同步到共享缓存"""
+        self.cache.add_variant(cache_key, variant)
+        if self.shared_cache is not None:
+            entry = self.cache.export_entry(cache_key)
+            if entry is not None:
+                self.shared_cache.set_background(
+                    self._shared_key(template, cache_key), entry, self.shared_cache_ttl
+                )
+    
+    async def prefetch(self, items: List[Tuple[str, InputFeatures]], language: str, template: CompiledTemplate):
+        """
+        批量预取共享缓存（一次 MGET），之后的 perturb 直接命中本地缓存
+        
+        Args:
+            items: (母句, 特征) 列表
+        """
+        if self.shared_cache is None:
+            return
+        cache_keys = list(dict.fromkeys(
+            self.cache.make_key(mother_verdict, features, language)
+            for mother_verdict, features in items
+        ))
+        values = await self.shared_cache.get_many([self._shared_key(template, key) for key in cache_keys])
+        for cache_key, data in zip(cache_keys, values):
+            if data is not None:
+                self.cache.import_entry(cache_key, data)
+    
+    @staticmethod
+    def clean_output(text: str) -> str:
+        """清理 LLM 输出，确保只有一句话"""
+        result = text.strip()
+        if '\n' in result:
+            result = result.split('\n')[0]
+        return result
+    
+    async def perturb(
+        self,
+        mother_verdict: str,
+        features: InputFeatures,
+        language: str = 'zh',
+        deadline: Optional[Deadline] = None,
+        template: Optional[CompiledTemplate] = None
+    ) -> Tuple[str, Optional[int]]:
         """
         对母句进行微扰
         
@@ -342,79 +578,137 @@ class LLMPerturbation:
             mother_verdict: 从判词池选出的母句
             features: 输入特征
             language: 语言
+            deadline: 请求截止时间，剩余预算不足一次 LLM 调用时直接返回母句
+            template: 微扰模板，不指定则使用当前生效的模板
             
         Returns:
-            微扰后的判词
+            (判词, 模板版本)：跳过微扰、LLM 输出为空或出错时返回 (母句, None)
         """
-        # 构建严格限制的提示词
-        if language == 'zh':
-            prompt = f"""你是语言润色助手。给定一个判词母句，你只能调整语气和节奏。
-
-【严格禁止】
-1. 添加任何新信息
-2. 添加建议或解释
-3. 改变原句的核心含义
-4. 使用温柔或安慰性语气
-5. 添加形容词或副词（除非为了语气）
-
-【允许操作】
-1. 调整语序
-2. 改变停顿节奏（逗号、句号位置）
-3. 调整强硬或柔和的程度
-4. 使用同义替换（不改变含义）
-
-母句：{mother_verdict}
-
-时间：{features.hour}点
-尝试次数：{features.attempt_count}次
-输入长度：{features.char_length}字
-
-请根据时间和次数调整语气强度，输出调整后的判词（仅一句话）："""
-        else:
-            prompt = f"""You are a language polisher. Given a verdict, you can only adjust tone and rhythm.
-
-【STRICTLY FORBIDDEN】
-1. Add any new information
-2. Add advice or explanation
-3. Change core meaning
-4. Use gentle or comforting tone
-5. Add adjectives or adverbs (unless for tone)
-
-【ALLOWED OPERATIONS】
-1. Adjust word order
-2. Change pause rhythm (comma, period position)
-3. Adjust harshness or softness level
-4. Use synonyms (without changing meaning)
-
-Mother verdict: {mother_verdict}
-
-Time: {features.hour}:00
-Attempt count: {features.attempt_count}
-Input length: {features.char_length} chars
-
-Adjust tone based on time and count, output adjusted verdict (one sentence only):"""
+        # 先取模板：版本变化时会清空缓存
+        if template is None:
+            template = self.get_template(language)
+        
+        # 先查缓存（键为量化特征，命中时直接返回已有变体）
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(mother_verdict, features, language)
+            cached = await self._cached_variant(cache_key, template)
+            if cached is not None:
+                logger.debug("Perturbation cache hit: %r -> %r", mother_verdict, cached)
+                # 模板版本变化时缓存会被清空，命中的变体一定出自当前模板
+                return cached, template.version
+        
+        # 剩余预算低于 LLM 典型延迟时跳过微扰
+        if deadline is not None:
+            expected = self.llm_service.observed_latency() or 0.0
+            if deadline.remaining() <= expected:
+                logger.info(
+                    "Skipping perturbation: %.3fs left, LLM p50 %.3fs",
+                    deadline.remaining(), expected
+                )
+                return mother_verdict, None
         
         try:
+            prompt = self.build_prompt(mother_verdict, features, language, template)
+            
             # 调用 LLM，但设置很低的 temperature 避免太大变化
             result = await self.llm_service.generate(
                 prompt=prompt,
                 language=language,
                 temperature=0.3,  # 低温度，减少随机性
-                max_tokens=100  # 限制长度
+                max_tokens=100,  # 限制长度
+                raise_on_error=True,  # 失败时回退母句，而不是通用备用答案
+                deadline=deadline
             )
             
-            # 清理结果，确保只有一句话
-            result = result.strip()
-            if '\n' in result:
-                result = result.split('\n')[0]
+            result = self.clean_output(result)
+            if not result:
+                return mother_verdict, None
+            
+            if cache_key is not None:
+                self._store_variant(cache_key, template, result)
             
-            logger.info(f"Perturbed verdict: '{mother_verdict}' -> '{result}'")
-            return result
+            logger.info("Perturbed verdict: %r -> %r", mother_verdict, result)
+            return result, template.version
             
         except Exception as e:
-            logger.error(f"LLM perturbation error: {e}, fallback to mother verdict")
+            logger.error("LLM perturbation error: %s, fallback to mother verdict", e)
             # 如果 LLM 出错，直接返回母句
-            return mother_verdict
+            return mother_verdict, None
+
+
+    async def perturb_stream(
+        self,
+        mother_verdict: str,
+        features: InputFeatures,
+        language: str = 'zh',
+        deadline: Optional[Deadline] = None,
+        template: Optional[CompiledTemplate] = None
+    ) -> AsyncIterator[Tuple[str, Optional[int]]]:
+        """
+        流式微扰：逐块产出微扰后的判词
+        
+        命中缓存时一次产出整句；跳过微扰或 LLM 失败且尚无输出时产出母句。
+        只输出第一行，和 perturb 的清理规则一致
+        
+        Yields:
+            (判词片段, 模板版本)：回退为母句时版本为 None
+        """
+        if template is None:
+            template = self.get_template(language)
+        
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(mother_verdict, features, language)
+            cached = await self._cached_variant(cache_key, template)
+            if cached is not None:
+                yield cached, template.version
+                return
+        
+        if deadline is not None:
+            expected = self.llm_service.observed_latency() or 0.0
+            if deadline.remaining() <= expected:
+                logger.info("Skipping streamed perturbation: %.3fs left", deadline.remaining())
+                yield mother_verdict, None
+                return
+        
+        emitted: List[str] = []
+        try:
+            prompt = self.build_prompt(mother_verdict, features, language, template)
+            async for delta in self.llm_service.stream(
+                prompt=prompt,
+                language=language,
+                temperature=0.3,
+                max_tokens=100,
+                deadline=deadline
+            ):
+                # 第一行之后的内容丢弃
+                if not emitted:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                if '\n' in delta:
+                    head = delta.split('\n')[0]
+                    if head:
+                        emitted.append(head)
+                        yield head, template.version
+                    break
+                emitted.append(delta)
+                yield delta, template.version
+        except Exception as e:
+            logger.error("LLM streamed perturbation error: %s", e)
+            if not emitted:
+                yield mother_verdict, None
+            return
+        
+        result = ''.join(emitted).strip()
+        if not result:
+            yield mother_verdict, None
+            return
+        
+        if cache_key is not None:
+            self._store_variant(cache_key, template, result)
+        logger.info("Streamed perturbed verdict: %r -> %r", mother_verdict, result)
 
 
 class FortuneAgent:
@@ -424,20 +718,87 @@ class FortuneAgent:
     核心理念：从"命理书"中选择判词，而不是生成判词
     """
     
-    def __init__(self, llm_service):
+    def __init__(
+        self,
+        llm_service,
+        perturbation_cache=None,
+        verdict_bank=None,
+        bank_refresh_rate: float = 0.0,
+        memory: Optional[UserMemoryStore] = None,
+        batch_concurrency: int = 8,
+        prompt_templates=None,
+        shared_cache=None,
+        shared_cache_ttl: float = 86400
+    ):
+        """
+        Args:
+            llm_service: LLM 服务
+            perturbation_cache: 可选的微扰缓存
+            verdict_bank: 可选的预生成判词库，设置后优先从库中取变体
+            bank_refresh_rate: 判词库模式下仍走实时 LLM 微扰的比例（0~1）
+            memory: 按用户分片的记忆，不指定则使用默认上限
+            batch_concurrency: 批量执行时同时进行的微扰数
+            prompt_templates: 可选的 PromptTemplateRegistry，不指定则使用内置模板
+            shared_cache: 可选的共享缓存（CacheService），多个进程共用微扰结果
+            shared_cache_ttl: 共享缓存中微扰结果的有效期（秒）
+        """
         self.llm_service = llm_service
-        self.memory: List[Dict[str, Any]] = []
-        self.llm_perturbation = LLMPerturbation(llm_service)
+        self.memory = memory or UserMemoryStore()
+        self.llm_perturbation = LLMPerturbation(
+            llm_service,
+            cache=perturbation_cache,
+            templates=prompt_templates,
+            shared_cache=shared_cache,
+            shared_cache_ttl=shared_cache_ttl
+        )
+        self.verdict_bank = verdict_bank
+        self.bank_refresh_rate = bank_refresh_rate
+        self.batch_concurrency = max(1, batch_concurrency)
+    
+    async def _apply_perturbation(
+        self,
+        mother_verdict: str,
+        features: InputFeatures,
+        language: str,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[str, str, Optional[int]]:
+        """
+        获取最终判词
+        
+        Returns:
+            (最终判词, 来源：bank 或 live, 微扰模板版本：bank 或回退为母句时为 None)
+        """
+        if self.verdict_bank is not None and random.random() >= self.bank_refresh_rate:
+            variant = self.verdict_bank.get_variant(mother_verdict, features, language)
+            if variant is not None:
+                return variant, "bank", None
+        
+        final_verdict, prompt_version = await self.llm_perturbation.perturb(
+            mother_verdict=mother_verdict,
+            features=features,
+            language=language,
+            deadline=deadline
+        )
+        return final_verdict, "live", prompt_version
     
     async def execute(
         self,
         question: str,
         language: str = 'zh',
-        enable_reasoning: bool = False
+        enable_reasoning: bool = False,
+        user_id: Optional[str] = None,
+        deadline: Optional[Deadline] = None
     ) -> Dict[str, Any]:
         """
         执行完整的算命流程
         
+        Args:
+            question: 用户问题
+            language: 语言
+            enable_reasoning: 是否返回推理过程
+            user_id: 用户ID，用于按用户统计尝试次数
+            deadline: 请求截止时间
+        
         流程：
         1. 提取输入特征（非语义）
         2. 状态机判断用户状态
@@ -446,79 +807,247 @@ class FortuneAgent:
         5. 返回结果
         """
         try:
-            # 1. 提取特征
+            # 1. 提取特征（在任何 await 之前登记次数，避免并发请求拿到相同次数）
             features = InputFeatures.from_input(
                 question=question,
-                history_count=len(self.memory)
+                history_count=self.memory.begin_attempt(user_id)
             )
             
-            # 2. 判断状态
-            state = determine_state(features)
-            logger.info(f"Determined state: {state.value}")
+            # 2-3. 判断状态并选择判词母句（一次查表）
+            state, verdict_index = classify(features, language)
+            mother_verdict = VerdictPool.get_verdicts(state, language)[verdict_index]
+            logger.info("Determined state: %s, verdict index: %d", state.value, verdict_index)
             
-            # 3. 选择判词母句
-            mother_verdict = select_verdict(
-                state=state,
+            # 4. LLM 微扰（判词库模式下直接取预生成变体）
+            final_verdict, perturbation_source, prompt_version = await self._apply_perturbation(
+                mother_verdict=mother_verdict,
                 features=features,
-                language=language
+                language=language,
+                deadline=deadline
             )
             
-            # 4. LLM 微扰
-            final_verdict = await self.llm_perturbation.perturb(
-                mother_verdict=mother_verdict,
-                features=features,
-                language=language
+            # 5-6. 保存到记忆并构建响应
+            return self._finish(
+                question, user_id, features, state, mother_verdict,
+                final_verdict, perturbation_source, enable_reasoning, prompt_version
             )
             
-            # 5. 保存到记忆
-            memory_entry = {
-                "question": question,
-                "result": final_verdict,
-                "state": state.value,
-                "mother_verdict": mother_verdict,
-                "features": features.to_dict(),
-                "timestamp": datetime.now().isoformat()
-            }
-            self.memory.append(memory_entry)
+        except Exception as e:
+            logger.error("Agent execution error: %s", e, exc_info=True)
+            raise
+    
+    async def execute_many(
+        self,
+        questions: List[str],
+        language: str = 'zh',
+        enable_reasoning: bool = False,
+        user_id: Optional[str] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量执行算命流程
+        
+        特征提取、状态判断和母句选择一次完成，LLM 微扰在并发上限内并行执行
+        
+        Args:
+            questions: 用户问题列表
+            language: 语言
+            enable_reasoning: 是否返回推理过程
+            user_id: 用户ID
+            deadline: 整批共用的截止时间
             
-            # 6. 构建响应
-            response = {
-                "result": final_verdict,
-                "state": state.value,
-            }
+        Returns:
+            与 questions 顺序一致的结果列表
+        """
+        try:
+            # 1. 提取特征（整批共用一次时间，按顺序登记次数）
+            hour = datetime.now().hour
+            features_list = [
+                InputFeatures.from_input(
+                    question=question,
+                    history_count=self.memory.begin_attempt(user_id),
+                    hour=hour
+                )
+                for question in questions
+            ]
             
-            if enable_reasoning:
-                response["reasoning"] = {
-                    "features": features.to_dict(),
-                    "state": state.value,
-                    "mother_verdict": mother_verdict,
-                    "perturbation": "applied"
-                }
+            # 2-3. 批量查表
+            classified = classify_many(features_list, language)
+            mother_verdicts = [
+                VerdictPool.get_verdicts(state, language)[index]
+                for state, index in classified
+            ]
+            logger.info("Batch classified: %d questions (lang: %s)", len(questions), language)
             
-            return response
+            # 4. 一次预取共享缓存（全部走判词库时跳过），再有界并发微扰
+            if self.verdict_bank is None or self.bank_refresh_rate > 0:
+                await self.llm_perturbation.prefetch(
+                    list(zip(mother_verdicts, features_list)),
+                    language,
+                    self.llm_perturbation.get_template(language)
+                )
+            semaphore = asyncio.Semaphore(self.batch_concurrency)
+            
+            async def perturb_one(mother_verdict: str, features: InputFeatures):
+                async with semaphore:
+                    return await self._apply_perturbation(
+                        mother_verdict=mother_verdict,
+                        features=features,
+                        language=language,
+                        deadline=deadline
+                    )
+            
+            perturbed = await asyncio.gather(*(
+                perturb_one(mother_verdict, features)
+                for mother_verdict, features in zip(mother_verdicts, features_list)
+            ))
+            
+            # 5-6. 保存到记忆并构建响应
+            return [
+                self._finish(
+                    question, user_id, features, state, mother_verdict,
+                    final_verdict, perturbation_source, enable_reasoning, prompt_version
+                )
+                for question, features, (state, _), mother_verdict, (final_verdict, perturbation_source, prompt_version)
+                in zip(questions, features_list, classified, mother_verdicts, perturbed)
+            ]
             
         except Exception as e:
-            logger.error(f"Agent execution error: {str(e)}", exc_info=True)
+            logger.error("Agent batch execution error: %s", e, exc_info=True)
             raise
     
-    def get_memory(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """获取历史记忆"""
-        return self.memory[-limit:]
+    async def execute_stream(
+        self,
+        question: str,
+        language: str = 'zh',
+        user_id: Optional[str] = None,
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式执行算命流程
+        
+        先产出母句事件（查表即可得到，无需等待 LLM），再逐块产出微扰片段，
+        最后产出完整结果
+        
+        Yields:
+            {"event": "verdict" | "token" | "result", ...}
+        """
+        features = InputFeatures.from_input(
+            question=question,
+            history_count=self.memory.begin_attempt(user_id)
+        )
+        state, verdict_index = classify(features, language)
+        mother_verdict = VerdictPool.get_verdicts(state, language)[verdict_index]
+        logger.info("Determined state: %s, verdict index: %d (stream)", state.value, verdict_index)
+        
+        yield {"event": "verdict", "text": mother_verdict, "state": state.value}
+        
+        # 判词库命中时无需调用 LLM
+        perturbation_source = "live"
+        prompt_version = None
+        chunks: List[str] = []
+        variant = None
+        if self.verdict_bank is not None and random.random() >= self.bank_refresh_rate:
+            variant = self.verdict_bank.get_variant(mother_verdict, features, language)
+        
+        if variant is not None:
+            perturbation_source = "bank"
+            chunks.append(variant)
+            yield {"event": "token", "text": variant}
+        else:
+            async for delta, prompt_version in self.llm_perturbation.perturb_stream(
+                mother_verdict=mother_verdict,
+                features=features,
+                language=language,
+                deadline=deadline
+            ):
+                chunks.append(delta)
+                yield {"event": "token", "text": delta}
+        
+        final_verdict = ''.join(chunks).strip() or mother_verdict
+        result = self._finish(
+            question, user_id, features, state, mother_verdict,
+            final_verdict, perturbation_source, False, prompt_version
+        )
+        yield {"event": "result", **result}
+    
+    def _finish(
+        self,
+        question: str,
+        user_id: Optional[str],
+        features: InputFeatures,
+        state: DestinyState,
+        mother_verdict: str,
+        final_verdict: str,
+        perturbation_source: str,
+        enable_reasoning: bool,
+        prompt_version: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """保存到记忆并构建响应"""
+        # 保存到记忆（只保留精简字段）
+        self.memory.record(user_id, {
+            "question": question,
+            "result": final_verdict,
+            "state": state.value,
+            "mother_verdict": mother_verdict,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+        # 构建响应
+        response = {
+            "result": final_verdict,
+            "state": state.value,
+            "prompt_version": prompt_version,
+        }
+        
+        if enable_reasoning:
+            response["reasoning"] = {
+                "features": features.to_dict(),
+                "state": state.value,
+                "mother_verdict": mother_verdict,
+                "perturbation": perturbation_source
+            }
+        
+        return response
+    
+    def get_memory(self, limit: int = 10, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取指定用户的历史记忆"""
+        return self.memory.get(user_id, limit)
     
-    def clear_memory(self):
-        """清空记忆"""
-        self.memory = []
-        logger.info("Agent memory cleared")
+    def clear_memory(self, user_id: Optional[str] = None):
+        """清空记忆（不指定用户时清空全部）"""
+        self.memory.clear(user_id)
+        logger.info("Agent memory cleared (user: %s)", user_id or 'all')
 
 
 # 全局实例（单例）
 _fortune_agent = None
 
 
-def init_fortune_agent(llm_service) -> FortuneAgent:
+def init_fortune_agent(
+    llm_service,
+    perturbation_cache=None,
+    verdict_bank=None,
+    bank_refresh_rate: float = 0.0,
+    memory: Optional[UserMemoryStore] = None,
+    batch_concurrency: int = 8,
+    prompt_templates=None,
+    shared_cache=None,
+    shared_cache_ttl: float = 86400
+) -> FortuneAgent:
     """初始化 Agent"""
     global _fortune_agent
-    _fortune_agent = FortuneAgent(llm_service)
+    _fortune_agent = FortuneAgent(
+        llm_service,
+        perturbation_cache=perturbation_cache,
+        verdict_bank=verdict_bank,
+        bank_refresh_rate=bank_refresh_rate,
+        memory=memory,
+        batch_concurrency=batch_concurrency,
+        prompt_templates=prompt_templates,
+        shared_cache=shared_cache,
+        shared_cache_ttl=shared_cache_ttl
+    )
     logger.info("Fortune Agent initialized (Refactored Version)")
     return _fortune_agent
 
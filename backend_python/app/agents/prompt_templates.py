@@ -0,0 +1,308 @@
+"""
+提示词模板注册表 - 数据库中的微扰提示词模板
+
+- 启动时加载每种语言版本号最高的启用模板，预编译为静态片段 + 槽位
+- 后台定期检查版本签名，变化时热加载（不需要重启）
+- 数据库中没有可用模板时使用内置模板（版本 0）
+
+模板占位符：{mother_verdict} 以及 InputFeatures 的字段
+（{hour}、{attempt_count}、{char_length}、{hour_bucket} 等），支持格式说明如 {hour:02d}
+
+命令行：
+    python -m app.agents.prompt_templates list
+    python -m app.agents.prompt_templates publish --language zh --file prompt_zh.txt
+"""
+import argparse
+import asyncio
+import logging
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.agents.features import InputFeatures
+
+logger = logging.getLogger(__name__)
+
+PERTURB_TEMPLATE_TYPE = "perturb"
+
+# 模板中允许使用的槽位
+ALLOWED_SLOTS = frozenset({
+    "mother_verdict", "is_empty", "char_length", "has_question_mark",
+    "hour", "attempt_count", "is_midnight", "is_dawn", "length_category",
+    "hour_bucket", "attempt_bucket",
+})
+
+# 内置模板（与数据库默认数据一致）
+BUILTIN_TEMPLATES = {
+    "zh": """你是语言润色助手。给定一个判词母句，你只能调整语气和节奏。
+
+【严格禁止】
+1. 添加任何新信息
+2. 添加建议或解释
+3. 改变原句的核心含义
+4. 使用温柔或安慰性语气
+5. 添加形容词或副词（除非为了语气）
+
+【允许操作】
+1. 调整语序
+2. 改变停顿节奏（逗号、句号位置）
+3. 调整强硬或柔和的程度
+4. 使用同义替换（不改变含义）
+
+母句：{mother_verdict}
+
+时间：{hour}点
+尝试次数：{attempt_count}次
+输入长度：{char_length}字
+
+请根据时间和次数调整语气强度，输出调整后的判词（仅一句话）：""",
+    "en": """You are a language polisher. Given a verdict, you can only adjust tone and rhythm.
+
+【STRICTLY FORBIDDEN】
+1. Add any new information
+2. Add advice or explanation
+3. Change core meaning
+4. Use gentle or comforting tone
+5. Add adjectives or adverbs (unless for tone)
+
+【ALLOWED OPERATIONS】
+1. Adjust word order
+2. Change pause rhythm (comma, period position)
+3. Adjust harshness or softness level
+4. Use synonyms (without changing meaning)
+
+Mother verdict: {mother_verdict}
+
+Time: {hour}:00
+Attempt count: {attempt_count}
+Input length: {char_length} chars
+
+Adjust tone based on time and count, output adjusted verdict (one sentence only):""",
+}
+
+# 编译时试渲染用的样例特征
+_SAMPLE_FEATURES = InputFeatures(
+    is_empty=False, char_length=8, has_question_mark=True, hour=23, attempt_count=2
+)
+
+
+class CompiledTemplate:
+    """预编译模板：静态片段和槽位交替拼接，渲染时不再解析模板"""
+
+    __slots__ = ("name", "language", "version", "parts", "slots", "fields")
+
+    def __init__(self, name: str, language: str, version: int, content: str):
+        """
+        Raises:
+            ValueError: 模板语法错误、使用了不支持的槽位或格式说明与取值类型不匹配
+        """
+        self.name = name
+        self.language = language
+        self.version = version
+
+        parts: List[str] = []
+        slots: List[Tuple[str, str]] = []
+        literal = ""
+        for text, field, spec, conversion in Formatter().parse(content):
+            literal += text
+            if field is None:
+                continue
+            if field not in ALLOWED_SLOTS:
+                raise ValueError(f"Unsupported slot {{{field}}} in template {name} v{version}")
+            if conversion or (spec and "{" in spec):
+                raise ValueError(f"Conversions and nested specs are not supported in template {name} v{version}")
+            parts.append(literal)
+            slots.append((field, spec or ""))
+            literal = ""
+        parts.append(literal)
+        self.parts = tuple(parts)
+        self.slots = tuple(slots)
+        self.fields = tuple(field for field, _ in slots)
+
+        # 用样例特征渲染一次：格式说明与取值类型不匹配（如 {hour:s}）时在加载/发布时就拒绝
+        try:
+            self.render_features("", _SAMPLE_FEATURES)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Template {name} v{version} failed to render: {e}") from e
+
+    def render(self, values: Dict[str, Any]) -> str:
+        """按槽位填入取值"""
+        out = self.parts[0]
+        for (field, spec), part in zip(self.slots, self.parts[1:]):
+            out += format(values[field], spec)
+            out += part
+        return out
+
+    def render_features(self, mother_verdict: str, features: InputFeatures) -> str:
+        """
+        用母句和 InputFeatures 的同名属性渲染（热路径）
+
+        与 render 相同的片段 + 槽位拼接，只是直接读特征属性，不构造取值字典
+        """
+        out = self.parts[0]
+        for (field, spec), part in zip(self.slots, self.parts[1:]):
+            value = mother_verdict if field == "mother_verdict" else getattr(features, field)
+            out += format(value, spec)
+            out += part
+        return out
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+
+BUILTIN_COMPILED = {
+    language: CompiledTemplate(f"builtin_{PERTURB_TEMPLATE_TYPE}_{language}", language, 0, content)
+    for language, content in BUILTIN_TEMPLATES.items()
+}
+
+
+class PromptTemplateRegistry:
+    """启用模板的内存缓存，版本变化时热加载"""
+
+    def __init__(self, db_service, template_type: str = PERTURB_TEMPLATE_TYPE):
+        self.db_service = db_service
+        self.template_type = template_type
+        self._templates: Dict[str, CompiledTemplate] = dict(BUILTIN_COMPILED)
+        self._signature: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self.reloads = 0
+
+    def get(self, language: str) -> CompiledTemplate:
+        """获取语言对应的模板（未知语言回退中文）"""
+        return self._templates.get(language) or self._templates['zh']
+
+    def load(self) -> bool:
+        """
+        从数据库加载启用的模板（每种语言取版本号最高的一条）
+
+        编译失败的模板会被跳过，该语言继续使用之前的模板
+
+        Returns:
+            模板是否发生变化
+        """
+        signature = self.db_service.get_prompt_template_signature(self.template_type)
+        if signature == self._signature:
+            return False
+
+        templates = dict(self._templates)
+        seen = set()
+        for row in self.db_service.get_active_prompt_templates(self.template_type):
+            language = row["language"]
+            if language in seen:
+                continue  # 已按版本号降序，第一条即最新
+            seen.add(language)
+            try:
+                templates[language] = CompiledTemplate(
+                    row["name"], language, row["version"], row["template_content"]
+                )
+            except ValueError as e:
+                logger.error(f"Rejected prompt template: {e}")
+
+        # 数据库中不再有启用模板的语言回退内置模板
+        for language, builtin in BUILTIN_COMPILED.items():
+            if language not in seen:
+                templates[language] = builtin
+
+        self._templates = templates
+        self._signature = signature
+        self.reloads += 1
+        logger.info(
+            "Prompt templates loaded: %s",
+            ", ".join(t.label for t in templates.values())
+        )
+        return True
+
+    async def watch(self, interval: float):
+        """后台轮询版本签名，变化时热加载"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.load)
+            except Exception as e:
+                logger.warning(f"Prompt template reload failed: {e}")
+
+    def start(self, interval: float):
+        """启动后台热加载（需要在事件循环中调用）"""
+        if interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self.watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "templates": {language: t.label for language, t in self._templates.items()},
+            "reloads": self.reloads,
+        }
+
+
+# 全局实例（单例）
+_registry: Optional[PromptTemplateRegistry] = None
+
+
+def init_prompt_template_registry(db_service) -> PromptTemplateRegistry:
+    """初始化模板注册表并加载一次"""
+    global _registry
+    _registry = PromptTemplateRegistry(db_service)
+    try:
+        db_service.seed_prompt_templates(PERTURB_TEMPLATE_TYPE, BUILTIN_TEMPLATES)
+        _registry.load()
+    except Exception as e:
+        logger.error(f"Failed to load prompt templates, using built-in: {e}")
+    return _registry
+
+
+def get_prompt_template_registry() -> Optional[PromptTemplateRegistry]:
+    """获取模板注册表（未初始化时返回 None）"""
+    return _registry
+
+
+def main():
+    import sys
+    from pathlib import Path
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+    from app.config.settings import get_settings
+    from app.services.database_service import DatabaseService
+
+    parser = argparse.ArgumentParser(description="Destiny 提示词模板工具")
+    parser.add_argument("--db", default=None, help="SQLite 数据库路径（默认读取 DATABASE_URL）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="列出模板")
+
+    publish = sub.add_parser("publish", help="发布新版本模板（自动递增版本号并启用）")
+    publish.add_argument("--language", required=True, choices=["zh", "en"])
+    publish.add_argument("--file", required=True, help="模板内容文件")
+    publish.add_argument("--name", default=None, help="模板名（默认 perturb_<language>）")
+
+    args = parser.parse_args()
+    db_path = args.db
+    if db_path is None:
+        url = get_settings().DATABASE_URL or ""
+        db_path = url.replace('sqlite:///', '') if url.startswith('sqlite:///') else "data/destiny.db"
+    db_service = DatabaseService(db_path)
+
+    if args.command == "list":
+        for row in db_service.list_prompt_templates(PERTURB_TEMPLATE_TYPE):
+            flag = "*" if row["is_active"] else " "
+            print(f"{flag} {row['language']} v{row['version']:<4} {row['name']}")
+        return
+
+    content = Path(args.file).read_text(encoding="utf-8")
+    name = args.name or f"{PERTURB_TEMPLATE_TYPE}_{args.language}"
+    # 发布前先编译，避免把无效模板写进数据库
+    CompiledTemplate(name, args.language, 0, content)
+    version = db_service.publish_prompt_template(name, args.language, PERTURB_TEMPLATE_TYPE, content)
+    print(f"Published {name} v{version}")
+
+
+if __name__ == "__main__":
+    main()
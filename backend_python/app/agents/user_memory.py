@@ -0,0 +1,136 @@
+"""
+Agent 记忆 - 按用户分片的有界记忆
+
+- 每个用户一个定长环形缓冲区（只保留最近 N 条记录）
+- 用户之间按 LRU 淘汰，超过空闲 TTL 的用户整体过期
+- 用户数和总记录数都有硬上限
+"""
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS_USER = "anonymous"
+
+
+class _UserMemory:
+    """单个用户的记忆"""
+
+    __slots__ = ("entries", "attempts", "last_seen")
+
+    def __init__(self, max_entries: int, now: float):
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+        self.attempts = 0  # 本次会话内的算卦次数（不受缓冲区长度限制）
+        self.last_seen = now
+
+
+class UserMemoryStore:
+    """按 user_id 分片的有界记忆"""
+
+    def __init__(
+        self,
+        max_entries_per_user: int = 20,
+        max_users: int = 10000,
+        ttl: int = 3600,
+        max_total_entries: int = 100000
+    ):
+        """
+        Args:
+            max_entries_per_user: 每个用户保留的记录数
+            max_users: 同时保留的用户数上限
+            ttl: 用户空闲多久（秒）后过期，过期后次数重新计算
+            max_total_entries: 所有用户记录总数上限
+        """
+        self.max_entries_per_user = max(1, max_entries_per_user)
+        self.max_users = max(1, max_users)
+        self.ttl = ttl
+        self.max_total_entries = max(1, max_total_entries)
+
+        self._users: "OrderedDict[str, _UserMemory]" = OrderedDict()
+        self._total_entries = 0
+        self.evictions = 0
+
+    def _is_expired(self, memory: _UserMemory, now: float) -> bool:
+        return self.ttl > 0 and now - memory.last_seen > self.ttl
+
+    def _drop(self, user_id: str):
+        memory = self._users.pop(user_id)
+        self._total_entries -= len(memory.entries)
+        self.evictions += 1
+
+    def _evict(self, now: float):
+        """淘汰过期用户，以及超出上限时最久未访问的用户"""
+        while self._users:
+            user_id, memory = next(iter(self._users.items()))
+            over_limit = (
+                len(self._users) > self.max_users
+                or self._total_entries > self.max_total_entries
+            )
+            if not over_limit and not self._is_expired(memory, now):
+                break
+            self._drop(user_id)
+
+    def _touch(self, user_id: str, now: float) -> _UserMemory:
+        memory = self._users.get(user_id)
+        if memory is not None and self._is_expired(memory, now):
+            self._drop(user_id)
+            memory = None
+
+        if memory is None:
+            memory = _UserMemory(self.max_entries_per_user, now)
+            self._users[user_id] = memory
+        else:
+            memory.last_seen = now
+            self._users.move_to_end(user_id)
+        return memory
+
+    def begin_attempt(self, user_id: Optional[str]) -> int:
+        """
+        登记一次新的算卦请求
+
+        在任何 await 之前同步调用，保证同一用户的并发请求拿到不同的次数
+
+        Returns:
+            本次请求之前的历史次数
+        """
+        now = time.time()
+        memory = self._touch(user_id or ANONYMOUS_USER, now)
+        history_count = memory.attempts
+        memory.attempts += 1
+        self._evict(now)
+        return history_count
+
+    def record(self, user_id: Optional[str], entry: Dict[str, Any]):
+        """追加一条记录（环形缓冲区满时丢弃最旧的记录）"""
+        now = time.time()
+        memory = self._touch(user_id or ANONYMOUS_USER, now)
+        if len(memory.entries) < self.max_entries_per_user:
+            self._total_entries += 1
+        memory.entries.append(entry)
+        self._evict(now)
+
+    def get(self, user_id: Optional[str], limit: int = 10) -> List[Dict[str, Any]]:
+        """获取用户最近的记录"""
+        memory = self._users.get(user_id or ANONYMOUS_USER)
+        if memory is None or self._is_expired(memory, time.time()):
+            return []
+        entries = list(memory.entries)
+        return entries[-limit:] if limit > 0 else []
+
+    def clear(self, user_id: Optional[str] = None):
+        """清空指定用户的记忆；不指定用户时清空全部"""
+        if user_id is None:
+            self._users.clear()
+            self._total_entries = 0
+        elif user_id in self._users:
+            self._drop(user_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取记忆占用统计"""
+        return {
+            "users": len(self._users),
+            "entries": self._total_entries,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,358 @@
+"""
+判词变体库 - 离线预生成的微扰判词
+
+母句空间很小（状态 × 语言 × 母句 × 时段 × 次数分桶），可以离线全部预生成，
+线上直接从库文件取变体，不产生任何 LLM 延迟。
+
+文件格式（小端序，可 mmap）：
+    [4s magic][H 格式版本][H 每条目槽位数][I 元数据长度]
+    [元数据 JSON，补齐到 4 字节对齐]
+    [I 偏移表，条目数 × 槽位数 + 1 项]
+    [UTF-8 字符串区]
+
+每个条目的第 0 个槽位保存母句（用于校验），其余槽位保存变体，
+生成失败的变体为空字符串。
+
+用法：
+    python -m app.agents.verdict_bank build --output data/verdict_bank.bin --variants 4
+    python -m app.agents.verdict_bank info data/verdict_bank.bin
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import random
+import struct
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple
+
+from app.agents.fortune_agent import (
+    DestinyState,
+    VerdictPool,
+    InputFeatures,
+    LLMPerturbation,
+    HOUR_BUCKETS,
+    ATTEMPT_BUCKETS,
+)
+
+logger = logging.getLogger(__name__)
+
+BANK_MAGIC = b"DVBK"
+BANK_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHI")
+_OFFSET = struct.Struct("<I")
+
+LANGUAGES = ("zh", "en")
+
+# 各分桶的代表值（生成提示词时使用）
+HOUR_BUCKET_REPRESENTATIVES = {
+    "midnight": 1,
+    "dawn": 6,
+    "morning": 8,
+    "worktime": 14,
+    "evening": 20,
+}
+ATTEMPT_BUCKET_REPRESENTATIVES = {
+    "first": 1,
+    "second": 2,
+    "few": 3,
+    "many": 5,
+}
+REPRESENTATIVE_CHAR_LENGTH = 10
+
+
+class VerdictBank:
+    """只读的判词变体库（基于 mmap）"""
+
+    def __init__(self, path: str):
+        """
+        加载判词库文件
+
+        Args:
+            path: 库文件路径
+
+        Raises:
+            ValueError: 文件格式或版本不正确
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, slots, meta_len = _HEADER.unpack_from(self._buf, 0)
+        if magic != BANK_MAGIC:
+            self.close()
+            raise ValueError(f"Not a verdict bank file: {path}")
+        if version != BANK_FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported verdict bank version {version}, expected {BANK_FORMAT_VERSION}")
+
+        meta_start = _HEADER.size
+        self.meta: Dict = json.loads(bytes(self._buf[meta_start:meta_start + meta_len]).decode("utf-8"))
+        self.slots = slots
+        self.variants_per_entry = slots - 1
+
+        self._offsets_start = _align4(meta_start + meta_len)
+        entry_count = self.meta["entry_count"]
+        self._blob_start = self._offsets_start + (entry_count * slots + 1) * _OFFSET.size
+
+        self._hour_index = {name: i for i, name in enumerate(self.meta["hour_buckets"])}
+        self._attempt_index = {name: i for i, name in enumerate(self.meta["attempt_buckets"])}
+        self._bucket_span = len(self._hour_index) * len(self._attempt_index)
+
+        # (语言, 母句) -> 该母句第一个分桶条目的序号
+        self._mother_index: Dict[Tuple[str, str], int] = {}
+        for base in range(0, entry_count, self._bucket_span):
+            lang = self.meta["entry_languages"][base // self._bucket_span]
+            self._mother_index[(lang, self._read_slot(base, 0))] = base
+
+        logger.info(
+            f"Verdict bank loaded: {path} "
+            f"({entry_count} entries, {self.variants_per_entry} variants each)"
+        )
+
+    def _read_slot(self, entry: int, slot: int) -> str:
+        pos = self._offsets_start + (entry * self.slots + slot) * _OFFSET.size
+        start, end = struct.unpack_from("<II", self._buf, pos)
+        return self._buf[self._blob_start + start:self._blob_start + end].decode("utf-8")
+
+    def get_variants(
+        self,
+        mother_verdict: str,
+        language: str,
+        hour_bucket: str,
+        attempt_bucket: str
+    ) -> List[str]:
+        """获取某个母句在指定分桶下的全部变体（母句不在库中时返回空列表）"""
+        base = self._mother_index.get((language, mother_verdict))
+        hour = self._hour_index.get(hour_bucket)
+        attempt = self._attempt_index.get(attempt_bucket)
+        if base is None or hour is None or attempt is None:
+            return []
+
+        entry = base + hour * len(self._attempt_index) + attempt
+        variants = [self._read_slot(entry, slot) for slot in range(1, self.slots)]
+        return [v for v in variants if v]
+
+    def get_variant(self, mother_verdict: str, features: InputFeatures, language: str) -> Optional[str]:
+        """随机取一条变体，未命中返回 None"""
+        variants = self.get_variants(
+            mother_verdict, language, features.hour_bucket, features.attempt_bucket
+        )
+        if not variants:
+            return None
+        return random.choice(variants)
+
+    def close(self):
+        """释放 mmap 和文件句柄"""
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _align4(n: int) -> int:
+    return (n + 3) & ~3
+
+
+def iter_bank_keys():
+    """
+    按库文件顺序遍历所有组合
+
+    Yields:
+        (状态, 语言, 母句序号, 母句, 时段分桶, 次数分桶)
+    """
+    for state in DestinyState:
+        for language in LANGUAGES:
+            verdicts = VerdictPool.get_verdicts(state, language)
+            for index, mother in enumerate(verdicts):
+                for hour_bucket in HOUR_BUCKETS:
+                    for attempt_bucket in ATTEMPT_BUCKETS:
+                        yield state, language, index, mother, hour_bucket, attempt_bucket
+
+
+def write_verdict_bank(
+    path: str,
+    entries: List[Tuple[str, str, List[str]]],
+    variants_per_entry: int,
+    extra_meta: Optional[Dict] = None
+):
+    """
+    写入判词库文件（先写临时文件再原子替换）
+
+    Args:
+        path: 输出路径
+        entries: 按 iter_bank_keys 顺序排列的 (语言, 母句, 变体列表)
+        variants_per_entry: 每个条目的变体槽位数
+        extra_meta: 额外的元数据
+    """
+    bucket_span = len(HOUR_BUCKETS) * len(ATTEMPT_BUCKETS)
+    if len(entries) % bucket_span != 0:
+        raise ValueError("Entry count must be a multiple of the bucket span")
+
+    slots = variants_per_entry + 1
+    meta = {
+        "entry_count": len(entries),
+        "hour_buckets": list(HOUR_BUCKETS),
+        "attempt_buckets": list(ATTEMPT_BUCKETS),
+        "entry_languages": [entries[i][0] for i in range(0, len(entries), bucket_span)],
+        "built_at": int(time.time()),
+    }
+    if extra_meta:
+        meta.update(extra_meta)
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    blob = bytearray()
+    offsets = [0]
+    for _, mother, variants in entries:
+        padded = (list(variants) + [""] * variants_per_entry)[:variants_per_entry]
+        for text in [mother] + padded:
+            blob += text.encode("utf-8")
+            offsets.append(len(blob))
+
+    header = _HEADER.pack(BANK_MAGIC, BANK_FORMAT_VERSION, slots, len(meta_bytes))
+    head = header + meta_bytes
+    head += b"\0" * (_align4(len(head)) - len(head))
+
+    out = Path(path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(head)
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(blob)
+    tmp.replace(out)
+
+
+async def build_verdict_bank(
+    llm_service,
+    path: str,
+    variants_per_entry: int = 4,
+    concurrency: int = 8
+) -> Dict[str, int]:
+    """
+    调用 LLM 为每个组合生成变体并写入库文件
+
+    Args:
+        llm_service: LLMService 实例
+        path: 输出路径
+        variants_per_entry: 每个组合生成的变体数
+        concurrency: 同时进行的 LLM 调用数
+
+    Returns:
+        生成统计
+    """
+    perturbation = LLMPerturbation(llm_service)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"entries": 0, "variants": 0, "failures": 0}
+
+    async def generate_one(prompt: str, language: str) -> str:
+        async with semaphore:
+            try:
+                text = await llm_service.generate(
+                    prompt=prompt,
+                    language=language,
+                    temperature=0.7,  # 比线上更高，拉开变体差异
+                    max_tokens=100,
+                    raise_on_error=True
+                )
+                return perturbation.clean_output(text)
+            except Exception as e:
+                logger.warning(f"Variant generation failed: {e}")
+                stats["failures"] += 1
+                return ""
+
+    async def generate_entry(state, language, mother, hour_bucket, attempt_bucket):
+        features = InputFeatures(
+            is_empty=False,
+            char_length=REPRESENTATIVE_CHAR_LENGTH,
+            has_question_mark=False,
+            hour=HOUR_BUCKET_REPRESENTATIVES[hour_bucket],
+            attempt_count=ATTEMPT_BUCKET_REPRESENTATIVES[attempt_bucket]
+        )
+        prompt = perturbation.build_prompt(mother, features, language)
+        results = await asyncio.gather(
+            *(generate_one(prompt, language) for _ in range(variants_per_entry))
+        )
+        # 去重，保留顺序
+        variants = list(dict.fromkeys(r for r in results if r))
+        stats["entries"] += 1
+        stats["variants"] += len(variants)
+        return language, mother, variants
+
+    keys = list(iter_bank_keys())
+    logger.info(f"Building verdict bank: {len(keys)} entries x {variants_per_entry} variants")
+    entries = await asyncio.gather(
+        *(generate_entry(state, language, mother, hb, ab)
+          for state, language, _, mother, hb, ab in keys)
+    )
+
+    write_verdict_bank(
+        path,
+        entries,
+        variants_per_entry,
+        extra_meta={"model": getattr(llm_service, "default_model", None)}
+    )
+    logger.info(f"Verdict bank written to {path}: {stats}")
+    return stats
+
+
+# 全局实例
+_verdict_bank: Optional[VerdictBank] = None
+
+
+def init_verdict_bank(path: str) -> Optional[VerdictBank]:
+    """加载判词库，文件不存在或损坏时返回 None"""
+    global _verdict_bank
+    try:
+        _verdict_bank = VerdictBank(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Verdict bank unavailable ({path}): {e}")
+        _verdict_bank = None
+    return _verdict_bank
+
+
+def get_verdict_bank() -> Optional[VerdictBank]:
+    """获取判词库实例"""
+    return _verdict_bank
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Destiny 判词变体库工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="调用 LLM 预生成判词变体库")
+    build.add_argument("--output", default="data/verdict_bank.bin", help="输出文件路径")
+    build.add_argument("--variants", type=int, default=4, help="每个组合的变体数")
+    build.add_argument("--concurrency", type=int, default=8, help="LLM 并发调用数")
+
+    info = sub.add_parser("info", help="查看判词库信息")
+    info.add_argument("path", help="库文件路径")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "build":
+        from app.config.settings import get_settings
+        from app.services.llm_service import LLMService, build_llm_config
+
+        llm_service = LLMService(build_llm_config(get_settings()))
+        stats = asyncio.run(build_verdict_bank(
+            llm_service, args.output, args.variants, args.concurrency
+        ))
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        bank = VerdictBank(args.path)
+        meta = dict(bank.meta)
+        meta.pop("entry_languages", None)
+        meta["variants_per_entry"] = bank.variants_per_entry
+        meta["format_version"] = BANK_FORMAT_VERSION
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()
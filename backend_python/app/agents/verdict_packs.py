@@ -0,0 +1,511 @@
+"""
+判词包 - 外置的判词池文件，内容更新不需要发版和重启
+
+每种语言一个文件 <目录>/<语言>.pack，格式（小端序，可 mmap）：
+    [4s magic][H 格式版本][H 状态数][I 内容版本][I CRC32][I 元数据长度]
+    [元数据 JSON，补齐到 4 字节对齐]
+    [I 每个状态第一条判词的序号，状态数 + 1 项]
+    [I 字符串偏移表，判词数 + 1 项]
+    [UTF-8 字符串区]
+
+CRC32 覆盖文件头之后的全部内容。元数据中的 states 给出各段对应的状态，
+必须恰好覆盖全部 DestinyState。
+
+- 加载时完整校验（魔数、版本、CRC、偏移、UTF-8、每个状态至少一条非空单行判词），
+  校验失败的文件不会生效，继续使用之前的判词池
+- 后台定期检查文件变化，在线程中校验并编译决策表，再在事件循环中一次性替换
+- 预加载语言之外的语言包在第一次请求该语言时才加载
+- 字符串按状态在第一次访问时解码
+
+用法：
+    python -m app.agents.verdict_packs export --language zh --output verdicts_zh.json
+    python -m app.agents.verdict_packs build --language zh --input verdicts_zh.json --output data/verdict_pool/zh.pack
+    python -m app.agents.verdict_packs info data/verdict_pool/zh.pack
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.agents.fortune_agent import (
+    DestinyState,
+    VerdictPool,
+    build_decision_table,
+    install_verdict_pools,
+)
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"DVPL"
+PACK_FORMAT_VERSION = 1
+PACK_SUFFIX = ".pack"
+_HEADER = struct.Struct("<4sHHIII")
+_OFFSET = struct.Struct("<I")
+
+MAX_VERDICT_CHARS = 200
+# 语言代码只允许字母、数字和连字符，避免拼出目录之外的路径
+_LANGUAGE_RE = re.compile(r"[a-z]{2,3}(-[A-Za-z0-9]{2,8})?")
+# 不存在的语言包只记住这么多，超出后清空重新探测
+MAX_MISSING_LANGUAGES = 256
+
+
+def _align4(n: int) -> int:
+    return (n + 3) & ~3
+
+
+class VerdictPack:
+    """单个语言的判词包（基于 mmap，只读）"""
+
+    def __init__(self, path: str, language: Optional[str] = None):
+        """
+        加载并校验判词包
+
+        Args:
+            path: 文件路径
+            language: 期望的语言，与文件元数据不一致时拒绝
+
+        Raises:
+            ValueError: 文件格式、校验和或内容不合法
+            OSError: 文件无法读取
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"Verdict pack too small: {path}")
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        try:
+            self._validate(language)
+        except struct.error as e:
+            self.close()
+            raise ValueError(f"Truncated verdict pack {path}: {e}")
+        except Exception:
+            self.close()
+            raise
+        self._decoded: Dict[DestinyState, List[str]] = {}
+
+    def _validate(self, language: Optional[str]):
+        buf = self._buf
+        magic, version, state_count, content_version, crc, meta_len = _HEADER.unpack_from(buf, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"Not a verdict pack file: {self.path}")
+        if version != PACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported verdict pack version {version}, expected {PACK_FORMAT_VERSION}")
+        if zlib.crc32(buf[_HEADER.size:]) != crc:
+            raise ValueError(f"Checksum mismatch (truncated or corrupted): {self.path}")
+
+        meta_start = _HEADER.size
+        try:
+            self.meta: Dict[str, Any] = json.loads(bytes(buf[meta_start:meta_start + meta_len]).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid verdict pack metadata: {e}")
+        self.language = self.meta.get("language")
+        if language is not None and self.language != language:
+            raise ValueError(f"Verdict pack language {self.language!r} does not match {language!r}")
+        self.version = content_version
+
+        try:
+            states = [DestinyState(value) for value in self.meta.get("states", [])]
+        except ValueError as e:
+            raise ValueError(f"Unknown state in verdict pack: {e}")
+        if len(states) != state_count or set(states) != set(DestinyState):
+            raise ValueError("Verdict pack must contain every state exactly once")
+
+        starts_pos = _align4(meta_start + meta_len)
+        starts = struct.unpack_from(f"<{state_count + 1}I", buf, starts_pos)
+        verdict_count = starts[-1]
+        offsets_pos = starts_pos + (state_count + 1) * _OFFSET.size
+        blob_start = offsets_pos + (verdict_count + 1) * _OFFSET.size
+        if blob_start > len(buf):
+            raise ValueError("Verdict pack offset table exceeds file size")
+        offsets = struct.unpack_from(f"<{verdict_count + 1}I", buf, offsets_pos)
+        if blob_start + offsets[-1] != len(buf):
+            raise ValueError("Verdict pack string area size mismatch")
+        if any(b < a for a, b in zip(starts, starts[1:])) or starts[0] != 0:
+            raise ValueError("Verdict pack state table is not monotonic")
+        if any(b <= a for a, b in zip(offsets, offsets[1:])) or offsets[0] != 0:
+            raise ValueError("Verdict pack contains empty or overlapping verdicts")
+
+        self._ranges: Dict[DestinyState, Tuple[int, int]] = {}
+        for i, state in enumerate(states):
+            if starts[i + 1] == starts[i]:
+                raise ValueError(f"Verdict pack has no verdicts for state {state.value}")
+            self._ranges[state] = (starts[i], starts[i + 1])
+
+        # 逐条检查内容，解码结果不保留（按状态在首次访问时再解码）
+        for i in range(verdict_count):
+            raw = buf[blob_start + offsets[i]:blob_start + offsets[i + 1]]
+            try:
+                text = raw.decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError(f"Verdict #{i} is not valid UTF-8")
+            if not text.strip() or "\n" in text or len(text) > MAX_VERDICT_CHARS:
+                raise ValueError(f"Verdict #{i} must be a single non-empty line of at most {MAX_VERDICT_CHARS} chars")
+
+        self._offsets = offsets
+        self._blob_start = blob_start
+        self.verdict_count = verdict_count
+
+    def get(self, state: DestinyState, default: Optional[List[str]] = None) -> Optional[List[str]]:
+        """某个状态的判词列表（与 dict.get 相同的接口，供 VerdictPool 使用）"""
+        verdicts = self._decoded.get(state)
+        if verdicts is None:
+            span = self._ranges.get(state)
+            if span is None:
+                return default
+            offsets, base = self._offsets, self._blob_start
+            verdicts = [
+                self._buf[base + offsets[i]:base + offsets[i + 1]].decode("utf-8")
+                for i in range(*span)
+            ]
+            self._decoded[state] = verdicts
+        return verdicts
+
+    def __getitem__(self, state: DestinyState) -> List[str]:
+        verdicts = self.get(state)
+        if verdicts is None:
+            raise KeyError(state)
+        return verdicts
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {state.value: self[state] for state in DestinyState}
+
+    def close(self):
+        """释放 mmap 和文件句柄（已解码的判词仍可用）"""
+        if getattr(self, "_buf", None) is not None:
+            self._buf.close()
+            self._buf = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_verdict_pack(
+    path: str,
+    language: str,
+    verdicts: Dict[DestinyState, Sequence[str]],
+    version: int,
+    extra_meta: Optional[Dict[str, Any]] = None
+):
+    """
+    写入判词包（先写临时文件再原子替换，读取方不会看到半个文件）
+
+    Raises:
+        ValueError: 内容不合法（写入后用 VerdictPack 重新校验）
+    """
+    states = list(DestinyState)
+    meta = {
+        "language": language,
+        "states": [state.value for state in states],
+        "created_at": int(time.time()),
+        **(extra_meta or {}),
+    }
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+
+    starts = [0]
+    offsets = [0]
+    blob = bytearray()
+    for state in states:
+        for text in verdicts.get(state, ()):
+            blob += text.encode("utf-8")
+            offsets.append(len(blob))
+        starts.append(len(offsets) - 1)
+
+    body = meta_bytes + b"\0" * (_align4(_HEADER.size + len(meta_bytes)) - _HEADER.size - len(meta_bytes))
+    body += struct.pack(f"<{len(starts)}I", *starts)
+    body += struct.pack(f"<{len(offsets)}I", *offsets)
+    body += bytes(blob)
+    header = _HEADER.pack(PACK_MAGIC, PACK_FORMAT_VERSION, len(states), version, zlib.crc32(body), len(meta_bytes))
+
+    out = Path(path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(body)
+    try:
+        VerdictPack(str(tmp), language).close()
+    except ValueError:
+        tmp.unlink()
+        raise
+    tmp.replace(out)
+
+
+class VerdictPoolStore:
+    """
+    判词包目录：加载、热替换和按需加载
+
+    目录中没有某种语言的判词包时该语言使用内置判词
+    """
+
+    def __init__(self, directory: str, languages: Sequence[str] = ("zh", "en")):
+        """
+        Args:
+            directory: 判词包目录
+            languages: 预加载的语言（参与决策表编译）
+        """
+        self.directory = Path(directory)
+        self.languages = tuple(languages)
+        self._packs: Dict[str, VerdictPack] = {}
+        self._signatures: Dict[str, Optional[Tuple[int, int, int]]] = {}
+        self._missing: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self.swaps = 0
+        self.rejected = 0
+        self.lazy_loads = 0
+
+    def _path(self, language: str) -> Path:
+        return self.directory / f"{language}{PACK_SUFFIX}"
+
+    def _signature(self, language: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self._path(language).stat()
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _open(self, language: str) -> VerdictPack:
+        return VerdictPack(str(self._path(language)), language)
+
+    def prepare(self) -> Optional[Tuple[Dict[str, Any], Any, Dict[str, VerdictPack], Dict[str, Any]]]:
+        """
+        检查文件变化，加载并校验新文件、编译决策表（不生效，可在后台线程执行）
+
+        Returns:
+            没有变化时返回 None，否则返回交给 apply 的结果
+        """
+        packs = dict(self._packs)
+        signatures = dict(self._signatures)
+        opened: List[VerdictPack] = []
+        changed = False
+        for language in dict.fromkeys(self.languages + tuple(self._packs)):
+            signature = self._signature(language)
+            if language in signatures and signature == signatures[language]:
+                continue
+            signatures[language] = signature
+            if signature is None:
+                if packs.pop(language, None) is not None:
+                    logger.warning("Verdict pack %s removed, using built-in verdicts", language)
+                    changed = True
+                continue
+            try:
+                pack = self._open(language)
+            except (OSError, ValueError) as e:
+                self.rejected += 1
+                logger.error(f"Rejected verdict pack {self._path(language)}: {e}")
+                continue
+            packs[language] = pack
+            opened.append(pack)
+            changed = True
+            logger.info("Loaded verdict pack %s v%d (%d verdicts)", language, pack.version, pack.verdict_count)
+
+        if not changed:
+            self._signatures = signatures
+            return None
+        pools: Dict[str, Any] = VerdictPool.builtin_pools()
+        builtin_languages = tuple(pools)
+        pools.update(packs)
+        # 决策表只按内置和预加载语言编译，按需加载的语言池长度不整除时按规则原文计算索引
+        try:
+            table = build_decision_table({
+                lang: pools[lang] for lang in pools
+                if lang in builtin_languages or lang in self.languages
+            })
+        except Exception as e:
+            # 记下签名，文件再次变化前不重复尝试
+            self.rejected += len(opened)
+            self._signatures = {
+                **self._signatures,
+                **{pack.language: signatures[pack.language] for pack in opened}
+            }
+            for pack in opened:
+                pack.close()
+            logger.error(f"Rejected verdict packs {[pack.language for pack in opened]}: decision table compile failed: {e}")
+            return None
+        return pools, table, packs, signatures
+
+    def apply(self, prepared) -> bool:
+        """让 prepare 的结果生效（在事件循环线程调用，判词池和决策表一起替换）"""
+        if prepared is None:
+            return False
+        pools, table, packs, signatures = prepared
+        install_verdict_pools(pools, table)
+        self._packs = packs
+        self._signatures = signatures
+        self.swaps += 1
+        logger.info(
+            "Verdict pools swapped: %s (modulus %d)",
+            ", ".join(f"{lang}@v{pack.version}" for lang, pack in packs.items()) or "built-in",
+            table.modulus
+        )
+        return True
+
+    def reload(self) -> bool:
+        """同步检查并替换（启动时和命令行使用）"""
+        return self.apply(self.prepare())
+
+    def lazy_load(self, language: str) -> Optional[VerdictPack]:
+        """VerdictPool 的按需加载回调：第一次请求某种语言时加载对应判词包"""
+        if language in self._missing or not _LANGUAGE_RE.fullmatch(language):
+            return None
+        pack = self._packs.get(language)
+        if pack is not None:
+            return pack
+        signature = self._signature(language)
+        try:
+            if signature is None:
+                raise FileNotFoundError(str(self._path(language)))
+            pack = self._open(language)
+        except (OSError, ValueError) as e:
+            if signature is not None:
+                self.rejected += 1
+                logger.error(f"Rejected verdict pack {self._path(language)}: {e}")
+            if len(self._missing) >= MAX_MISSING_LANGUAGES:
+                self._missing.clear()
+            self._missing.add(language)
+            return None
+
+        # 只追加这一种语言，决策表不变
+        self._packs = {**self._packs, language: pack}
+        self._signatures[language] = signature
+        VerdictPool._pools = {**VerdictPool._pools, language: pack}
+        self.lazy_loads += 1
+        logger.info("Lazily loaded verdict pack %s v%d", language, pack.version)
+        return pack
+
+    async def watch(self, interval: float):
+        """后台轮询文件变化：线程中校验和编译，事件循环中替换"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._missing.clear()  # 允许之后新增的语言包被按需加载
+                self.apply(await loop.run_in_executor(None, self.prepare))
+            except Exception as e:
+                logger.warning(f"Verdict pack reload failed: {e}")
+
+    def start(self, interval: float):
+        """安装按需加载回调并启动后台热替换（需要在事件循环中调用）"""
+        VerdictPool._lazy_loader = self.lazy_load
+        if interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self.watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if VerdictPool._lazy_loader == self.lazy_load:
+            VerdictPool._lazy_loader = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "packs": {lang: pack.version for lang, pack in self._packs.items()},
+            "swaps": self.swaps,
+            "rejected": self.rejected,
+            "lazy_loads": self.lazy_loads,
+        }
+
+
+# 全局实例
+_verdict_pool_store: Optional[VerdictPoolStore] = None
+
+
+def init_verdict_pool_store(directory: str, languages: Sequence[str] = ("zh", "en")) -> VerdictPoolStore:
+    """初始化判词包目录并加载一次（目录为空或文件无效时使用内置判词）"""
+    global _verdict_pool_store
+    _verdict_pool_store = VerdictPoolStore(directory, languages)
+    try:
+        _verdict_pool_store.reload()
+    except Exception as e:
+        logger.error(f"Failed to load verdict packs, using built-in verdicts: {e}")
+    return _verdict_pool_store
+
+
+def get_verdict_pool_store() -> Optional[VerdictPoolStore]:
+    """获取判词包目录（未配置时返回 None）"""
+    return _verdict_pool_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Destiny 判词包工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="导出内置判词（或已有判词包）为 JSON")
+    export.add_argument("--language", required=True)
+    export.add_argument("--pack", default=None, help="从判词包导出，不指定则导出内置判词")
+    export.add_argument("--output", default="-", help="输出文件（默认标准输出）")
+
+    build = sub.add_parser("build", help="从 JSON 生成判词包")
+    build.add_argument("--language", required=True)
+    build.add_argument("--input", required=True, help='JSON 文件：{"hesitating": ["...", ...], ...}')
+    build.add_argument("--output", required=True, help="输出文件，例如 data/verdict_pool/zh.pack")
+    build.add_argument("--version", type=int, default=None, help="内容版本（默认在已有文件版本上加一）")
+
+    info = sub.add_parser("info", help="查看判词包信息")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if args.pack:
+            pack = VerdictPack(args.pack, args.language)
+            data = pack.to_dict()
+            pack.close()
+        else:
+            pools = VerdictPool.builtin_pools().get(args.language)
+            if pools is None:
+                parser.error(f"No built-in verdicts for language {args.language}")
+            data = {state.value: list(pools[state]) for state in DestinyState}
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        if args.output == "-":
+            print(text)
+        else:
+            Path(args.output).write_text(text + "\n", encoding="utf-8")
+        return
+
+    if args.command == "build":
+        raw = json.loads(Path(args.input).read_text(encoding="utf-8"))
+        verdicts = {DestinyState(key): value for key, value in raw.items()}
+        version = args.version
+        if version is None:
+            version = 1
+            if Path(args.output).exists():
+                try:
+                    previous = VerdictPack(args.output)
+                    version = previous.version + 1
+                    previous.close()
+                except ValueError:
+                    pass
+        write_verdict_pack(args.output, args.language, verdicts, version)
+        print(f"Wrote {args.output} ({args.language} v{version})")
+        return
+
+    pack = VerdictPack(args.path)
+    print(json.dumps({
+        "language": pack.language,
+        "version": pack.version,
+        "format_version": PACK_FORMAT_VERSION,
+        "verdicts": pack.verdict_count,
+        "states": {state.value: len(pack[state]) for state in DestinyState},
+        "created_at": pack.meta.get("created_at"),
+    }, ensure_ascii=False, indent=2))
+    pack.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,45 @@
 """
 算卦API路由
 """
+import json
 import logging
+import math
 import time
 import hashlib
 import uuid
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 
-from app.services.database_service import get_database_service
-from app.agents.fortune_agent import get_fortune_agent
+from app.config.settings import get_settings
+from app.services.async_database import get_async_database_service
+from app.services.cache_service import get_cache_service
+from app.services.share_cache import get_share_cache
+from app.services.write_behind import get_write_behind_queue
+from app.agents.fortune_agent import VerdictPool, get_fortune_agent
 from app.models.user_interaction import UserSession, UserInteraction
 from app.utils.security import get_client_ip, hash_ip, generate_user_id, hash_question
+from app.utils.deadline import Deadline
+from app.utils.structured_logging import log_fields
+from app.utils.rate_limiter import get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 分享文案
+SHARE_TEXTS = {
+    'zh': "我刚算了一卦，有点不舒服。",
+    'en': "I just had my fortune told, and it hit too close to home."
+}
+
 
 class DivineRequest(BaseModel):
     """算卦请求"""
     question: str = Field(..., min_length=0, max_length=200, description="用户问题")
-    language: Optional[str] = Field('zh', description="语言（zh或en）")
+    language: Optional[str] = Field('zh', description="语言（zh、en 或判词包目录中的其他语言）")
     clientId: Optional[str] = Field(None, description="客户端标识")
 
 
@@ -45,6 +61,134 @@ class DivineResponse(BaseModel):
     message: Optional[str] = Field(None, description="消息")
 
 
+class DivineBatchRequest(BaseModel):
+    """批量算卦请求"""
+    questions: List[str] = Field(..., min_length=1, description="用户问题列表")
+    language: Optional[str] = Field('zh', description="语言（zh、en 或判词包目录中的其他语言）")
+    clientId: Optional[str] = Field(None, description="客户端标识")
+
+
+class DivineBatchResponse(BaseModel):
+    """批量算卦响应"""
+    success: bool = Field(..., description="是否成功")
+    data: Optional[List[FortuneResult]] = Field(None, description="结果数据（与请求顺序一致）")
+    error: Optional[str] = Field(None, description="错误信息")
+    message: Optional[str] = Field(None, description="消息")
+
+
+def _writer(db_service):
+    """写入目标：启用写缓冲时入队后立即返回，否则直接写库"""
+    return get_write_behind_queue() or db_service
+
+
+async def _record_session(db_service, user_id: str, ip_hashed: str, user_agent: Optional[str], language: str):
+    """记录/更新用户会话（失败只记日志）"""
+    if not db_service:
+        return
+    try:
+        session = UserSession(
+            user_id=user_id,
+            ip_hash=ip_hashed,
+            first_visit=datetime.now(),
+            last_visit=datetime.now(),
+            visit_count=1,
+            user_agent=user_agent,
+            language=language
+        )
+        await _writer(db_service).save_or_update_session(session)
+    except Exception as e:
+        logger.warning(f"Failed to save session: {e}")
+
+
+async def _record_interaction(
+    db_service,
+    user_id: str,
+    question: str,
+    result_text: str,
+    language: str,
+    is_night: bool,
+    response_time: int,
+    result_id: str,
+    prompt_version: Optional[int] = None
+) -> bool:
+    """
+    记录用户交互（失败只记日志）
+    
+    Returns:
+        是否保存成功（启用写缓冲时为是否已入队）
+    """
+    if not db_service:
+        return False
+    try:
+        interaction = UserInteraction(
+            user_id=user_id,
+            session_id=None,
+            question=question,
+            question_hash=hash_question(question),
+            result=result_text,
+            language=language,
+            category="general",
+            is_night=is_night,
+            timestamp=datetime.now(),
+            response_time_ms=response_time,
+            llm_model="fortune_agent",
+            result_id=result_id,
+            prompt_version=prompt_version
+        )
+        await _writer(db_service).save_interaction(interaction)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to save interaction: {e}")
+        return False
+
+
+RATE_LIMIT_MESSAGES = {
+    'zh': '算得太频繁了，命运需要一点时间',
+    'en': 'Too many readings, destiny needs a moment'
+}
+
+
+def _resolve_language(language: Optional[str]) -> str:
+    """
+    请求语言：有判词池的语言原样使用（包括判词包目录中按需加载的新语言），否则回退中文
+    
+    分享文案和错误提示只有中英文，其他语言在取用时各自回退
+    """
+    if language and VerdictPool.has_language(language):
+        return language
+    return 'zh'
+
+
+async def _rate_limited(user_id: str, language: str, cost: int = 1) -> Optional[JSONResponse]:
+    """
+    扣减用户的令牌
+    
+    Returns:
+        超出限额时返回 429 响应（带 Retry-After），否则返回 None
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return None
+    allowed, retry_after = await limiter.acquire_async(user_id, cost)
+    if allowed:
+        return None
+    logger.info("Rate limited user: %s (retry after %.1fs)", user_id, retry_after)
+    return JSONResponse(
+        status_code=429,
+        content=DivineResponse(
+            success=False,
+            error="RATE_LIMITED",
+            message=RATE_LIMIT_MESSAGES.get(language, RATE_LIMIT_MESSAGES['zh'])
+        ).model_dump(),
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.post("/divine", response_model=DivineResponse)
 async def divine(request: DivineRequest, http_request: Request):
     """
@@ -53,11 +197,12 @@ async def divine(request: DivineRequest, http_request: Request):
     接收用户问题，返回命运判决
     """
     start_time = time.time()
+    deadline = Deadline.from_ms(get_settings().DIVINE_DEADLINE_MS)
     
     try:
         # 获取服务实例
         agent = get_fortune_agent()
-        db_service = get_database_service()
+        db_service = get_async_database_service()
         
         # 获取用户信息（基于IP）
         client_ip = get_client_ip(http_request)
@@ -65,7 +210,11 @@ async def divine(request: DivineRequest, http_request: Request):
         user_id = generate_user_id(ip_hashed)
         user_agent = http_request.headers.get("User-Agent")
         
-        logger.info(f"Request from user: {user_id} (IP hash: {ip_hashed[:8]}...)")
+        limited = await _rate_limited(user_id, request.language)
+        if limited is not None:
+            return limited
+        
+        logger.info("Request from user: %s", user_id)
         
         # 处理问题：超长直接截取，不报错
         question = request.question.strip() if request.question else ''
@@ -74,32 +223,20 @@ async def divine(request: DivineRequest, http_request: Request):
         
         # 使用前端传递的语言设置（界面语言决定回复语言）
         # 如果未指定或无效，使用默认值 'zh'
-        if not request.language or request.language not in ['zh', 'en']:
-            request.language = 'zh'  # 默认中文
+        request.language = _resolve_language(request.language)
         
         # 记录/更新用户会话
-        if db_service:
-            try:
-                session = UserSession(
-                    user_id=user_id,
-                    ip_hash=ip_hashed,
-                    first_visit=datetime.now(),
-                    last_visit=datetime.now(),
-                    visit_count=1,
-                    user_agent=user_agent,
-                    language=request.language
-                )
-                db_service.save_or_update_session(session)
-            except Exception as e:
-                logger.warning(f"Failed to save session: {e}")
+        await _record_session(db_service, user_id, ip_hashed, user_agent, request.language)
         
-        logger.info(f"Generating fortune for question: {question[:50]}... (lang: {request.language})")
+        logger.debug("Generating fortune for question: %.50s (lang: %s)", question, request.language)
         
         # 使用 Agent 生成结果
         agent_result = await agent.execute(
             question=question,
             language=request.language,
-            enable_reasoning=False
+            enable_reasoning=False,
+            user_id=user_id,
+            deadline=deadline
         )
         result_text = agent_result['result']
         
@@ -111,35 +248,16 @@ async def divine(request: DivineRequest, http_request: Request):
         result_id = str(uuid.uuid4())[:8]
         
         # 生成分享文案
-        share_texts = {
-            'zh': "我刚算了一卦，有点不舒服。",
-            'en': "I just had my fortune told, and it hit too close to home."
-        }
-        share_text = share_texts.get(request.language, share_texts['zh'])
+        share_text = SHARE_TEXTS.get(request.language, SHARE_TEXTS['zh'])
         
         # 计算响应时间
         response_time = int((time.time() - start_time) * 1000)
         
         # 记录用户交互
-        if db_service:
-            try:
-                interaction = UserInteraction(
-                    user_id=user_id,
-                    session_id=None,
-                    question=question,
-                    question_hash=hash_question(question),
-                    result=result_text,
-                    language=request.language,
-                    category="general",
-                    is_night=is_night,
-                    timestamp=datetime.now(),
-                    response_time_ms=response_time,
-                    llm_model="fortune_agent",
-                    result_id=result_id
-                )
-                db_service.save_interaction(interaction)
-            except Exception as e:
-                logger.warning(f"Failed to save interaction: {e}")
+        saved = await _record_interaction(
+            db_service, user_id, question, result_text, request.language,
+            is_night, response_time, result_id, agent_result.get('prompt_version')
+        )
         
         # 构建结果
         fortune_result = FortuneResult(
@@ -150,8 +268,13 @@ async def divine(request: DivineRequest, http_request: Request):
             shareText=share_text,
             category="general"
         )
+        if saved:
+            _cache_shared_result(fortune_result)
         
-        logger.info(f"Fortune generated successfully in {response_time}ms for user: {user_id}")
+        logger.info(
+            "Fortune generated",
+            extra=log_fields(user_id=user_id, response_ms=response_time, language=request.language)
+        )
         
         return DivineResponse(
             success=True,
@@ -173,11 +296,284 @@ async def divine(request: DivineRequest, http_request: Request):
         )
 
 
+@router.post("/divine/stream")
+async def divine_stream(request: DivineRequest, http_request: Request):
+    """
+    流式算卦接口（Server-Sent Events）
+    
+    事件顺序：
+    - verdict：查表选出的母句，立即返回
+    - token：LLM 微扰片段，随生成逐个返回
+    - done：完整结果（结构同 FortuneResult）
+    - error：出错时返回，随后结束
+    """
+    start_time = time.time()
+    deadline = Deadline.from_ms(get_settings().DIVINE_DEADLINE_MS)
+    language = _resolve_language(request.language)
+    
+    agent = get_fortune_agent()
+    db_service = get_async_database_service()
+    
+    client_ip = get_client_ip(http_request)
+    ip_hashed = hash_ip(client_ip)
+    user_id = generate_user_id(ip_hashed)
+    user_agent = http_request.headers.get("User-Agent")
+    question = (request.question or '').strip()[:200]
+    
+    limited = await _rate_limited(user_id, language)
+    if limited is not None:
+        return limited
+    
+    logger.info("Stream request from user: %s (lang: %s)", user_id, language)
+    
+    async def event_stream():
+        try:
+            final_text = None
+            prompt_version = None
+            async for event in agent.execute_stream(
+                question=question,
+                language=language,
+                user_id=user_id,
+                deadline=deadline
+            ):
+                if event["event"] == "verdict":
+                    yield _sse("verdict", {"text": event["text"], "language": language})
+                elif event["event"] == "token":
+                    yield _sse("token", {"text": event["text"]})
+                else:
+                    final_text = event["result"]
+                    prompt_version = event.get("prompt_version")
+            
+            hour = datetime.now().hour
+            is_night = hour >= 23 or hour < 3
+            result_id = str(uuid.uuid4())[:8]
+            response_time = int((time.time() - start_time) * 1000)
+            
+            # 判词全部发出后再写库，数据库写入不计入首字节时间
+            await _record_session(db_service, user_id, ip_hashed, user_agent, language)
+            saved = await _record_interaction(
+                db_service, user_id, question, final_text, language,
+                is_night, response_time, result_id, prompt_version
+            )
+            
+            fortune_result = FortuneResult(
+                id=result_id,
+                text=final_text,
+                language=language,
+                timestamp=int(time.time() * 1000),
+                shareText=SHARE_TEXTS.get(language, SHARE_TEXTS['zh']),
+                category="general"
+            )
+            if saved:
+                _cache_shared_result(fortune_result)
+            logger.info(
+                "Fortune streamed",
+                extra=log_fields(user_id=user_id, response_ms=response_time, language=language)
+            )
+            yield _sse("done", fortune_result.model_dump())
+            
+        except Exception as e:
+            logger.error(f"Divine stream error: {str(e)}", exc_info=True)
+            error_messages = {
+                'zh': '命运之轮暂时卡住了，请稍后再试',
+                'en': 'The wheel of destiny is stuck, please try again later'
+            }
+            yield _sse("error", {
+                "error": "INTERNAL_ERROR",
+                "message": error_messages.get(language, error_messages['zh'])
+            })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/divine/batch", response_model=DivineBatchResponse)
+async def divine_batch(request: DivineBatchRequest, http_request: Request):
+    """
+    批量算卦接口
+    
+    一次请求处理多个问题：特征、状态和母句一次算完，LLM 微扰有界并发，
+    会话和交互记录在一个事务中写入
+    """
+    start_time = time.time()
+    settings = get_settings()
+    deadline = Deadline.from_ms(settings.DIVINE_BATCH_DEADLINE_MS)
+    language = _resolve_language(request.language)
+    
+    # 整批按问题数全额扣减令牌，批大小不能超过限流桶容量（否则一次请求就能绕过限额）
+    max_size = settings.DIVINE_BATCH_MAX_SIZE
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        max_size = min(max_size, int(limiter.capacity))
+    if len(request.questions) > max_size:
+        return DivineBatchResponse(
+            success=False,
+            error="BATCH_TOO_LARGE",
+            message=f"At most {max_size} questions per batch"
+        )
+    
+    try:
+        agent = get_fortune_agent()
+        db_service = get_async_database_service()
+        
+        # 获取用户信息（基于IP），整批只算一次
+        client_ip = get_client_ip(http_request)
+        ip_hashed = hash_ip(client_ip)
+        user_id = generate_user_id(ip_hashed)
+        user_agent = http_request.headers.get("User-Agent")
+        
+        # 整批按问题数扣减令牌
+        limited = await _rate_limited(user_id, language, cost=max(1, len(request.questions)))
+        if limited is not None:
+            return limited
+        
+        # 处理问题：超长直接截取，不报错
+        questions = [(q or '').strip()[:200] for q in request.questions]
+        
+        logger.info("Batch request from user: %s, %d questions (lang: %s)", user_id, len(questions), language)
+        
+        agent_results = await agent.execute_many(
+            questions=questions,
+            language=language,
+            enable_reasoning=False,
+            user_id=user_id,
+            deadline=deadline
+        )
+        
+        now = datetime.now()
+        is_night = now.hour >= 23 or now.hour < 3
+        timestamp_ms = int(time.time() * 1000)
+        share_text = SHARE_TEXTS.get(language, SHARE_TEXTS['zh'])
+        response_time = int((time.time() - start_time) * 1000)
+        
+        fortune_results = []
+        interactions = []
+        for question, agent_result in zip(questions, agent_results):
+            result_id = str(uuid.uuid4())[:8]
+            fortune_results.append(FortuneResult(
+                id=result_id,
+                text=agent_result['result'],
+                language=language,
+                timestamp=timestamp_ms,
+                shareText=share_text,
+                category="general"
+            ))
+            interactions.append(UserInteraction(
+                user_id=user_id,
+                session_id=None,
+                question=question,
+                question_hash=hash_question(question),
+                result=agent_result['result'],
+                language=language,
+                category="general",
+                is_night=is_night,
+                timestamp=now,
+                response_time_ms=response_time,
+                llm_model="fortune_agent",
+                result_id=result_id,
+                prompt_version=agent_result.get('prompt_version')
+            ))
+        
+        # 会话和交互记录一个事务写入（启用写缓冲时入队）
+        if db_service:
+            try:
+                session = UserSession(
+                    user_id=user_id,
+                    ip_hash=ip_hashed,
+                    first_visit=now,
+                    last_visit=now,
+                    visit_count=1,
+                    user_agent=user_agent,
+                    language=language
+                )
+                await _writer(db_service).save_batch(session, interactions)
+                for fortune_result in fortune_results:
+                    _cache_shared_result(fortune_result)
+            except Exception as e:
+                logger.warning(f"Failed to save batch: {e}")
+        
+        logger.info(
+            "Batch generated",
+            extra=log_fields(user_id=user_id, size=len(questions), response_ms=response_time, language=language)
+        )
+        
+        return DivineBatchResponse(
+            success=True,
+            data=fortune_results
+        )
+        
+    except Exception as e:
+        logger.error(f"Divine batch endpoint error: {str(e)}", exc_info=True)
+        error_messages = {
+            'zh': '命运之轮暂时卡住了，请稍后再试',
+            'en': 'The wheel of destiny is stuck, please try again later'
+        }
+        return DivineBatchResponse(
+            success=False,
+            error="INTERNAL_ERROR",
+            message=error_messages.get(language, error_messages['zh'])
+        )
+
+
+async def _load_shared_result(db_service, share_id: str) -> Optional[FortuneResult]:
+    """从共享缓存或数据库加载分享结果（不存在时返回 None）"""
+    # 先查共享缓存，同一分享ID的并发请求只查一次数据库
+    cache = get_cache_service()
+    if cache is not None:
+        interaction = await cache.get_or_set(
+            f"share:{share_id}",
+            lambda: db_service.get_interaction_by_result_id(share_id),
+            ttl=get_settings().REDIS_CACHE_TTL
+        )
+    else:
+        interaction = await db_service.get_interaction_by_result_id(share_id)
+    
+    if not interaction:
+        return None
+    
+    # 生成分享文案
+    language = interaction.get('language', 'zh')
+    share_text = SHARE_TEXTS.get(language, SHARE_TEXTS['zh'])
+    
+    # 处理时间戳
+    try:
+        if isinstance(interaction['timestamp'], str):
+            # SQLite返回的是ISO格式字符串
+            timestamp_dt = datetime.fromisoformat(interaction['timestamp'].replace('Z', '+00:00'))
+            timestamp_ms = int(timestamp_dt.timestamp() * 1000)
+        else:
+            timestamp_ms = int(time.time() * 1000)
+    except Exception as e:
+        logger.warning(f"Error parsing timestamp: {e}, using current time")
+        timestamp_ms = int(time.time() * 1000)
+    
+    return FortuneResult(
+        id=share_id,
+        text=interaction['result'],
+        language=language,
+        timestamp=timestamp_ms,
+        shareText=share_text,
+        category=interaction.get('category', 'general')
+    )
+
+
+def _cache_shared_result(fortune_result: FortuneResult):
+    """把刚生成并已保存的结果写入分享缓存"""
+    share_cache = get_share_cache()
+    if share_cache is not None:
+        share_cache.put(fortune_result.id, fortune_result)
+
+
 @router.get("/share/{share_id}", response_model=DivineResponse)
 async def get_shared_result(share_id: str):
     """
     根据分享ID获取算卦结果
     
+    分享结果不会变化，热门分享由进程内缓存直接返回
+    
     Args:
         share_id: 分享ID（8位UUID）
         
@@ -185,7 +581,7 @@ async def get_shared_result(share_id: str):
         算卦结果数据
     """
     try:
-        db_service = get_database_service()
+        db_service = get_async_database_service()
         
         if not db_service:
             logger.warning("Database service not available")
@@ -195,10 +591,16 @@ async def get_shared_result(share_id: str):
                 message="分享服务暂时不可用"
             )
         
-        # 查询分享结果
-        interaction = db_service.get_interaction_by_result_id(share_id)
+        # 查询分享结果（进程内缓存 -> 共享缓存 -> 数据库）
+        share_cache = get_share_cache()
+        if share_cache is not None:
+            fortune_result = await share_cache.get(
+                share_id, lambda: _load_shared_result(db_service, share_id)
+            )
+        else:
+            fortune_result = await _load_shared_result(db_service, share_id)
         
-        if not interaction:
+        if fortune_result is None:
             logger.warning(f"Share ID not found: {share_id}")
             error_messages = {
                 'zh': '分享链接已失效或不存在',
@@ -211,37 +613,7 @@ async def get_shared_result(share_id: str):
                 message=error_messages.get('zh', 'Share link not found')
             )
         
-        # 生成分享文案
-        share_texts = {
-            'zh': "我刚算了一卦，有点不舒服。",
-            'en': "I just had my fortune told, and it hit too close to home."
-        }
-        language = interaction.get('language', 'zh')
-        share_text = share_texts.get(language, share_texts['zh'])
-        
-        # 处理时间戳
-        try:
-            if isinstance(interaction['timestamp'], str):
-                # SQLite返回的是ISO格式字符串
-                timestamp_dt = datetime.fromisoformat(interaction['timestamp'].replace('Z', '+00:00'))
-                timestamp_ms = int(timestamp_dt.timestamp() * 1000)
-            else:
-                timestamp_ms = int(time.time() * 1000)
-        except Exception as e:
-            logger.warning(f"Error parsing timestamp: {e}, using current time")
-            timestamp_ms = int(time.time() * 1000)
-        
-        # 构建结果
-        fortune_result = FortuneResult(
-            id=share_id,
-            text=interaction['result'],
-            language=language,
-            timestamp=timestamp_ms,
-            shareText=share_text,
-            category=interaction.get('category', 'general')
-        )
-        
-        logger.info(f"Retrieved shared result for share_id: {share_id}")
+        logger.info("Retrieved shared result for share_id: %s", share_id)
         
         return DivineResponse(
             success=True,
@@ -1,19 +1,37 @@
 """
 统计数据API路由
 """
+import hmac
 import logging
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 
-from app.services.database_service import get_database_service
+from app.config.settings import get_settings
+from app.services.async_database import get_async_database_service
+from app.services.cache_service import get_cache_service
+from app.services.share_cache import get_share_cache
+from app.services.write_behind import get_write_behind_queue
+from app.services.llm_service import get_llm_service
 from app.utils.security import get_client_ip, hash_ip, generate_user_id
+from app.utils.structured_logging import get_logging_stats
+from app.agents.prompt_templates import get_prompt_template_registry
+from app.agents.verdict_packs import get_verdict_pool_store
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+async def _cached_stats(key: str, loader):
+    """统计结果短时间缓存（CACHE_STATS_TTL），并发请求只查一次数据库"""
+    cache = get_cache_service()
+    ttl = get_settings().CACHE_STATS_TTL
+    if cache is None or ttl <= 0:
+        return await loader()
+    return await cache.get_or_set(key, loader, ttl=ttl)
+
+
 class UserStatsResponse(BaseModel):
     """用户统计响应"""
     success: bool
@@ -43,7 +61,7 @@ async def get_user_stats(request: Request):
     基于IP地址识别用户
     """
     try:
-        db_service = get_database_service()
+        db_service = get_async_database_service()
         if not db_service:
             return UserStatsResponse(
                 success=False,
@@ -56,7 +74,7 @@ async def get_user_stats(request: Request):
         user_id = generate_user_id(ip_hashed)
         
         # 获取统计数据
-        stats = db_service.get_user_stats(user_id)
+        stats = await _cached_stats(f"stats:user:{user_id}", lambda: db_service.get_user_stats(user_id))
         
         if not stats:
             return UserStatsResponse(
@@ -89,7 +107,7 @@ async def get_user_recent_interactions(request: Request, limit: int = 10):
         limit: 返回记录数量（默认10条，最多50条）
     """
     try:
-        db_service = get_database_service()
+        db_service = get_async_database_service()
         if not db_service:
             return RecentInteractionsResponse(
                 success=False,
@@ -105,7 +123,7 @@ async def get_user_recent_interactions(request: Request, limit: int = 10):
         user_id = generate_user_id(ip_hashed)
         
         # 获取最近交互
-        interactions = db_service.get_recent_interactions(user_id, limit)
+        interactions = await db_service.get_recent_interactions(user_id, limit)
         
         return RecentInteractionsResponse(
             success=True,
@@ -128,7 +146,7 @@ async def get_global_stats():
     返回系统整体使用情况
     """
     try:
-        db_service = get_database_service()
+        db_service = get_async_database_service()
         if not db_service:
             return GlobalStatsResponse(
                 success=False,
@@ -136,7 +154,7 @@ async def get_global_stats():
             )
         
         # 获取全局统计
-        stats = db_service.get_global_stats()
+        stats = await _cached_stats("stats:global", db_service.get_global_stats)
         
         return GlobalStatsResponse(
             success=True,
@@ -149,3 +167,78 @@ async def get_global_stats():
             success=False,
             error=str(e)
         )
+
+
+@router.get("/stats/llm", response_model=GlobalStatsResponse)
+async def get_llm_stats():
+    """
+    获取 LLM 服务运行状态
+    
+    包括各模型熔断器状态、对冲请求、请求合并和连接池统计
+    """
+    try:
+        llm_service = get_llm_service()
+        return GlobalStatsResponse(
+            success=True,
+            data={
+                'breakers': llm_service.get_breaker_states(),
+                'hedging': llm_service.get_hedge_stats(),
+                'single_flight': llm_service.get_single_flight_stats(),
+                'http_pool': llm_service.get_pool_stats()
+            }
+        )
+        
+    except Exception as e:
+        logger.error(f"Error getting LLM stats: {str(e)}", exc_info=True)
+        return GlobalStatsResponse(
+            success=False,
+            error=str(e)
+        )
+
+
+def require_stats_api_key(x_api_key: Optional[str] = Header(None)):
+    """
+    校验运维统计接口的访问密钥（X-API-Key 请求头）
+    
+    未配置 STATS_API_KEY 时接口不可用
+    """
+    expected = get_settings().STATS_API_KEY
+    if not expected:
+        raise HTTPException(status_code=403, detail="System stats are disabled")
+    if not x_api_key or not hmac.compare_digest(x_api_key.encode('utf-8'), expected.encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+
+@router.get("/stats/system", response_model=GlobalStatsResponse, dependencies=[Depends(require_stats_api_key)])
+async def get_system_stats():
+    """
+    获取服务内部运行状态（需要 X-API-Key）
+    
+    包括提示词模板、判词包、共享缓存、分享缓存、数据库连接、写缓冲和日志队列统计
+    """
+    try:
+        db_service = get_async_database_service()
+        cache = get_cache_service()
+        share_cache = get_share_cache()
+        write_behind = get_write_behind_queue()
+        prompt_templates = get_prompt_template_registry()
+        verdict_pool_store = get_verdict_pool_store()
+        return GlobalStatsResponse(
+            success=True,
+            data={
+                'prompt_templates': prompt_templates.get_stats() if prompt_templates else None,
+                'verdict_packs': verdict_pool_store.get_stats() if verdict_pool_store else None,
+                'cache': cache.get_stats() if cache else None,
+                'share_cache': share_cache.get_stats() if share_cache else None,
+                'database': db_service.get_stats() if db_service else None,
+                'write_behind': write_behind.get_stats() if write_behind else None,
+                'logging': get_logging_stats()
+            }
+        )
+        
+    except Exception as e:
+        logger.error(f"Error getting system stats: {str(e)}", exc_info=True)
+        return GlobalStatsResponse(
+            success=False,
+            error=str(e)
+        )
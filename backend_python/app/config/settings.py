@@ -29,10 +29,23 @@ class Settings(BaseSettings):
     
     # 数据库配置
     DATABASE_URL: Optional[str] = None
+    DB_READER_POOL_SIZE: int = 4  # SQLite 读连接数（另有一个写连接）
+    DB_MMAP_SIZE_MB: int = 64  # 每个连接的内存映射大小，0 表示不使用
+    DB_CACHE_SIZE_KB: int = 8192  # 每个连接的页缓存大小
+    DB_BUSY_TIMEOUT: float = 5.0  # 等待其他进程释放写锁的时间（秒）
+    WRITE_BEHIND_ENABLED: bool = True  # 会话和交互记录入队后批量写入
+    WRITE_BEHIND_QUEUE_SIZE: int = 10000  # 队列上限，写满时请求等待入队
+    WRITE_BEHIND_BATCH_SIZE: int = 500  # 每个事务最多写入的记录数
+    WRITE_BEHIND_FLUSH_INTERVAL: float = 0.1  # 凑批等待时间（秒）
+    WRITE_BEHIND_SESSION_INTERVAL: float = 5.0  # 同一用户的访问合并后写入的间隔（秒）
     
     # Redis配置
     REDIS_URL: str = "redis://localhost:6379"
     REDIS_CACHE_TTL: int = 3600  # 1小时
+    REDIS_TIMEOUT: float = 0.2  # 连接和读写超时（秒），超时后改用进程内缓存
+    CACHE_ENABLED: bool = True  # 分享结果、统计和微扰结果的共享缓存
+    CACHE_STATS_TTL: int = 10  # 统计接口结果缓存时间（秒）
+    CACHE_MEMORY_MAX_ENTRIES: int = 10000  # 进程内后备缓存的最大条目数
     
     # LLM配置
     LLM_PROVIDER: str = "openai"  # openai, anthropic, azure, perfxcloud等
@@ -42,6 +55,76 @@ class Settings(BaseSettings):
     LLM_MAX_CONTEXT_TOKENS: int = 128000
     LLM_TEMPERATURE: float = 0.7
     LLM_MAX_TOKENS: int = 300
+    LLM_TIMEOUT: float = 30.0  # 单次上游调用超时上限（秒），实际超时不超过请求剩余预算
+    
+    # LLM 对冲请求（主模型超过分位数延迟未返回时并行请求备用模型）
+    LLM_HEDGE_ENABLED: bool = False  # 需要 FALLBACK_LLM_MODEL 为不同的模型
+    LLM_HEDGE_PERCENTILE: float = 0.95  # 以主模型延迟的该分位数作为对冲延迟
+    LLM_HEDGE_MIN_DELAY: float = 0.2  # 对冲延迟下限（秒）
+    LLM_HEDGE_DEFAULT_DELAY: float = 2.0  # 延迟样本不足时使用的对冲延迟（秒）
+    
+    # LLM 熔断器（按模型）
+    LLM_BREAKER_ENABLED: bool = True
+    LLM_BREAKER_WINDOW: int = 20  # 滑动窗口（最近 N 次调用）
+    LLM_BREAKER_MIN_CALLS: int = 10  # 窗口内最少调用数
+    LLM_BREAKER_FAILURE_RATE: float = 0.5  # 错误率阈值
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 10.0  # 慢调用阈值（秒）
+    LLM_BREAKER_SLOW_CALL_RATE: float = 0.8  # 慢调用率阈值
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0  # 打开后的冷却时间（秒）
+    LLM_BREAKER_HALF_OPEN_PROBES: int = 1  # 半开状态的探测请求数
+    
+    # 相同的并发 LLM 调用（提示词、模型、生成参数都相同）只发一次上游请求
+    LLM_SINGLE_FLIGHT_ENABLED: bool = True
+    
+    # 上游 HTTP 连接池（启动时预热，所有 LLM 调用共享）
+    LLM_HTTP_POOL_ENABLED: bool = True
+    LLM_HTTP_POOL_SIZE: int = 20  # 最大连接数
+    LLM_HTTP_KEEPALIVE: int = 10  # 最多保持的空闲连接数
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0  # 空闲连接保持时间（秒）
+    LLM_HTTP2: bool = True  # 启用 HTTP/2（需要 h2）
+    LLM_HTTP_WARM_CONNECTIONS: int = 2  # 启动时预先建立的连接数
+    
+    # 微扰结果缓存（内存 LRU + 可选磁盘缓存）
+    PERTURBATION_CACHE_ENABLED: bool = True
+    PERTURBATION_CACHE_MAX_ENTRIES: int = 2048
+    PERTURBATION_CACHE_TTL: int = 86400  # 24小时
+    PERTURBATION_CACHE_VARIANTS: int = 4  # 每个条目积累的变体数
+    PERTURBATION_CACHE_DISK_PATH: Optional[str] = None  # 例如 data/perturbation_cache.db
+    
+    # 分享结果缓存（进程内 LRU + 负缓存 + 布隆过滤器）
+    SHARE_CACHE_ENABLED: bool = True
+    SHARE_CACHE_MAX_ENTRIES: int = 50000
+    SHARE_CACHE_NEGATIVE_TTL: float = 60.0  # 不存在的分享ID缓存时间（秒）
+    SHARE_CACHE_BLOOM_CAPACITY: int = 1000000  # 布隆过滤器初始容量，超出后自动扩容
+    SHARE_CACHE_SYNC_INTERVAL: float = 1.0  # 布隆过滤器增量同步的最小间隔（秒）
+    
+    # 判词来源：live（实时 LLM 微扰）或 bank（预生成判词库）
+    VERDICT_SOURCE: str = "live"
+    VERDICT_BANK_PATH: str = "data/verdict_bank.bin"
+    VERDICT_BANK_LIVE_REFRESH_RATE: float = 0.0  # bank 模式下仍走实时微扰的比例
+    
+    # 判词包（外置判词池，热替换）
+    VERDICT_POOL_DIR: str = ""  # 判词包目录（<语言>.pack），为空时只用内置判词
+    VERDICT_POOL_LANGUAGES: str = "zh,en"  # 启动时预加载的语言，其他语言首次请求时加载
+    VERDICT_POOL_RELOAD_INTERVAL: float = 10.0  # 检查文件变化的间隔（秒），0 表示只在启动时加载
+    
+    # 微扰提示词模板（数据库中的版本化模板，热加载）
+    PROMPT_TEMPLATES_ENABLED: bool = True
+    PROMPT_TEMPLATE_RELOAD_INTERVAL: float = 30.0  # 检查新版本的间隔（秒），0 表示只在启动时加载
+    
+    # Agent 记忆（按用户分片，有界）
+    AGENT_MEMORY_PER_USER: int = 20  # 每个用户保留的记录数
+    AGENT_MEMORY_MAX_USERS: int = 10000
+    AGENT_MEMORY_MAX_ENTRIES: int = 100000  # 所有用户记录总数上限
+    AGENT_MEMORY_TTL: int = 3600  # 用户空闲过期时间（秒）
+    
+    # 请求延迟预算（毫秒），/divine 的硬性 SLO
+    DIVINE_DEADLINE_MS: int = 5000
+    DIVINE_BATCH_DEADLINE_MS: int = 30000
+    
+    # 批量算卦
+    DIVINE_BATCH_MAX_SIZE: int = 100  # 单次批量请求的问题数上限
+    DIVINE_BATCH_CONCURRENCY: int = 8  # 批量请求中同时进行的 LLM 微扰数
     
     # 旧版配置（保留向后兼容）
     DEFAULT_LLM_MODEL: Optional[str] = None
@@ -58,9 +141,16 @@ class Settings(BaseSettings):
     AZURE_API_BASE: Optional[str] = None
     AZURE_API_VERSION: Optional[str] = None
     
+    # 运维统计接口 /stats/system 的访问密钥（X-API-Key 请求头），为空时该接口不可用
+    STATS_API_KEY: Optional[str] = None
+    
     # 速率限制
     RATE_LIMIT_ENABLED: bool = True
     RATE_LIMIT_PER_MINUTE: int = 10
+    RATE_LIMIT_BURST: int = 0  # 桶容量，0 表示等于每分钟次数
+    RATE_LIMIT_BACKEND: str = "memory"  # memory（单 worker）或 sqlite（多 worker 共享）
+    RATE_LIMIT_SQLITE_PATH: str = "data/rate_limit.db"
+    RATE_LIMIT_IDLE_TTL: float = 600.0  # 空闲用户的桶保留时间（秒）
     
     # CORS配置
     CORS_ORIGINS: list = [
@@ -71,6 +161,9 @@ class Settings(BaseSettings):
     
     # 日志配置
     LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"  # text 或 json
+    LOG_SAMPLE_RATES: str = ""  # INFO/DEBUG 采样率，例如 "app.api.divine=0.1,app.services=0.5"
+    LOG_QUEUE_SIZE: int = 10000  # 日志队列上限，满了丢弃（不阻塞请求）
     
     class Config:
         env_file = ".env"
@@ -15,21 +15,34 @@ sys.path.insert(0, str(backend_path))
 from __version__ import get_full_version
 
 from app.config.settings import get_settings, validate_settings
-from app.services.llm_service import init_llm_service, get_llm_service
-from app.services.database_service import init_database_service
+from app.services.llm_service import init_llm_service, get_llm_service, build_llm_config
+from app.services.database_service import init_database_service, close_database_service
+from app.agents.prompt_templates import init_prompt_template_registry
+from app.services.perturbation_cache import init_perturbation_cache
+from app.services.cache_service import init_cache_service, close_cache_service
+from app.services.share_cache import init_share_cache
+from app.services.async_database import init_async_database_service, close_async_database_service
+from app.services.write_behind import init_write_behind_queue, close_write_behind_queue
 from app.agents.fortune_agent import init_fortune_agent
+from app.agents.verdict_bank import init_verdict_bank
+from app.agents.verdict_packs import init_verdict_pool_store
+from app.agents.user_memory import UserMemoryStore
 from app.api import divine
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from app.utils.structured_logging import setup_logging, parse_sample_rates
+from app.utils.rate_limiter import init_rate_limiter, close_rate_limiter
 
 # 获取配置
 settings = get_settings()
 
+# 配置日志（队列 + 后台线程写出，按 logger 采样）
+setup_logging(
+    level=settings.LOG_LEVEL,
+    fmt=settings.LOG_FORMAT,
+    sample_rates=parse_sample_rates(settings.LOG_SAMPLE_RATES),
+    queue_size=settings.LOG_QUEUE_SIZE
+)
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -49,34 +62,138 @@ async def lifespan(app: FastAPI):
     db_path = settings.DATABASE_URL if settings.DATABASE_URL and settings.DATABASE_URL.startswith('sqlite:///') else "data/destiny.db"
     if db_path.startswith('sqlite:///'):
         db_path = db_path.replace('sqlite:///', '')
-    init_database_service(db_path)
+    db_service = init_database_service(
+        db_path,
+        readers=settings.DB_READER_POOL_SIZE,
+        mmap_size_mb=settings.DB_MMAP_SIZE_MB,
+        cache_size_kb=settings.DB_CACHE_SIZE_KB,
+        busy_timeout=settings.DB_BUSY_TIMEOUT
+    )
     logger.info(f"Database service initialized: {db_path}")
     
+    # 请求处理中的数据库调用在专用线程中执行，不阻塞事件循环
+    async_db = init_async_database_service(db_service, readers=settings.DB_READER_POOL_SIZE)
+    
+    # 会话和交互记录入队后批量写入，不占用请求的响应时间
+    if settings.WRITE_BEHIND_ENABLED:
+        init_write_behind_queue(
+            async_db,
+            max_size=settings.WRITE_BEHIND_QUEUE_SIZE,
+            batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL,
+            session_interval=settings.WRITE_BEHIND_SESSION_INTERVAL
+        )
+    
+    # 初始化分享结果缓存（从数据库同步分享ID）
+    if settings.SHARE_CACHE_ENABLED:
+        await init_share_cache(
+            async_db,
+            max_entries=settings.SHARE_CACHE_MAX_ENTRIES,
+            negative_ttl=settings.SHARE_CACHE_NEGATIVE_TTL,
+            bloom_capacity=settings.SHARE_CACHE_BLOOM_CAPACITY,
+            sync_interval=settings.SHARE_CACHE_SYNC_INTERVAL
+        )
+    
+    # 加载微扰提示词模板并启动热加载
+    prompt_templates = None
+    if settings.PROMPT_TEMPLATES_ENABLED:
+        prompt_templates = init_prompt_template_registry(db_service)
+        prompt_templates.start(settings.PROMPT_TEMPLATE_RELOAD_INTERVAL)
+    
+    # 初始化速率限制
+    if settings.RATE_LIMIT_ENABLED:
+        init_rate_limiter(
+            settings.RATE_LIMIT_PER_MINUTE,
+            backend=settings.RATE_LIMIT_BACKEND,
+            burst=settings.RATE_LIMIT_BURST or None,
+            idle_ttl=settings.RATE_LIMIT_IDLE_TTL,
+            sqlite_path=settings.RATE_LIMIT_SQLITE_PATH
+        )
+    
+    # 初始化共享缓存（Redis 不可用时使用进程内缓存）
+    cache_service = None
+    if settings.CACHE_ENABLED:
+        cache_service = init_cache_service(
+            settings.REDIS_URL,
+            default_ttl=settings.REDIS_CACHE_TTL,
+            memory_max_entries=settings.CACHE_MEMORY_MAX_ENTRIES,
+            timeout=settings.REDIS_TIMEOUT
+        )
+        await cache_service.start()
+    
     # 初始化LLM服务
-    llm_config = {
-        'provider': settings.LLM_PROVIDER,
-        'api_key': settings.LLM_API_KEY,
-        'base_url': settings.LLM_BASE_URL,
-        'model': settings.LLM_MODEL,
-        'max_context_tokens': settings.LLM_MAX_CONTEXT_TOKENS,
-        'temperature': settings.LLM_TEMPERATURE,
-        'max_tokens': settings.LLM_MAX_TOKENS,
-        # 向后兼容旧配置
-        'default_model': settings.DEFAULT_LLM_MODEL or settings.LLM_MODEL,
-        'fallback_model': settings.FALLBACK_LLM_MODEL or settings.LLM_MODEL,
-    }
+    llm_config = build_llm_config(settings)
     init_llm_service(llm_config)
     logger.info(f"LLM service initialized with provider: {settings.LLM_PROVIDER}, model: {settings.LLM_MODEL}")
     
+    # 预热上游连接池
+    await get_llm_service().start()
+    
+    # 初始化微扰缓存
+    perturbation_cache = None
+    if settings.PERTURBATION_CACHE_ENABLED:
+        perturbation_cache = init_perturbation_cache(
+            max_entries=settings.PERTURBATION_CACHE_MAX_ENTRIES,
+            ttl=settings.PERTURBATION_CACHE_TTL,
+            variants_per_entry=settings.PERTURBATION_CACHE_VARIANTS,
+            disk_path=settings.PERTURBATION_CACHE_DISK_PATH
+        )
+        logger.info("Perturbation cache initialized")
+    
+    # 加载外置判词包（文件变化时热替换）
+    verdict_pool_store = None
+    if settings.VERDICT_POOL_DIR:
+        verdict_pool_store = init_verdict_pool_store(
+            settings.VERDICT_POOL_DIR,
+            [lang.strip() for lang in settings.VERDICT_POOL_LANGUAGES.split(',') if lang.strip()]
+        )
+        verdict_pool_store.start(settings.VERDICT_POOL_RELOAD_INTERVAL)
+    
+    # 加载预生成判词库（bank 模式）
+    verdict_bank = None
+    if settings.VERDICT_SOURCE == "bank":
+        verdict_bank = init_verdict_bank(settings.VERDICT_BANK_PATH)
+        if verdict_bank is None:
+            logger.warning("VERDICT_SOURCE=bank but no verdict bank loaded, using live perturbation")
+    
     # 初始化 Agent
     llm_service = get_llm_service()
-    init_fortune_agent(llm_service)
+    init_fortune_agent(
+        llm_service,
+        perturbation_cache=perturbation_cache,
+        verdict_bank=verdict_bank,
+        bank_refresh_rate=settings.VERDICT_BANK_LIVE_REFRESH_RATE,
+        memory=UserMemoryStore(
+            max_entries_per_user=settings.AGENT_MEMORY_PER_USER,
+            max_users=settings.AGENT_MEMORY_MAX_USERS,
+            ttl=settings.AGENT_MEMORY_TTL,
+            max_total_entries=settings.AGENT_MEMORY_MAX_ENTRIES
+        ),
+        batch_concurrency=settings.DIVINE_BATCH_CONCURRENCY,
+        prompt_templates=prompt_templates,
+        shared_cache=cache_service if perturbation_cache is not None else None,
+        shared_cache_ttl=settings.PERTURBATION_CACHE_TTL
+    )
     logger.info("Fortune Agent initialized successfully")
     
     yield
     
     # 关闭时清理
     logger.info("Shutting down Destiny API...")
+    await llm_service.close()
+    if prompt_templates is not None:
+        await prompt_templates.stop()
+    if verdict_pool_store is not None:
+        await verdict_pool_store.stop()
+    close_rate_limiter()
+    await close_cache_service()
+    if perturbation_cache is not None:
+        perturbation_cache.close()
+    if verdict_bank is not None:
+        verdict_bank.close()
+    await close_write_behind_queue()
+    close_async_database_service()
+    close_database_service()
 
 
 # 创建FastAPI应用
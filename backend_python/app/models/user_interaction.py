@@ -46,6 +46,7 @@ class UserInteraction(BaseModel):
     response_time_ms: Optional[int] = Field(None, description="响应时间(毫秒)")
     llm_model: Optional[str] = Field(None, description="使用的LLM模型")
     result_id: Optional[str] = Field(None, description="结果ID（用于分享）")
+    prompt_version: Optional[int] = Field(None, description="微扰提示词模板版本（使用判词库变体时为空）")
     
     class Config:
         json_schema_extra = {
@@ -0,0 +1,163 @@
+"""
+异步数据库服务 - DatabaseService 的异步外观
+
+SQLite 调用是同步阻塞的，直接在请求处理函数里调用会卡住事件循环，
+连等待 LLM 的其他请求也一起停下。这里把调用放到专用线程池中执行：
+
+- 写操作：单个写线程，和 SQLite 的单写连接一一对应，写入按提交顺序串行执行
+- 读操作：读线程池，线程数等于读连接数，线程不会因为等连接而阻塞
+
+每个线程池记录排队深度、等待时间（提交到开始执行）和执行时间。
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolMetrics:
+    """线程池排队和耗时统计"""
+
+    __slots__ = ("queued", "running", "completed", "failed", "wait_total", "wait_max", "run_total", "_lock")
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        done = self.completed + self.failed
+        return {
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": self.wait_total / done * 1000 if done else 0.0,
+            "max_wait_ms": self.wait_max * 1000,
+            "avg_run_ms": self.run_total / done * 1000 if done else 0.0,
+        }
+
+
+def _reader(name: str):
+    async def method(self, *args, **kwargs):
+        return await self._submit(self._read_pool, self.read_metrics, getattr(self.db, name), args, kwargs)
+    method.__name__ = name
+    method.__doc__ = f"在读线程池中执行 DatabaseService.{name}"
+    return method
+
+
+def _writer(name: str):
+    async def method(self, *args, **kwargs):
+        return await self._submit(self._write_pool, self.write_metrics, getattr(self.db, name), args, kwargs)
+    method.__name__ = name
+    method.__doc__ = f"在写线程中执行 DatabaseService.{name}"
+    return method
+
+
+class AsyncDatabaseService:
+    """DatabaseService 的异步外观（方法名和参数与 DatabaseService 相同）"""
+
+    def __init__(self, db_service, readers: int = 4):
+        """
+        Args:
+            db_service: DatabaseService 实例
+            readers: 读线程数（应与读连接数一致）
+        """
+        self.db = db_service
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._read_pool = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="db-reader")
+        self.write_metrics = _PoolMetrics()
+        self.read_metrics = _PoolMetrics()
+
+    async def _submit(self, pool: ThreadPoolExecutor, metrics: _PoolMetrics, fn: Callable, args, kwargs) -> Any:
+        submitted = time.perf_counter()
+        with metrics._lock:
+            metrics.queued += 1
+
+        def call():
+            started = time.perf_counter()
+            wait = started - submitted
+            with metrics._lock:
+                metrics.queued -= 1
+                metrics.running += 1
+                metrics.wait_total += wait
+                metrics.wait_max = max(metrics.wait_max, wait)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with metrics._lock:
+                    metrics.running -= 1
+                    metrics.run_total += time.perf_counter() - started
+                    if ok:
+                        metrics.completed += 1
+                    else:
+                        metrics.failed += 1
+
+        return await asyncio.get_running_loop().run_in_executor(pool, call)
+
+    # 读操作
+    get_user_stats = _reader("get_user_stats")
+    get_recent_interactions = _reader("get_recent_interactions")
+    get_global_stats = _reader("get_global_stats")
+    get_interaction_by_result_id = _reader("get_interaction_by_result_id")
+    get_result_ids_since = _reader("get_result_ids_since")
+    get_active_prompt_templates = _reader("get_active_prompt_templates")
+    get_prompt_template_signature = _reader("get_prompt_template_signature")
+    list_prompt_templates = _reader("list_prompt_templates")
+
+    # 写操作
+    save_or_update_session = _writer("save_or_update_session")
+    save_interaction = _writer("save_interaction")
+    save_batch = _writer("save_batch")
+    save_many = _writer("save_many")
+    rebuild_stats_rollups = _writer("rebuild_stats_rollups")
+    publish_prompt_template = _writer("publish_prompt_template")
+    seed_prompt_templates = _writer("seed_prompt_templates")
+
+    def close(self):
+        """等待已提交的操作完成后关闭线程池（不关闭数据库连接）"""
+        self._write_pool.shutdown(wait=True)
+        self._read_pool.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connections": self.db.get_connection_stats(),
+            "writer": self.write_metrics.to_dict(),
+            "readers": self.read_metrics.to_dict(),
+        }
+
+
+# 全局实例（单例）
+_async_db: Optional[AsyncDatabaseService] = None
+
+
+def init_async_database_service(db_service, readers: int = 4) -> AsyncDatabaseService:
+    """初始化异步数据库服务"""
+    global _async_db
+    _async_db = AsyncDatabaseService(db_service, readers)
+    return _async_db
+
+
+def get_async_database_service() -> Optional[AsyncDatabaseService]:
+    """获取异步数据库服务（数据库未初始化时返回 None）"""
+    return _async_db
+
+
+def close_async_database_service():
+    """关闭异步数据库服务的线程池"""
+    global _async_db
+    if _async_db is not None:
+        _async_db.close()
+        _async_db = None
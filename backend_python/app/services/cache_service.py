@@ -0,0 +1,361 @@
+"""
+共享缓存 - Redis 为共享层，进程内缓存为后备
+
+- 多 worker / 多节点共用 Redis，命中率不随进程数下降
+- 未配置 REDIS_URL 或 Redis 不可用时自动使用进程内缓存，冷却后再尝试 Redis
+- get_many 一次 MGET，set_many 一次 pipeline，都只有一个往返
+- get_or_set 防击穿：进程内合并同 key 的加载，跨进程用 SET NX 锁，
+  没拿到锁的调用方等待持锁方写入结果
+
+值以 JSON 保存，所有 key 带命名空间前缀。
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCacheBackend:
+    """进程内缓存（LRU + 过期时间）"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._data: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def _get(self, key: str, now: float) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at and expires_at <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: str, ttl: Optional[float], now: float):
+        self._data[key] = (value, now + ttl if ttl else 0.0)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        now = self._clock()
+        return [self._get(key, now) for key in keys]
+
+    async def set_many(self, items: Dict[str, str], ttl: Optional[float]):
+        now = self._clock()
+        for key, value in items.items():
+            self._set(key, value, ttl, now)
+
+    async def delete(self, keys: Sequence[str]):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        """key 不存在时写入（锁）"""
+        now = self._clock()
+        if self._get(key, now) is not None:
+            return False
+        self._set(key, value, ttl, now)
+        return True
+
+    async def exists(self, key: str) -> bool:
+        return self._get(key, self._clock()) is not None
+
+    async def clear(self, prefix: str):
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            del self._data[key]
+
+    async def close(self):
+        self._data.clear()
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class RedisCacheBackend:
+    """Redis 缓存（redis.asyncio 客户端，连接池由客户端管理）"""
+
+    name = "redis"
+
+    def __init__(self, client):
+        """
+        Args:
+            client: redis.asyncio.Redis 兼容的客户端（decode_responses=True）
+        """
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str, timeout: float = 0.2, max_connections: int = 50) -> "RedisCacheBackend":
+        import redis.asyncio as redis
+
+        return cls(redis.from_url(
+            url,
+            decode_responses=True,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+            max_connections=max_connections
+        ))
+
+    async def ping(self):
+        await self.client.ping()
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[str]]:
+        return await self.client.mget(list(keys))
+
+    async def set_many(self, items: Dict[str, str], ttl: Optional[float]):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(key, value, px=int(ttl * 1000) if ttl else None)
+        await pipe.execute()
+
+    async def delete(self, keys: Sequence[str]):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def add(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self.client.set(key, value, nx=True, px=int(ttl * 1000)))
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self.client.exists(key))
+
+    async def clear(self, prefix: str):
+        keys = [key async for key in self.client.scan_iter(match=f"{prefix}*", count=500)]
+        for i in range(0, len(keys), 500):
+            await self.client.delete(*keys[i:i + 500])
+
+    async def close(self):
+        await self.client.aclose()
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class CacheService:
+    """带命名空间、JSON 序列化和后备缓存的缓存服务"""
+
+    def __init__(
+        self,
+        backend=None,
+        namespace: str = "destiny:",
+        default_ttl: float = 3600,
+        fallback: Optional[MemoryCacheBackend] = None,
+        retry_interval: float = 30.0
+    ):
+        """
+        Args:
+            backend: 主缓存（RedisCacheBackend），为空则只用进程内缓存
+            namespace: key 前缀
+            default_ttl: 默认过期时间（秒）
+            fallback: 主缓存不可用时使用的进程内缓存
+            retry_interval: 主缓存出错后多久再尝试
+        """
+        self.fallback = fallback or MemoryCacheBackend()
+        self.backend = backend or self.fallback
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.retry_interval = retry_interval
+        self._down_until = 0.0
+        self._flight = SingleFlight()
+        self._background: set = set()
+        self.stats = {"hits": 0, "misses": 0, "errors": 0, "loads": 0, "lock_waits": 0}
+
+    def _key(self, key: str) -> str:
+        return self.namespace + key
+
+    async def _call(self, method: str, *args):
+        """调用主缓存，出错时标记不可用并改用后备缓存"""
+        if self.backend is not self.fallback and time.monotonic() >= self._down_until:
+            try:
+                return await getattr(self.backend, method)(*args)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._down_until = time.monotonic() + self.retry_interval
+                logger.warning(f"Cache backend {self.backend.name} unavailable, using in-process cache: {e}")
+        return await getattr(self.fallback, method)(*args)
+
+    @property
+    def using_fallback(self) -> bool:
+        return self.backend is self.fallback or time.monotonic() < self._down_until
+
+    async def get_many(self, keys: Sequence[str]) -> List[Any]:
+        """一次往返获取多个 key（不存在的为 None）"""
+        if not keys:
+            return []
+        raw = await self._call("get_many", [self._key(key) for key in keys])
+        values = []
+        for item in raw:
+            if item is None:
+                self.stats["misses"] += 1
+                values.append(None)
+            else:
+                self.stats["hits"] += 1
+                values.append(json.loads(item))
+        return values
+
+    async def get(self, key: str) -> Any:
+        return (await self.get_many([key]))[0]
+
+    async def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """一次往返写入多个 key"""
+        if not items:
+            return
+        payload = {
+            self._key(key): json.dumps(value, ensure_ascii=False, default=str)
+            for key, value in items.items()
+        }
+        await self._call("set_many", payload, ttl if ttl is not None else self.default_ttl)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set_many({key: value}, ttl)
+
+    def set_background(self, key: str, value: Any, ttl: Optional[float] = None):
+        """后台写入，不阻塞当前请求"""
+        task = asyncio.ensure_future(self.set(key, value, ttl))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def delete(self, *keys: str):
+        await self._call("delete", [self._key(key) for key in keys])
+
+    async def clear(self, prefix: str = ""):
+        """删除命名空间下指定前缀的 key"""
+        await self._call("clear", self._key(prefix))
+
+    async def get_or_set(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None,
+        lock_timeout: float = 5.0
+    ) -> Any:
+        """
+        读取缓存，未命中时调用 loader 加载并写入（loader 返回 None 时不缓存）
+
+        同一进程内同一 key 只加载一次；跨进程只有拿到锁的一方加载，
+        其他调用方等待结果，锁释放后仍未命中（例如结果为 None）时各自加载
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+        return await self._flight.do(key, lambda: self._load(key, loader, ttl, lock_timeout))
+
+    async def _load(self, key: str, loader, ttl: Optional[float], lock_timeout: float) -> Any:
+        lock_key = self._key(key + ":lock")
+        if await self._call("add", lock_key, uuid.uuid4().hex, lock_timeout):
+            try:
+                self.stats["loads"] += 1
+                value = await loader()
+                if value is not None:
+                    await self.set(key, value, ttl)
+                return value
+            finally:
+                await self._call("delete", [lock_key])
+
+        # 其他进程正在加载：等待它写入结果
+        self.stats["lock_waits"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + lock_timeout
+        delay = 0.005
+        while loop.time() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+            value = await self.get(key)
+            if value is not None:
+                return value
+            if not await self._call("exists", lock_key):
+                break
+        self.stats["loads"] += 1
+        value = await loader()
+        if value is not None:
+            await self.set(key, value, ttl)
+        return value
+
+    async def start(self):
+        """检查主缓存是否可用（不可用时先使用进程内缓存）"""
+        if self.backend is self.fallback:
+            return
+        try:
+            await self.backend.ping()
+            logger.info("Shared cache connected (%s)", self.backend.name)
+        except Exception as e:
+            self._down_until = time.monotonic() + self.retry_interval
+            logger.warning(f"Shared cache unavailable, using in-process cache: {e}")
+
+    async def close(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.backend is not self.fallback:
+            try:
+                await self.backend.close()
+            except Exception as e:
+                logger.warning(f"Error closing cache backend: {e}")
+        await self.fallback.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "backend": self.backend.name,
+            "using_fallback": self.using_fallback,
+            "fallback_entries": self.fallback.size(),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+
+# 全局实例（单例）
+_cache_service: Optional[CacheService] = None
+
+
+def init_cache_service(
+    redis_url: Optional[str] = None,
+    default_ttl: float = 3600,
+    memory_max_entries: int = 10000,
+    timeout: float = 0.2
+) -> CacheService:
+    """
+    初始化缓存服务
+
+    Args:
+        redis_url: Redis 地址，为空则只用进程内缓存
+        default_ttl: 默认过期时间（秒）
+        memory_max_entries: 进程内缓存的最大条目数
+        timeout: Redis 连接和读写超时（秒）
+    """
+    global _cache_service
+    backend = None
+    if redis_url:
+        try:
+            backend = RedisCacheBackend.from_url(redis_url, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Invalid REDIS_URL, using in-process cache: {e}")
+    _cache_service = CacheService(
+        backend,
+        default_ttl=default_ttl,
+        fallback=MemoryCacheBackend(memory_max_entries)
+    )
+    return _cache_service
+
+
+def get_cache_service() -> Optional[CacheService]:
+    """获取缓存服务（未初始化时返回 None）"""
+    return _cache_service
+
+
+async def close_cache_service():
+    """关闭缓存服务（等待后台写入完成）"""
+    global _cache_service
+    if _cache_service is not None:
+        await _cache_service.close()
+        _cache_service = None
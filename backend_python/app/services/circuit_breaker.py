@@ -0,0 +1,151 @@
+"""
+熔断器 - 按模型隔离上游故障
+
+状态：
+- closed：正常放行，按滑动窗口统计错误率和慢调用率
+- open：直接拒绝（快速失败），冷却时间后进入 half_open
+- half_open：放行少量探测请求，成功则恢复 closed，失败则重新 open
+"""
+import logging
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(Enum):
+    """熔断器状态"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时拒绝请求"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker open for {name}")
+        self.name = name
+
+
+class CircuitBreaker:
+    """单个上游（模型）的熔断器"""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 10,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate_threshold: float = 0.8,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1
+    ):
+        """
+        Args:
+            name: 名称（模型名）
+            window_size: 滑动窗口大小（最近 N 次调用）
+            min_calls: 窗口内至少有这么多次调用才计算比例
+            failure_rate_threshold: 错误率达到该值时打开
+            slow_call_seconds: 超过该耗时的调用记为慢调用
+            slow_call_rate_threshold: 慢调用率达到该值时打开
+            open_seconds: 打开后的冷却时间
+            half_open_probes: 半开状态下同时放行的探测请求数
+        """
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+
+        self.state = CircuitState.CLOSED
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)  # (失败, 慢调用)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _transition(self, state: CircuitState):
+        if state is self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state.value} -> {state.value}")
+        self.state = state
+        if state is CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state is CircuitState.CLOSED:
+            self._window.clear()
+        self._probes_in_flight = 0
+
+    def allow_request(self) -> bool:
+        """是否放行本次请求（放行的请求必须以 record_* 或 release 结束）"""
+        if self.state is CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+
+        if self.state is CircuitState.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+
+        return True
+
+    def _rates(self) -> Tuple[float, float]:
+        calls = len(self._window)
+        if calls == 0:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow = sum(1 for _, is_slow in self._window if is_slow)
+        return failures / calls, slow / calls
+
+    def _record(self, failed: bool, slow: bool):
+        if self.state is CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._transition(CircuitState.OPEN if failed or slow else CircuitState.CLOSED)
+            return
+
+        self._window.append((failed, slow))
+        if len(self._window) < self.min_calls:
+            return
+        failure_rate, slow_rate = self._rates()
+        if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+            self._transition(CircuitState.OPEN)
+
+    def record_success(self, latency: float):
+        """记录成功调用"""
+        self._record(False, latency >= self.slow_call_seconds)
+
+    def record_failure(self):
+        """记录失败调用"""
+        self._record(True, False)
+
+    def release(self):
+        """请求被取消，既不算成功也不算失败"""
+        if self.state is CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """熔断器状态快照"""
+        failure_rate, slow_rate = self._rates()
+        snapshot = {
+            "state": self.state.value,
+            "calls_in_window": len(self._window),
+            "failure_rate": failure_rate,
+            "slow_call_rate": slow_rate,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
+        if self.state is CircuitState.OPEN:
+            snapshot["retry_in_seconds"] = max(
+                0.0, self.open_seconds - (time.monotonic() - self._opened_at)
+            )
+        return snapshot
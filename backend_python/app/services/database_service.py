@@ -6,10 +6,11 @@ import sqlite3
 import logging
 import json
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from pathlib import Path
 
 from app.models.user_interaction import UserSession, UserInteraction, UserStats
+from app.services.sqlite_pool import SQLiteConnectionManager
 
 logger = logging.getLogger(__name__)
 
@@ -17,12 +18,23 @@ logger = logging.getLogger(__name__)
 class DatabaseService:
     """数据库服务类"""
     
-    def __init__(self, db_path: str = "data/destiny.db"):
+    def __init__(
+        self,
+        db_path: str = "data/destiny.db",
+        readers: int = 4,
+        mmap_size_mb: int = 64,
+        cache_size_kb: int = 8192,
+        busy_timeout: float = 5.0
+    ):
         """
         初始化数据库服务
         
         Args:
             db_path: 数据库文件路径
+            readers: 读连接池大小
+            mmap_size_mb: 每个连接的内存映射大小（MB）
+            cache_size_kb: 每个连接的页缓存大小（KB）
+            busy_timeout: 等待其他进程释放锁的时间（秒）
         """
         self.db_path = db_path
         
@@ -30,131 +42,310 @@ class DatabaseService:
         db_dir = Path(db_path).parent
         db_dir.mkdir(parents=True, exist_ok=True)
         
+        # 长连接：一个写连接 + 读连接池（WAL 模式）
+        self._db = SQLiteConnectionManager(
+            db_path,
+            readers=readers,
+            mmap_size_mb=mmap_size_mb,
+            cache_size_kb=cache_size_kb,
+            busy_timeout=busy_timeout
+        )
+        
         # 初始化数据库
         self._init_database()
         logger.info(f"Database service initialized: {db_path}")
     
-    def _get_connection(self) -> sqlite3.Connection:
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # 返回字典格式
-        return conn
+    def close(self):
+        """关闭数据库连接"""
+        self._db.close()
+    
+    def get_connection_stats(self) -> Dict[str, Any]:
+        """连接池统计"""
+        return self._db.get_stats()
     
     def _init_database(self):
         """初始化数据库表"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 创建用户会话表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL UNIQUE,
-                    ip_hash TEXT NOT NULL,
-                    first_visit TEXT NOT NULL,
-                    last_visit TEXT NOT NULL,
-                    visit_count INTEGER DEFAULT 1,
-                    user_agent TEXT,
-                    language TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # 创建用户交互表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_interactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    session_id TEXT,
-                    question TEXT NOT NULL,
-                    question_hash TEXT NOT NULL,
-                    result TEXT NOT NULL,
-                    language TEXT NOT NULL,
-                    category TEXT,
-                    is_night INTEGER DEFAULT 0,
-                    timestamp TEXT NOT NULL,
-                    response_time_ms INTEGER,
-                    llm_model TEXT,
-                    result_id TEXT UNIQUE,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES user_sessions(user_id)
-                )
-            """)
-            
-            # 如果表已存在，添加 result_id 字段（用于分享功能）
-            result_id_exists = False
-            column_just_added = False
-            try:
-                cursor.execute("ALTER TABLE user_interactions ADD COLUMN result_id TEXT")
-                logger.info("Added result_id column to user_interactions table")
-                result_id_exists = True
-                column_just_added = True
-            except sqlite3.OperationalError as e:
-                # 检查是否因为列已存在而失败
-                error_msg = str(e).lower()
-                if "duplicate column name" in error_msg or "already exists" in error_msg:
-                    result_id_exists = True
-                    logger.debug("result_id column already exists")
-                else:
-                    # 其他错误，检查列是否存在
-                    cursor.execute("PRAGMA table_info(user_interactions)")
-                    columns = [row[1] for row in cursor.fetchall()]
-                    result_id_exists = "result_id" in columns
-                    if result_id_exists:
-                        logger.debug("result_id column exists (verified via PRAGMA)")
-            
-            # 创建索引
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id 
-                ON user_sessions(user_id)
-            """)
-            
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_interactions_user_id 
-                ON user_interactions(user_id)
-            """)
-            
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_interactions_timestamp 
-                ON user_interactions(timestamp)
-            """)
-            
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_interactions_question_hash 
-                ON user_interactions(question_hash)
-            """)
-            
-            # 只有在 result_id 列存在时才创建索引
-            if result_id_exists:
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # 创建用户会话表
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS user_sessions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT NOT NULL UNIQUE,
+                        ip_hash TEXT NOT NULL,
+                        first_visit TEXT NOT NULL,
+                        last_visit TEXT NOT NULL,
+                        visit_count INTEGER DEFAULT 1,
+                        user_agent TEXT,
+                        language TEXT,
+                        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # 创建用户交互表
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS user_interactions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT NOT NULL,
+                        session_id TEXT,
+                        question TEXT NOT NULL,
+                        question_hash TEXT NOT NULL,
+                        result TEXT NOT NULL,
+                        language TEXT NOT NULL,
+                        category TEXT,
+                        is_night INTEGER DEFAULT 0,
+                        timestamp TEXT NOT NULL,
+                        response_time_ms INTEGER,
+                        llm_model TEXT,
+                        result_id TEXT UNIQUE,
+                        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES user_sessions(user_id)
+                    )
+                """)
+                
+                # 如果表已存在，添加 result_id 字段（用于分享功能）
+                result_id_exists = False
+                column_just_added = False
                 try:
-                    # 如果列是刚添加的，创建唯一索引以保持数据完整性
-                    if column_just_added:
-                        cursor.execute("""
-                            CREATE UNIQUE INDEX IF NOT EXISTS idx_interactions_result_id 
-                            ON user_interactions(result_id)
-                        """)
-                        logger.info("Created unique index on result_id column")
+                    cursor.execute("ALTER TABLE user_interactions ADD COLUMN result_id TEXT")
+                    logger.info("Added result_id column to user_interactions table")
+                    result_id_exists = True
+                    column_just_added = True
+                except sqlite3.OperationalError as e:
+                    # 检查是否因为列已存在而失败
+                    error_msg = str(e).lower()
+                    if "duplicate column name" in error_msg or "already exists" in error_msg:
+                        result_id_exists = True
+                        logger.debug("result_id column already exists")
                     else:
-                        cursor.execute("""
-                            CREATE INDEX IF NOT EXISTS idx_interactions_result_id 
-                            ON user_interactions(result_id)
-                        """)
+                        # 其他错误，检查列是否存在
+                        cursor.execute("PRAGMA table_info(user_interactions)")
+                        columns = [row[1] for row in cursor.fetchall()]
+                        result_id_exists = "result_id" in columns
+                        if result_id_exists:
+                            logger.debug("result_id column exists (verified via PRAGMA)")
+                
+                # 记录生成结果所用的提示词模板版本
+                try:
+                    cursor.execute("ALTER TABLE user_interactions ADD COLUMN prompt_version INTEGER")
+                    logger.info("Added prompt_version column to user_interactions table")
                 except sqlite3.OperationalError as e:
-                    logger.warning(f"Failed to create index on result_id: {e}")
-            else:
-                logger.warning("result_id column does not exist, skipping index creation")
-            
-            conn.commit()
+                    if "duplicate column name" not in str(e).lower():
+                        raise
+                
+                # 创建提示词模板表（与 init_db.sql 中的 PostgreSQL 定义一致）
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS prompt_templates (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        language TEXT NOT NULL,
+                        template_type TEXT NOT NULL,
+                        template_content TEXT NOT NULL,
+                        version INTEGER NOT NULL DEFAULT 1,
+                        is_active INTEGER NOT NULL DEFAULT 1,
+                        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_templates_active 
+                    ON prompt_templates(language, template_type, is_active)
+                """)
+                
+                # 创建索引
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id 
+                    ON user_sessions(user_id)
+                """)
+                
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_interactions_user_id 
+                    ON user_interactions(user_id)
+                """)
+                
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_interactions_timestamp 
+                    ON user_interactions(timestamp)
+                """)
+                
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_interactions_question_hash 
+                    ON user_interactions(question_hash)
+                """)
+                
+                # 只有在 result_id 列存在时才创建索引
+                if result_id_exists:
+                    try:
+                        # 如果列是刚添加的，创建唯一索引以保持数据完整性
+                        if column_just_added:
+                            cursor.execute("""
+                                CREATE UNIQUE INDEX IF NOT EXISTS idx_interactions_result_id 
+                                ON user_interactions(result_id)
+                            """)
+                            logger.info("Created unique index on result_id column")
+                        else:
+                            cursor.execute("""
+                                CREATE INDEX IF NOT EXISTS idx_interactions_result_id 
+                                ON user_interactions(result_id)
+                            """)
+                    except sqlite3.OperationalError as e:
+                        logger.warning(f"Failed to create index on result_id: {e}")
+                else:
+                    logger.warning("result_id column does not exist, skipping index creation")
+                
+                self._init_stats_rollups(cursor)
             logger.info("Database tables initialized successfully")
             
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
-            conn.rollback()
             raise
-        finally:
-            conn.close()
+    
+    def _init_stats_rollups(self, cursor: sqlite3.Cursor):
+        """
+        创建统计汇总表和维护它们的触发器
+        
+        stats_daily 按天、语言、类别记录交互数，stats_totals 记录用户总数。
+        触发器在写入交互和会话的同一事务中更新汇总表，全局统计只读汇总表。
+        汇总表第一次创建时从历史数据回填。
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_daily'")
+        rollups_exist = cursor.fetchone() is not None
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                day TEXT NOT NULL,
+                language TEXT NOT NULL,
+                category TEXT NOT NULL DEFAULT '',
+                interactions INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, language, category)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_interactions_rollup_insert
+            AFTER INSERT ON user_interactions
+            BEGIN
+                INSERT INTO stats_daily (day, language, category, interactions)
+                VALUES (IFNULL(DATE(NEW.timestamp), ''), NEW.language, IFNULL(NEW.category, ''), 1)
+                ON CONFLICT(day, language, category) DO UPDATE SET interactions = interactions + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_interactions_rollup_delete
+            AFTER DELETE ON user_interactions
+            BEGIN
+                UPDATE stats_daily SET interactions = interactions - 1
+                WHERE day = IFNULL(DATE(OLD.timestamp), '')
+                  AND language = OLD.language
+                  AND category = IFNULL(OLD.category, '');
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_insert
+            AFTER INSERT ON user_sessions
+            BEGIN
+                INSERT INTO stats_totals (name, value) VALUES ('users', 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_delete
+            AFTER DELETE ON user_sessions
+            BEGIN
+                UPDATE stats_totals SET value = value - 1 WHERE name = 'users';
+            END
+        """)
+        
+        if not rollups_exist:
+            rows = self._rebuild_stats_rollups(cursor)
+            logger.info("Stats rollup tables created and backfilled: %d rows", rows)
+    
+    @staticmethod
+    def _rebuild_stats_rollups(cursor: sqlite3.Cursor) -> int:
+        """在当前事务中从明细表重建汇总表，返回 stats_daily 的行数"""
+        cursor.execute("DELETE FROM stats_daily")
+        cursor.execute("DELETE FROM stats_totals WHERE name = 'users'")
+        cursor.execute("""
+            INSERT INTO stats_daily (day, language, category, interactions)
+            SELECT IFNULL(DATE(timestamp), ''), language, IFNULL(category, ''), COUNT(*)
+            FROM user_interactions
+            GROUP BY 1, 2, 3
+        """)
+        rows = cursor.rowcount
+        cursor.execute("INSERT INTO stats_totals (name, value) SELECT 'users', COUNT(*) FROM user_sessions")
+        return rows
+    
+    def rebuild_stats_rollups(self) -> int:
+        """
+        从历史数据重建统计汇总表（汇总表与明细不一致时使用）
+        
+        Returns:
+            stats_daily 的行数
+        """
+        with self._db.transaction() as conn:
+            rows = self._rebuild_stats_rollups(conn.cursor())
+        logger.info("Stats rollup tables rebuilt: %d rows", rows)
+        return rows
+    
+    # 新用户插入；已有用户累加访问次数（合并后的会话 visit_count 可能大于 1）
+    _UPSERT_SESSION_SQL = """
+        INSERT INTO user_sessions 
+        (user_id, ip_hash, first_visit, last_visit, visit_count, user_agent, language, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            last_visit = MAX(last_visit, excluded.last_visit),
+            visit_count = visit_count + excluded.visit_count,
+            user_agent = excluded.user_agent,
+            language = excluded.language,
+            updated_at = excluded.updated_at
+    """
+    
+    @staticmethod
+    def _session_params(session: UserSession) -> tuple:
+        return (
+            session.user_id,
+            session.ip_hash,
+            session.first_visit.isoformat(),
+            session.last_visit.isoformat(),
+            session.visit_count,
+            session.user_agent,
+            session.language,
+            datetime.now().isoformat()
+        )
+    
+    _INSERT_INTERACTION_SQL = """
+        INSERT INTO user_interactions 
+        (user_id, session_id, question, question_hash, result, language, 
+         category, is_night, timestamp, response_time_ms, llm_model, result_id, prompt_version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    
+    @staticmethod
+    def _interaction_params(interaction: UserInteraction) -> tuple:
+        return (
+            interaction.user_id,
+            interaction.session_id,
+            interaction.question,
+            interaction.question_hash,
+            interaction.result,
+            interaction.language,
+            interaction.category,
+            1 if interaction.is_night else 0,
+            interaction.timestamp.isoformat(),
+            interaction.response_time_ms,
+            interaction.llm_model,
+            getattr(interaction, 'result_id', None),
+            interaction.prompt_version
+        )
     
     def save_or_update_session(self, session: UserSession) -> str:
         """
@@ -166,61 +357,17 @@ class DatabaseService:
         Returns:
             用户ID
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 检查会话是否存在
-            cursor.execute(
-                "SELECT id, visit_count FROM user_sessions WHERE user_id = ?",
-                (session.user_id,)
-            )
-            existing = cursor.fetchone()
-            
-            if existing:
-                # 更新现有会话
-                cursor.execute("""
-                    UPDATE user_sessions 
-                    SET last_visit = ?,
-                        visit_count = visit_count + 1,
-                        user_agent = ?,
-                        language = ?,
-                        updated_at = ?
-                    WHERE user_id = ?
-                """, (
-                    session.last_visit.isoformat(),
-                    session.user_agent,
-                    session.language,
-                    datetime.now().isoformat(),
-                    session.user_id
-                ))
-                logger.debug(f"Updated session for user: {session.user_id}")
-            else:
-                # 创建新会话
-                cursor.execute("""
-                    INSERT INTO user_sessions 
-                    (user_id, ip_hash, first_visit, last_visit, visit_count, user_agent, language)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    session.user_id,
-                    session.ip_hash,
-                    session.first_visit.isoformat(),
-                    session.last_visit.isoformat(),
-                    session.visit_count,
-                    session.user_agent,
-                    session.language
-                ))
-                logger.info(f"Created new session for user: {session.user_id}")
-            
-            conn.commit()
-            return session.user_id
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(self._UPSERT_SESSION_SQL, self._session_params(session))
+                logger.debug("Saved session for user: %s", session.user_id)
+                return session.user_id
             
         except Exception as e:
             logger.error(f"Error saving session: {e}")
-            conn.rollback()
             raise
-        finally:
-            conn.close()
     
     def save_interaction(self, interaction: UserInteraction) -> int:
         """
@@ -232,41 +379,70 @@ class DatabaseService:
         Returns:
             交互记录ID
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute("""
-                INSERT INTO user_interactions 
-                (user_id, session_id, question, question_hash, result, language, 
-                 category, is_night, timestamp, response_time_ms, llm_model, result_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                interaction.user_id,
-                interaction.session_id,
-                interaction.question,
-                interaction.question_hash,
-                interaction.result,
-                interaction.language,
-                interaction.category,
-                1 if interaction.is_night else 0,
-                interaction.timestamp.isoformat(),
-                interaction.response_time_ms,
-                interaction.llm_model,
-                getattr(interaction, 'result_id', None)
-            ))
-            
-            conn.commit()
-            interaction_id = cursor.lastrowid
-            logger.info(f"Saved interaction {interaction_id} for user: {interaction.user_id}")
-            return interaction_id
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(self._INSERT_INTERACTION_SQL, self._interaction_params(interaction))
+                
+                interaction_id = cursor.lastrowid
+                logger.info("Saved interaction %s for user: %s", interaction_id, interaction.user_id)
+                return interaction_id
             
         except Exception as e:
             logger.error(f"Error saving interaction: {e}")
-            conn.rollback()
             raise
-        finally:
-            conn.close()
+    
+    def save_many(
+        self,
+        sessions: List[UserSession],
+        interactions: List[UserInteraction]
+    ) -> int:
+        """
+        在一个事务中保存多个会话和交互记录（写缓冲批量落库）
+        
+        Args:
+            sessions: 用户会话列表（同一用户可出现多次，访问次数累加）
+            interactions: 交互记录列表
+            
+        Returns:
+            写入的交互记录数
+        """
+        try:
+            with self._db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany(
+                    self._UPSERT_SESSION_SQL,
+                    [self._session_params(session) for session in sessions]
+                )
+                cursor.executemany(
+                    self._INSERT_INTERACTION_SQL,
+                    [self._interaction_params(interaction) for interaction in interactions]
+                )
+                logger.debug("Saved %d sessions and %d interactions", len(sessions), len(interactions))
+                return len(interactions)
+                
+        except Exception as e:
+            logger.error(f"Error saving write batch: {e}")
+            raise
+    
+    def save_batch(
+        self,
+        session: Optional[UserSession],
+        interactions: List[UserInteraction]
+    ) -> int:
+        """
+        在一个事务中保存会话和一批交互记录
+        
+        Args:
+            session: 用户会话对象（可选）
+            interactions: 交互记录列表
+            
+        Returns:
+            写入的交互记录数
+        """
+        return self.save_many([session] if session is not None else [], interactions)
     
     def get_user_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -278,74 +454,72 @@ class DatabaseService:
         Returns:
             统计数据字典
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 获取基础会话信息
-            cursor.execute("""
-                SELECT first_visit, last_visit, visit_count, language
-                FROM user_sessions 
-                WHERE user_id = ?
-            """, (user_id,))
-            session = cursor.fetchone()
-            
-            if not session:
-                return None
-            
-            # 获取交互统计
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_interactions,
-                    AVG(response_time_ms) as avg_response_time,
-                    SUM(CASE WHEN is_night = 1 THEN 1 ELSE 0 END) as night_interactions,
-                    language,
-                    category
-                FROM user_interactions 
-                WHERE user_id = ?
-                GROUP BY language, category
-            """, (user_id,))
-            interactions = cursor.fetchall()
-            
-            # 构建统计数据
-            stats = {
-                'user_id': user_id,
-                'first_visit': session['first_visit'],
-                'last_visit': session['last_visit'],
-                'total_visits': session['visit_count'],
-                'total_interactions': sum(row['total_interactions'] for row in interactions),
-                'favorite_language': session['language'],
-                'avg_response_time_ms': 0,
-                'night_mode_usage': 0,
-                'categories': {}
-            }
-            
-            # 计算详细统计
-            total_interactions = stats['total_interactions']
-            if total_interactions > 0:
-                total_response_time = sum(
-                    row['total_interactions'] * (row['avg_response_time'] or 0) 
-                    for row in interactions
-                )
-                stats['avg_response_time_ms'] = total_response_time / total_interactions
+            with self._db.reader() as conn:
+                cursor = conn.cursor()
                 
-                night_total = sum(row['night_interactions'] for row in interactions)
-                stats['night_mode_usage'] = night_total / total_interactions
+                # 获取基础会话信息
+                cursor.execute("""
+                    SELECT first_visit, last_visit, visit_count, language
+                    FROM user_sessions 
+                    WHERE user_id = ?
+                """, (user_id,))
+                session = cursor.fetchone()
                 
-                # 统计各类别的交互数量
-                for row in interactions:
-                    category = row['category'] or 'general'
-                    if category not in stats['categories']:
-                        stats['categories'][category] = 0
-                    stats['categories'][category] += row['total_interactions']
-            
-            return stats
+                if not session:
+                    return None
+                
+                # 获取交互统计
+                cursor.execute("""
+                    SELECT 
+                        COUNT(*) as total_interactions,
+                        AVG(response_time_ms) as avg_response_time,
+                        SUM(CASE WHEN is_night = 1 THEN 1 ELSE 0 END) as night_interactions,
+                        language,
+                        category
+                    FROM user_interactions 
+                    WHERE user_id = ?
+                    GROUP BY language, category
+                """, (user_id,))
+                interactions = cursor.fetchall()
+                
+                # 构建统计数据
+                stats = {
+                    'user_id': user_id,
+                    'first_visit': session['first_visit'],
+                    'last_visit': session['last_visit'],
+                    'total_visits': session['visit_count'],
+                    'total_interactions': sum(row['total_interactions'] for row in interactions),
+                    'favorite_language': session['language'],
+                    'avg_response_time_ms': 0,
+                    'night_mode_usage': 0,
+                    'categories': {}
+                }
+                
+                # 计算详细统计
+                total_interactions = stats['total_interactions']
+                if total_interactions > 0:
+                    total_response_time = sum(
+                        row['total_interactions'] * (row['avg_response_time'] or 0) 
+                        for row in interactions
+                    )
+                    stats['avg_response_time_ms'] = total_response_time / total_interactions
+                    
+                    night_total = sum(row['night_interactions'] for row in interactions)
+                    stats['night_mode_usage'] = night_total / total_interactions
+                    
+                    # 统计各类别的交互数量
+                    for row in interactions:
+                        category = row['category'] or 'general'
+                        if category not in stats['categories']:
+                            stats['categories'][category] = 0
+                        stats['categories'][category] += row['total_interactions']
+                
+                return stats
             
         except Exception as e:
             logger.error(f"Error getting user stats: {e}")
             return None
-        finally:
-            conn.close()
     
     def get_recent_interactions(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """
@@ -358,27 +532,25 @@ class DatabaseService:
         Returns:
             交互记录列表
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute("""
-                SELECT id, question, result, language, category, 
-                       is_night, timestamp, response_time_ms
-                FROM user_interactions 
-                WHERE user_id = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            """, (user_id, limit))
-            
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            with self._db.reader() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT id, question, result, language, category, 
+                           is_night, timestamp, response_time_ms
+                    FROM user_interactions 
+                    WHERE user_id = ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                """, (user_id, limit))
+                
+                rows = cursor.fetchall()
+                return [dict(row) for row in rows]
             
         except Exception as e:
             logger.error(f"Error getting recent interactions: {e}")
             return []
-        finally:
-            conn.close()
     
     def get_global_stats(self) -> Dict[str, Any]:
         """
@@ -387,55 +559,56 @@ class DatabaseService:
         Returns:
             全局统计数据
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # 用户总数
-            cursor.execute("SELECT COUNT(*) as total_users FROM user_sessions")
-            total_users = cursor.fetchone()['total_users']
-            
-            # 交互总数
-            cursor.execute("SELECT COUNT(*) as total_interactions FROM user_interactions")
-            total_interactions = cursor.fetchone()['total_interactions']
-            
-            # 今日交互数
-            cursor.execute("""
-                SELECT COUNT(*) as today_interactions 
-                FROM user_interactions 
-                WHERE DATE(timestamp) = DATE('now')
-            """)
-            today_interactions = cursor.fetchone()['today_interactions']
-            
-            # 各语言使用统计
-            cursor.execute("""
-                SELECT language, COUNT(*) as count 
-                FROM user_interactions 
-                GROUP BY language
-            """)
-            language_stats = {row['language']: row['count'] for row in cursor.fetchall()}
-            
-            # 各类别统计
-            cursor.execute("""
-                SELECT category, COUNT(*) as count 
-                FROM user_interactions 
-                GROUP BY category
-            """)
-            category_stats = {row['category']: row['count'] for row in cursor.fetchall()}
-            
-            return {
-                'total_users': total_users,
-                'total_interactions': total_interactions,
-                'today_interactions': today_interactions,
-                'language_distribution': language_stats,
-                'category_distribution': category_stats
-            }
+            with self._db.reader() as conn:
+                cursor = conn.cursor()
+                
+                # 全部来自汇总表，行数与天数成正比，和明细行数无关
+                cursor.execute("SELECT value FROM stats_totals WHERE name = 'users'")
+                row = cursor.fetchone()
+                total_users = row['value'] if row else 0
+                
+                # 交互总数
+                cursor.execute("SELECT IFNULL(SUM(interactions), 0) as total_interactions FROM stats_daily")
+                total_interactions = cursor.fetchone()['total_interactions']
+                
+                # 今日交互数
+                cursor.execute("""
+                    SELECT IFNULL(SUM(interactions), 0) as today_interactions 
+                    FROM stats_daily 
+                    WHERE day = DATE('now')
+                """)
+                today_interactions = cursor.fetchone()['today_interactions']
+                
+                # 各语言使用统计
+                cursor.execute("""
+                    SELECT language, SUM(interactions) as count 
+                    FROM stats_daily 
+                    GROUP BY language
+                    HAVING count > 0
+                """)
+                language_stats = {row['language']: row['count'] for row in cursor.fetchall()}
+                
+                # 各类别统计（未设置类别的记录在汇总表中为空字符串）
+                cursor.execute("""
+                    SELECT category, SUM(interactions) as count 
+                    FROM stats_daily 
+                    GROUP BY category
+                    HAVING count > 0
+                """)
+                category_stats = {(row['category'] or None): row['count'] for row in cursor.fetchall()}
+                
+                return {
+                    'total_users': total_users,
+                    'total_interactions': total_interactions,
+                    'today_interactions': today_interactions,
+                    'language_distribution': language_stats,
+                    'category_distribution': category_stats
+                }
             
         except Exception as e:
             logger.error(f"Error getting global stats: {e}")
             return {}
-        finally:
-            conn.close()
     
     def get_interaction_by_result_id(self, result_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -447,40 +620,170 @@ class DatabaseService:
         Returns:
             交互记录字典，如果不存在则返回 None
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute("""
-                SELECT id, user_id, question, result, language, category, 
-                       is_night, timestamp, result_id
-                FROM user_interactions 
-                WHERE result_id = ?
-            """, (result_id,))
-            
-            row = cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+            with self._db.reader() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    SELECT id, user_id, question, result, language, category, 
+                           is_night, timestamp, result_id
+                    FROM user_interactions 
+                    WHERE result_id = ?
+                """, (result_id,))
+                
+                row = cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
             
         except Exception as e:
+            # 抛出而不是返回 None：调用方会把 None 当作"不存在"缓存下来
             logger.error(f"Error getting interaction by result_id: {e}")
-            return None
-        finally:
-            conn.close()
+            raise
+    
+    def get_result_ids_since(self, last_id: int = 0, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """
+        获取主键大于 last_id 的分享ID（增量同步分享缓存的布隆过滤器）
+        
+        Args:
+            last_id: 上次同步到的主键
+            limit: 最多返回的条数（分页读取），为空则不限
+        
+        Returns:
+            按主键升序的 (主键, result_id) 列表
+        """
+        with self._db.reader() as conn:
+            cursor = conn.execute("""
+                SELECT id, result_id FROM user_interactions
+                WHERE id > ? AND result_id IS NOT NULL
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, -1 if limit is None else limit))
+            return [(row[0], row[1]) for row in cursor.fetchall()]
+
+    
+    def get_active_prompt_templates(self, template_type: str) -> List[Dict[str, Any]]:
+        """
+        获取启用的提示词模板（按语言分组、版本号降序）
+        
+        Args:
+            template_type: 模板类型
+        """
+        with self._db.reader() as conn:
+            cursor = conn.execute("""
+                SELECT name, language, template_type, template_content, version
+                FROM prompt_templates
+                WHERE template_type = ? AND is_active = 1
+                ORDER BY language, version DESC, id DESC
+            """, (template_type,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_prompt_template_signature(self, template_type: str) -> str:
+        """启用模板的版本签名（任何模板启用、停用或发布新版本都会改变）"""
+        with self._db.reader() as conn:
+            row = conn.execute("""
+                SELECT COUNT(*), COALESCE(GROUP_CONCAT(id || ':' || version), '')
+                FROM (
+                    SELECT id, version FROM prompt_templates
+                    WHERE template_type = ? AND is_active = 1
+                    ORDER BY id
+                )
+            """, (template_type,)).fetchone()
+            return f"{row[0]}|{row[1]}"
+    
+    def list_prompt_templates(self, template_type: str) -> List[Dict[str, Any]]:
+        """列出某类型的全部模板（含已停用）"""
+        with self._db.reader() as conn:
+            cursor = conn.execute("""
+                SELECT id, name, language, version, is_active, created_at
+                FROM prompt_templates
+                WHERE template_type = ?
+                ORDER BY language, version DESC
+            """, (template_type,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def publish_prompt_template(
+        self,
+        name: str,
+        language: str,
+        template_type: str,
+        content: str
+    ) -> int:
+        """
+        发布新版本模板：版本号递增，同语言同类型的旧版本停用
+        
+        Returns:
+            新版本号
+        """
+        try:
+            with self._db.transaction() as conn:
+                row = conn.execute("""
+                    SELECT COALESCE(MAX(version), 0) FROM prompt_templates
+                    WHERE language = ? AND template_type = ?
+                """, (language, template_type)).fetchone()
+                version = row[0] + 1
+                conn.execute("""
+                    UPDATE prompt_templates SET is_active = 0
+                    WHERE language = ? AND template_type = ?
+                """, (language, template_type))
+                conn.execute("""
+                    INSERT INTO prompt_templates
+                    (name, language, template_type, template_content, version, is_active)
+                    VALUES (?, ?, ?, ?, ?, 1)
+                """, (name, language, template_type, content, version))
+                logger.info(f"Published prompt template {name} v{version}")
+                return version
+            
+        except Exception as e:
+            logger.error(f"Error publishing prompt template: {e}")
+            raise
+    
+    def seed_prompt_templates(self, template_type: str, templates: Dict[str, str]):
+        """某类型还没有任何模板时写入默认模板（版本 1）"""
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM prompt_templates WHERE template_type = ?",
+                (template_type,)
+            ).fetchone()
+            if row[0]:
+                return
+            conn.executemany("""
+                INSERT INTO prompt_templates
+                (name, language, template_type, template_content, version, is_active)
+                VALUES (?, ?, ?, ?, 1, 1)
+            """, [
+                (f"{template_type}_{language}", language, template_type, content)
+                for language, content in templates.items()
+            ])
+            logger.info(f"Seeded default {template_type} prompt templates")
 
 
 # 全局数据库服务实例
 _db_service: Optional[DatabaseService] = None
 
 
-def init_database_service(db_path: str = "data/destiny.db") -> DatabaseService:
-    """初始化数据库服务"""
+def init_database_service(db_path: str = "data/destiny.db", **kwargs) -> DatabaseService:
+    """
+    初始化数据库服务
+    
+    Args:
+        db_path: 数据库文件路径
+        **kwargs: 连接参数（readers、mmap_size_mb、cache_size_kb、busy_timeout）
+    """
     global _db_service
-    _db_service = DatabaseService(db_path)
+    _db_service = DatabaseService(db_path, **kwargs)
     return _db_service
 
 
 def get_database_service() -> Optional[DatabaseService]:
     """获取数据库服务实例"""
     return _db_service
+
+
+def close_database_service():
+    """关闭数据库连接"""
+    global _db_service
+    if _db_service is not None:
+        _db_service.close()
+        _db_service = None
+
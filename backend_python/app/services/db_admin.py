@@ -0,0 +1,38 @@
+"""
+数据库维护工具 - 命令行入口，不在应用内导入
+
+用法：
+    python -m app.services.db_admin rebuild-stats
+    python -m app.services.db_admin --db data/destiny.db rebuild-stats
+"""
+import argparse
+from typing import List, Optional
+
+from app.config.settings import get_settings
+from app.services.database_service import DatabaseService
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Destiny 数据库工具")
+    parser.add_argument("--db", default=None, help="SQLite 数据库路径（默认读取 DATABASE_URL）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("rebuild-stats", help="从历史交互和会话重建统计汇总表")
+
+    args = parser.parse_args(argv)
+    db_path = args.db
+    if db_path is None:
+        url = get_settings().DATABASE_URL or ""
+        db_path = url.replace('sqlite:///', '') if url.startswith('sqlite:///') else "data/destiny.db"
+    db_service = DatabaseService(db_path)
+    try:
+        if args.command == "rebuild-stats":
+            rows = db_service.rebuild_stats_rollups()
+            stats = db_service.get_global_stats()
+            print(f"Rebuilt {rows} daily rows: {stats['total_interactions']} interactions, {stats['total_users']} users")
+    finally:
+        db_service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+上游 HTTP 连接池 - LLM 调用共享的异步 HTTP 客户端
+
+启动时创建并预热（提前完成 TCP/TLS 握手），通过 litellm.aclient_session
+交给 litellm 复用，关闭时统一释放连接
+
+使用情况由包在 httpx 传输层外的计数器统计（只依赖 httpx 的公开传输接口），
+请求从发出到响应体关闭之间算作进行中
+"""
+import asyncio
+import logging
+import time
+import urllib.request
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import litellm
+
+logger = logging.getLogger(__name__)
+
+# 未配置 LLM_BASE_URL 时的默认上游（OpenAI 兼容）
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _environment_proxy(url: str) -> Optional[str]:
+    """按环境变量（HTTPS_PROXY / NO_PROXY 等）取上游代理；自带传输层时 httpx 不再读取这些变量"""
+    parts = urlsplit(url)
+    if parts.hostname and urllib.request.proxy_bypass(parts.hostname):
+        return None
+    return urllib.request.getproxies().get(parts.scheme)
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    """响应体关闭时结束计数（只结束一次）"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """统计进行中请求数的传输层包装"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.http2_responses = 0
+
+    def _finish(self):
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._finish()
+            raise
+        if response.extensions.get("http_version") == b"HTTP/2":
+            self.http2_responses += 1
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_CountedStream(response.stream, self._finish),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class HTTPPool:
+    """共享的上游 HTTP 连接池"""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        warm_connections: int = 2,
+        timeout: float = 30.0
+    ):
+        """
+        Args:
+            base_url: 上游地址（预热时访问）
+            max_connections: 最大连接数
+            max_keepalive: 最多保持的空闲连接数
+            keepalive_expiry: 空闲连接保持时间（秒）
+            http2: 是否启用 HTTP/2（需要安装 h2）
+            warm_connections: 启动时预先建立的连接数
+            timeout: 默认超时（秒），单次调用仍以 litellm 的 timeout 参数为准
+        """
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.warm_connections = warm_connections
+        self.timeout = timeout
+
+        self.client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[_CountingTransport] = None
+        self.stats = {"requests": 0, "warmed": 0, "warm_seconds": 0.0}
+
+        if self.http2 and not _http2_available():
+            logger.warning("h2 not installed, upstream HTTP pool falls back to HTTP/1.1")
+            self.http2 = False
+
+    async def _on_request(self, request: httpx.Request):
+        self.stats["requests"] += 1
+
+    def open(self) -> httpx.AsyncClient:
+        """创建客户端并交给 litellm 使用（重复调用返回同一个客户端）"""
+        if self.client is not None:
+            return self.client
+        self._transport = _CountingTransport(httpx.AsyncHTTPTransport(
+            http2=self.http2,
+            proxy=_environment_proxy(self.base_url),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            )
+        ))
+        self.client = httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(self.timeout),
+            event_hooks={"request": [self._on_request]}
+        )
+        litellm.aclient_session = self.client
+        logger.info(
+            f"Upstream HTTP pool opened: max={self.max_connections}, "
+            f"keepalive={self.max_keepalive}, http2={self.http2}"
+        )
+        return self.client
+
+    async def warm(self, connections: Optional[int] = None) -> int:
+        """
+        预热：并发请求上游，提前建立连接
+
+        只关心握手，不关心响应状态码（未授权的 /models 也能完成握手）
+
+        Returns:
+            成功建立的连接数
+        """
+        client = self.open()
+        count = self.warm_connections if connections is None else connections
+        count = min(count, self.max_keepalive, self.max_connections)
+        if count <= 0:
+            return 0
+
+        started = time.monotonic()
+
+        async def touch() -> bool:
+            try:
+                response = await client.get(f"{self.base_url}/models", timeout=5.0)
+                await response.aclose()
+                return True
+            except Exception as e:
+                logger.warning(f"Upstream HTTP pool warm-up failed: {e}")
+                return False
+
+        # HTTP/2 下一条连接即可多路复用，只需握手一次
+        results = await asyncio.gather(*(touch() for _ in range(1 if self.http2 else count)))
+        warmed = sum(results)
+        self.stats["warmed"] += warmed
+        self.stats["warm_seconds"] = time.monotonic() - started
+        logger.info(f"Upstream HTTP pool warmed: {warmed} connection(s) in {self.stats['warm_seconds']:.3f}s")
+        return warmed
+
+    async def close(self):
+        """关闭连接池"""
+        if self.client is None:
+            return
+        if litellm.aclient_session is self.client:
+            litellm.aclient_session = None
+        await self.client.aclose()
+        self.client = None
+        self._transport = None
+        logger.info("Upstream HTTP pool closed")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """连接池使用情况"""
+        stats: Dict[str, Any] = {
+            "open": self.client is not None,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            **self.stats,
+        }
+        transport = self._transport
+        if transport is not None and self.client is not None:
+            stats.update({
+                "in_flight_requests": transport.in_flight,
+                "peak_in_flight_requests": transport.peak_in_flight,
+                "http2_responses": transport.http2_responses,
+            })
+            # HTTP/1.1 下每个进行中的请求占用一条连接；HTTP/2 多路复用，不按连接数计算
+            if not self.http2 and self.max_connections:
+                stats["utilization"] = min(1.0, transport.in_flight / self.max_connections)
+        return stats
@@ -4,16 +4,50 @@ LLM服务 - 使用LiteLLM作为多服务接入层
 import asyncio
 import logging
 import os
-from typing import Optional, Dict
+import time
+from collections import deque
+from typing import Optional, Dict, Deque, List, AsyncIterator
 from litellm import acompletion
 import litellm
 
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.http_pool import HTTPPool
+from app.utils.deadline import Deadline
+from app.utils.single_flight import SingleFlight, make_flight_key
+
 logger = logging.getLogger(__name__)
 
 # 配置litellm日志级别
 litellm.set_verbose = False
 
 
+class LatencyTracker:
+    """按模型记录最近的调用延迟（秒），用于计算分位数"""
+    
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+    
+    def record(self, model: str, seconds: float):
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+    
+    def percentile(self, model: str, p: float) -> Optional[float]:
+        """样本不足 min_samples 时返回 None"""
+        samples = self._samples.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+    
+    def models(self) -> List[str]:
+        return list(self._samples)
+
+
 class LLMService:
     """LLM服务类 - 使用LiteLLM统一接口"""
     
@@ -28,6 +62,49 @@ class LLMService:
         self.fallback_model = config.get('fallback_model', self.model)
         self.temperature = config.get('temperature', 0.7)
         self.max_tokens = config.get('max_tokens', 300)
+        self.timeout = config.get('timeout', 30.0)  # 上游超时上限（秒）
+        
+        # 对冲请求（主模型慢时并行请求备用模型）
+        self.hedge_enabled = config.get('hedge_enabled', False)
+        self.hedge_percentile = config.get('hedge_percentile', 0.95)
+        self.hedge_min_delay = config.get('hedge_min_delay', 0.2)
+        self.hedge_default_delay = config.get('hedge_default_delay', 2.0)
+        self.latency = LatencyTracker()
+        # 流式调用只记录首块延迟，且与非流式分开，不影响对冲延迟和 observed_latency
+        self.stream_latency = LatencyTracker()
+        if self.hedge_enabled and self.fallback_model == self.default_model:
+            # 对冲到同一个模型只会把负载翻倍
+            logger.warning("LLM hedging disabled: FALLBACK_LLM_MODEL is not set to a different model")
+            self.hedge_enabled = False
+        
+        # 按模型的熔断器
+        self.breaker_enabled = config.get('breaker_enabled', True)
+        self.breaker_config = config.get('breaker_config', {})
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.hedge_stats = {
+            "requests": 0,
+            "hedged": 0,
+            "wins": {"primary": 0, "hedge": 0},
+            "wins_by_model": {},
+        }
+        
+        # 合并完全相同的并发调用（同一提示词、模型和生成参数）
+        self.single_flight: Optional[SingleFlight] = (
+            SingleFlight() if config.get('single_flight_enabled', True) else None
+        )
+        
+        # 共享的上游 HTTP 连接池（在 start() 中创建并预热）
+        self.http_pool: Optional[HTTPPool] = None
+        if config.get('http_pool_enabled', True):
+            self.http_pool = HTTPPool(
+                base_url=self.base_url,
+                max_connections=config.get('http_pool_size', 20),
+                max_keepalive=config.get('http_keepalive', 10),
+                keepalive_expiry=config.get('http_keepalive_expiry', 60.0),
+                http2=config.get('http2', True),
+                warm_connections=config.get('http_warm_connections', 2),
+                timeout=self.timeout
+            )
         
         # 设置环境变量供LiteLLM使用
         if self.api_key:
@@ -56,7 +133,194 @@ class LLMService:
             ]
         }
     
-    async def generate(self, prompt: str, language: str = 'zh', model: Optional[str] = None) -> str:
+    async def start(self):
+        """打开并预热上游连接池（应用启动时调用）"""
+        if self.http_pool is None:
+            return
+        self.http_pool.open()
+        await self.http_pool.warm()
+    
+    async def close(self):
+        """关闭上游连接池（应用关闭时调用）"""
+        if self.http_pool is not None:
+            await self.http_pool.close()
+    
+    def get_pool_stats(self) -> Dict:
+        """获取上游连接池使用情况"""
+        if self.http_pool is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.http_pool.get_stats()}
+    
+    def _build_call_params(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        timeout: float
+    ) -> Dict:
+        """准备 litellm 调用参数"""
+        call_params = {
+            "model": model,
+            "messages": [{
+                "role": "user",
+                "content": prompt
+            }],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "timeout": timeout
+        }
+        
+        # 如果配置了自定义base_url，添加api_base参数
+        if self.base_url:
+            call_params["api_base"] = self.base_url
+        
+        return call_params
+    
+    async def _call_model(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        timeout: float
+    ) -> str:
+        """
+        调用单个模型并记录延迟（timeout 为硬上限）
+        
+        熔断器打开时立即抛出 CircuitOpenError，不产生网络等待
+        """
+        if timeout <= 0:
+            raise asyncio.TimeoutError(f"No time budget left for {model}")
+        
+        breaker = self._get_breaker(model)
+        if breaker is not None and not breaker.allow_request():
+            raise CircuitOpenError(model)
+        
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                acompletion(**self._build_call_params(model, prompt, temperature, max_tokens, timeout)),
+                timeout
+            )
+        except asyncio.CancelledError:
+            # 被取消（例如对冲落败）不计入熔断统计
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        
+        elapsed = time.monotonic() - started
+        self.latency.record(model, elapsed)
+        if breaker is not None:
+            breaker.record_success(elapsed)
+        
+        # 提取生成的文本
+        return response.choices[0].message.content.strip()
+    
+    def _get_breaker(self, model: str) -> Optional[CircuitBreaker]:
+        """获取（按需创建）模型的熔断器，未启用时返回 None"""
+        if not self.breaker_enabled:
+            return None
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(model, **self.breaker_config)
+        return breaker
+    
+    def get_breaker_states(self) -> Dict[str, Dict]:
+        """获取各模型熔断器状态"""
+        return {model: breaker.snapshot() for model, breaker in self.breakers.items()}
+    
+    def _timeout(self, deadline: Optional[Deadline]) -> float:
+        """上游超时：配置的超时上限与剩余预算取小"""
+        if deadline is None:
+            return self.timeout
+        return deadline.timeout(self.timeout)
+    
+    def observed_latency(self, model: Optional[str] = None) -> Optional[float]:
+        """模型的典型延迟（p50，秒），样本不足时返回 None"""
+        return self.latency.percentile(model or self.default_model, 0.5)
+    
+    def _hedge_delay(self, model: str) -> float:
+        """对冲延迟：主模型历史延迟的分位数，样本不足时使用默认值"""
+        observed = self.latency.percentile(model, self.hedge_percentile)
+        if observed is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, observed)
+    
+    async def _generate_hedged(
+        self,
+        primary_model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        deadline: Optional[Deadline] = None
+    ) -> str:
+        """
+        对冲请求：主模型超过分位数延迟仍未返回时并行发起备用模型请求，
+        取先成功的结果并取消另一个
+        """
+        self.hedge_stats["requests"] += 1
+        primary = asyncio.ensure_future(self._call_model(
+            primary_model, prompt, temperature, max_tokens, self._timeout(deadline)
+        ))
+        tasks = {primary: primary_model}
+        
+        try:
+            hedge_delay = self._hedge_delay(primary_model)
+            if deadline is not None:
+                hedge_delay = min(hedge_delay, deadline.remaining())
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if not done:
+                self.hedge_stats["hedged"] += 1
+                logger.info("Hedging %s with %s", primary_model, self.fallback_model)
+                hedge = asyncio.ensure_future(self._call_model(
+                    self.fallback_model, prompt, temperature, max_tokens, self._timeout(deadline)
+                ))
+                tasks[hedge] = self.fallback_model
+            
+            pending = set(tasks)
+            last_error: Optional[Exception] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        role = "primary" if task is primary else "hedge"
+                        self.hedge_stats["wins"][role] += 1
+                        self.hedge_stats["wins_by_model"][winner] = \
+                            self.hedge_stats["wins_by_model"].get(winner, 0) + 1
+                        return task.result()
+                    last_error = task.exception()
+                    logger.error(f"LLM generation failed with {tasks[task]}: {last_error}")
+                
+                # 主模型在对冲前就失败了，立即发起备用模型请求
+                if not pending and len(tasks) == 1 and primary_model != self.fallback_model:
+                    hedge = asyncio.ensure_future(self._call_model(
+                        self.fallback_model, prompt, temperature, max_tokens, self._timeout(deadline)
+                    ))
+                    tasks[hedge] = self.fallback_model
+                    pending = {hedge}
+            
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def generate(
+        self,
+        prompt: str,
+        language: str = 'zh',
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        raise_on_error: bool = False,
+        deadline: Optional[Deadline] = None
+    ) -> str:
         """
         生成文本
         
@@ -64,80 +328,218 @@ class LLMService:
             prompt: 提示词
             language: 语言（'zh' 或 'en'）
             model: 指定模型，如果不指定则使用默认模型
+            temperature: 温度参数，不指定则使用配置值
+            max_tokens: 最大输出令牌数，不指定则使用配置值
+            raise_on_error: 主备模型都失败时抛出异常，而不是返回预设答案
+            deadline: 请求截止时间，上游超时由剩余预算推导
             
         Returns:
             生成的文本
         """
         model_to_use = model or self.default_model
+        temperature = self.temperature if temperature is None else temperature
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
         
         try:
-            logger.info(f"Generating with model: {model_to_use}, language: {language}")
-            
-            # 准备调用参数
-            call_params = {
-                "model": model_to_use,
-                "messages": [{
-                    "role": "user",
-                    "content": prompt
-                }],
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-                "timeout": 30.0  # 30秒超时
-            }
-            
-            # 如果配置了自定义base_url，添加api_base参数
-            if self.base_url:
-                call_params["api_base"] = self.base_url
-            
-            # 使用litellm进行异步调用
-            response = await acompletion(**call_params)
-            
-            # 提取生成的文本
-            result = response.choices[0].message.content.strip()
-            
-            logger.info(f"LLM generation successful: {len(result)} chars")
+            if self.single_flight is None:
+                return await self._generate_upstream(
+                    model_to_use, prompt, language, temperature, max_tokens, deadline
+                )
+            # 完全相同的并发调用合并为一次上游请求，每个调用者按自己的预算等待。
+            # 共享的上游调用不属于任何一个调用者，只受配置的超时上限约束，
+            # 否则预算更长的调用者会被第一个调用者的截止时间拖累
+            key = make_flight_key(model_to_use, temperature, max_tokens, prompt)
+            return await self.single_flight.do(
+                key,
+                lambda: self._generate_upstream(
+                    model_to_use, prompt, language, temperature, max_tokens, None
+                ),
+                timeout=deadline.remaining() if deadline is not None else None
+            )
+        except Exception as e:
+            if raise_on_error:
+                raise
+            logger.error(f"LLM generation failed, using preset answer: {str(e)}")
+            # 最后使用预设答案
+            return self._get_fallback_response(language)
+    
+    async def _generate_upstream(
+        self,
+        model_to_use: str,
+        prompt: str,
+        language: str,
+        temperature: float,
+        max_tokens: int,
+        deadline: Optional[Deadline]
+    ) -> str:
+        """调用上游（对冲或主备顺序），全部失败时抛出最后一个异常"""
+        if self.hedge_enabled and model_to_use != self.fallback_model:
+            try:
+                logger.info("Generating with model: %s (hedged), language: %s", model_to_use, language)
+                result = await self._generate_hedged(
+                    model_to_use, prompt, temperature, max_tokens, deadline
+                )
+                logger.info("LLM generation successful: %d chars", len(result))
+                return result
+            except Exception as e:
+                logger.error(f"Hedged generation failed: {str(e)}")
+                raise
+        
+        try:
+            logger.info("Generating with model: %s, language: %s", model_to_use, language)
+            result = await self._call_model(
+                model_to_use, prompt, temperature, max_tokens, self._timeout(deadline)
+            )
+            logger.info("LLM generation successful: %d chars", len(result))
             return result
             
         except Exception as e:
             logger.error(f"LLM generation failed with {model_to_use}: {str(e)}")
             
-            # 如果主模型失败，尝试使用备用模型
-            if model_to_use != self.fallback_model:
+            # 如果主模型失败，尝试使用备用模型（预算耗尽时跳过）
+            if model_to_use == self.fallback_model or (deadline and deadline.expired()):
+                raise
+            
+            try:
+                logger.info("Trying fallback model: %s", self.fallback_model)
+                result = await self._call_model(
+                    self.fallback_model, prompt, temperature, max_tokens, self._timeout(deadline)
+                )
+                logger.info("Fallback generation successful: %d chars", len(result))
+                return result
+                
+            except Exception as fallback_error:
+                logger.error(f"Fallback model also failed: {str(fallback_error)}")
+                raise
+    
+    async def _stream_model(
+        self,
+        model: str,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        deadline: Optional[Deadline]
+    ) -> AsyncIterator[str]:
+        """流式调用单个模型，逐块产出文本（熔断和超时规则与 _call_model 相同）"""
+        timeout = self._timeout(deadline)
+        if timeout <= 0:
+            raise asyncio.TimeoutError(f"No time budget left for {model}")
+        
+        breaker = self._get_breaker(model)
+        if breaker is not None and not breaker.allow_request():
+            raise CircuitOpenError(model)
+        
+        started = time.monotonic()
+        first_chunk: Optional[float] = None
+        call_params = self._build_call_params(model, prompt, temperature, max_tokens, timeout)
+        call_params["stream"] = True
+        try:
+            response = await asyncio.wait_for(acompletion(**call_params), timeout)
+            chunks = response.__aiter__()
+            while True:
                 try:
-                    logger.info(f"Trying fallback model: {self.fallback_model}")
-                    
-                    fallback_params = {
-                        "model": self.fallback_model,
-                        "messages": [{
-                            "role": "user",
-                            "content": prompt
-                        }],
-                        "temperature": self.temperature,
-                        "max_tokens": self.max_tokens,
-                        "timeout": 30.0
-                    }
-                    
-                    if self.base_url:
-                        fallback_params["api_base"] = self.base_url
-                    
-                    response = await acompletion(**fallback_params)
-                    
-                    result = response.choices[0].message.content.strip()
-                    logger.info(f"Fallback generation successful: {len(result)} chars")
-                    return result
-                    
-                except Exception as fallback_error:
-                    logger.error(f"Fallback model also failed: {str(fallback_error)}")
+                    chunk = await asyncio.wait_for(chunks.__anext__(), self._timeout(deadline))
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first_chunk is None:
+                        first_chunk = time.monotonic() - started
+                    yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        
+        # 整个流的时长取决于输出长度，慢调用判断和延迟统计都按首块延迟
+        elapsed = first_chunk if first_chunk is not None else time.monotonic() - started
+        self.stream_latency.record(model, elapsed)
+        if breaker is not None:
+            breaker.record_success(elapsed)
+    
+    async def stream(
+        self,
+        prompt: str,
+        language: str = 'zh',
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[str]:
+        """
+        流式生成文本
+        
+        主模型在产出第一个片段之前失败时改用备用模型；已经开始输出后失败则直接抛出。
+        全部失败时抛出异常（不返回预设答案，由调用方决定回退内容）
+        
+        Args:
+            prompt: 提示词
+            language: 语言（'zh' 或 'en'）
+            model: 指定模型，如果不指定则使用默认模型
+            temperature: 温度参数，不指定则使用配置值
+            max_tokens: 最大输出令牌数，不指定则使用配置值
+            deadline: 请求截止时间
             
-            # 最后使用预设答案
-            return self._get_fallback_response(language)
+        Yields:
+            文本片段
+        """
+        model_to_use = model or self.default_model
+        temperature = self.temperature if temperature is None else temperature
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        
+        models = [model_to_use]
+        if self.fallback_model != model_to_use:
+            models.append(self.fallback_model)
+        
+        last_error: Optional[Exception] = None
+        for candidate in models:
+            if deadline is not None and deadline.expired():
+                break
+            started_output = False
+            try:
+                logger.info("Streaming with model: %s, language: %s", candidate, language)
+                async for delta in self._stream_model(candidate, prompt, temperature, max_tokens, deadline):
+                    started_output = True
+                    yield delta
+                return
+            except Exception as e:
+                logger.error(f"LLM streaming failed with {candidate}: {str(e)}")
+                last_error = e
+                if started_output:
+                    raise
+        
+        raise last_error or asyncio.TimeoutError("No time budget left for streaming")
+    
+    def get_single_flight_stats(self) -> Dict:
+        """获取并发调用合并统计"""
+        if self.single_flight is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.single_flight.get_stats()}
+    
+    def get_hedge_stats(self) -> Dict:
+        """获取对冲请求统计"""
+        requests = self.hedge_stats["requests"]
+        return {
+            "enabled": self.hedge_enabled,
+            "requests": requests,
+            "hedged": self.hedge_stats["hedged"],
+            "hedge_rate": self.hedge_stats["hedged"] / requests if requests else 0.0,
+            "wins": dict(self.hedge_stats["wins"]),
+            "wins_by_model": dict(self.hedge_stats["wins_by_model"]),
+            "latency_p50": {m: self.latency.percentile(m, 0.5) for m in self.latency.models()},
+            "latency_p95": {m: self.latency.percentile(m, 0.95) for m in self.latency.models()},
+        }
     
     def _get_fallback_response(self, language: str) -> str:
         """获取备用答案"""
         import random
         responses = self.fallback_responses.get(language, self.fallback_responses['zh'])
         response = random.choice(responses)
-        logger.info(f"Using fallback response: {response}")
+        logger.info("Using fallback response: %s", response)
         return response
     
     async def test_connection(self, model: Optional[str] = None) -> Dict:
@@ -183,6 +585,48 @@ class LLMService:
             }
 
 
+def build_llm_config(settings) -> Dict:
+    """根据应用设置构建 LLM 服务配置"""
+    return {
+        'provider': settings.LLM_PROVIDER,
+        'api_key': settings.LLM_API_KEY,
+        'base_url': settings.LLM_BASE_URL,
+        'model': settings.LLM_MODEL,
+        'max_context_tokens': settings.LLM_MAX_CONTEXT_TOKENS,
+        'temperature': settings.LLM_TEMPERATURE,
+        'max_tokens': settings.LLM_MAX_TOKENS,
+        'timeout': settings.LLM_TIMEOUT,
+        # 向后兼容旧配置
+        'default_model': settings.DEFAULT_LLM_MODEL or settings.LLM_MODEL,
+        'fallback_model': settings.FALLBACK_LLM_MODEL or settings.LLM_MODEL,
+        # 对冲请求
+        'hedge_enabled': settings.LLM_HEDGE_ENABLED,
+        'hedge_percentile': settings.LLM_HEDGE_PERCENTILE,
+        'hedge_min_delay': settings.LLM_HEDGE_MIN_DELAY,
+        'hedge_default_delay': settings.LLM_HEDGE_DEFAULT_DELAY,
+        # 熔断器
+        'breaker_enabled': settings.LLM_BREAKER_ENABLED,
+        'breaker_config': {
+            'window_size': settings.LLM_BREAKER_WINDOW,
+            'min_calls': settings.LLM_BREAKER_MIN_CALLS,
+            'failure_rate_threshold': settings.LLM_BREAKER_FAILURE_RATE,
+            'slow_call_seconds': settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+            'slow_call_rate_threshold': settings.LLM_BREAKER_SLOW_CALL_RATE,
+            'open_seconds': settings.LLM_BREAKER_OPEN_SECONDS,
+            'half_open_probes': settings.LLM_BREAKER_HALF_OPEN_PROBES,
+        },
+        # 相同并发调用合并
+        'single_flight_enabled': settings.LLM_SINGLE_FLIGHT_ENABLED,
+        # 上游 HTTP 连接池
+        'http_pool_enabled': settings.LLM_HTTP_POOL_ENABLED,
+        'http_pool_size': settings.LLM_HTTP_POOL_SIZE,
+        'http_keepalive': settings.LLM_HTTP_KEEPALIVE,
+        'http_keepalive_expiry': settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        'http2': settings.LLM_HTTP2,
+        'http_warm_connections': settings.LLM_HTTP_WARM_CONNECTIONS,
+    }
+
+
 # 创建全局实例
 llm_service: Optional[LLMService] = None
 
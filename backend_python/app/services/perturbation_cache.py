@@ -0,0 +1,307 @@
+"""
+微扰结果缓存 - LLMPerturbation.perturb 前置的两级缓存
+
+一级：进程内 LRU + TTL
+二级：可选的磁盘缓存（SQLite 文件），重启后依然有效。
+     磁盘读写都在专用的单个线程中执行，事件循环上只访问内存：
+     内存未命中时 get_variant 等待磁盘线程读取，写入只提交给磁盘线程、不等待
+
+缓存键使用量化后的特征（长度分类、时段分桶、次数分桶），
+每个条目保存多条变体，命中时随机返回其中一条，保证回答仍有变化。
+
+export_entry / import_entry 供共享缓存（Redis）在多个进程之间同步条目。
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    """缓存条目：一组变体 + 创建时间"""
+
+    __slots__ = ("variants", "generated", "created_at")
+
+    def __init__(self, variants: List[str], generated: int, created_at: float):
+        self.variants = variants
+        self.generated = generated  # 已生成次数（含重复结果），用于判断是否填满
+        self.created_at = created_at
+
+
+class PerturbationCache:
+    """微扰结果两级缓存"""
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl: int = 3600,
+        variants_per_entry: int = 4,
+        disk_path: Optional[str] = None
+    ):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 内存中最多保存的条目数
+            ttl: 条目有效期（秒）
+            variants_per_entry: 每个条目需要积累的变体数
+            disk_path: 磁盘缓存文件路径，为空则不启用磁盘缓存
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants_per_entry = max(1, variants_per_entry)
+        self.disk_path = disk_path
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_executor: Optional[ThreadPoolExecutor] = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            self._init_disk(disk_path)
+
+    def _init_disk(self, disk_path: str):
+        """初始化磁盘缓存"""
+        try:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS perturbation_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    variants TEXT NOT NULL,
+                    generated INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._disk.commit()
+            # 连接只在这个线程中使用，读写按提交顺序执行
+            self._disk_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="perturb-disk")
+            logger.info(f"Perturbation disk cache enabled: {disk_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to open perturbation disk cache, memory only: {e}")
+            self._disk = None
+
+    @staticmethod
+    def make_key(mother_verdict: str, features, language: str) -> str:
+        """
+        根据量化特征构建缓存键
+
+        使用 length_category / hour_bucket / attempt_bucket 而不是原始数值，
+        以提高命中率
+        """
+        return "|".join((
+            language,
+            features.length_category,
+            features.hour_bucket,
+            features.attempt_bucket,
+            mother_verdict
+        ))
+
+    def _is_expired(self, entry: _CacheEntry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created_at > self.ttl
+
+    def _lookup(self, key: str) -> Optional[_CacheEntry]:
+        """查询内存，返回未过期的条目"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry, time.time()):
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+        return None
+
+    def _read_disk(self, key: str) -> Optional[_CacheEntry]:
+        """在磁盘线程中读取条目"""
+        if self._disk is None:
+            return None
+        try:
+            row = self._disk.execute(
+                "SELECT variants, generated, created_at FROM perturbation_cache WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Perturbation disk cache read failed: {e}")
+            return None
+        if not row:
+            return None
+        return _CacheEntry(json.loads(row[0]), row[1], row[2])
+
+    async def _lookup_disk(self, key: str) -> Optional[_CacheEntry]:
+        """内存中没有该键时，在磁盘线程中读取未过期的条目并放入内存"""
+        if self._disk_executor is None or key in self._entries:
+            return None
+        entry = await asyncio.get_running_loop().run_in_executor(self._disk_executor, self._read_disk, key)
+        if entry is None or self._is_expired(entry, time.time()):
+            return None
+        # 等待期间可能已有新的变体写入内存，以内存为准
+        current = self._lookup(key)
+        if current is not None:
+            return current
+        self.disk_hits += 1
+        self._store_memory(key, entry)
+        return entry
+
+    def _store_memory(self, key: str, entry: _CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write_disk(self, key: str, variants: List[str], generated: int, created_at: float):
+        """在磁盘线程中写入条目"""
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO perturbation_cache (cache_key, variants, generated, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(variants, ensure_ascii=False), generated, created_at)
+            )
+            self._disk.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Perturbation disk cache write failed: {e}")
+
+    def _store_disk(self, key: str, entry: _CacheEntry):
+        """把条目快照提交给磁盘线程写入（不等待）"""
+        if self._disk_executor is None:
+            return
+        self._disk_executor.submit(
+            self._write_disk, key, list(entry.variants), entry.generated, entry.created_at
+        )
+
+    async def get_variant(self, key: str) -> Optional[str]:
+        """
+        获取一条缓存变体
+
+        内存未命中时查询磁盘缓存；条目尚未积累足够变体时返回 None，由调用方继续请求 LLM 填充
+        """
+        entry = self._lookup(key) or await self._lookup_disk(key)
+        if entry is None or entry.generated < self.variants_per_entry:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return random.choice(entry.variants)
+
+    def add_variant(self, key: str, variant: str):
+        """向条目追加一条 LLM 生成的变体（同时在后台写入磁盘）"""
+        entry = self._lookup(key)
+        if entry is None:
+            entry = _CacheEntry([], 0, time.time())
+
+        entry.generated += 1
+        if variant not in entry.variants:
+            entry.variants.append(variant)
+
+        self._store_memory(key, entry)
+        self._store_disk(key, entry)
+
+    def export_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        """导出条目（写入共享缓存）"""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        return {"variants": entry.variants, "generated": entry.generated, "created_at": entry.created_at}
+
+    def import_entry(self, key: str, data: Dict[str, Any]) -> Optional[str]:
+        """
+        合并从共享缓存取到的条目
+
+        Returns:
+            合并后条目已填满时返回一条变体，否则返回 None
+        """
+        try:
+            shared = _CacheEntry(list(data["variants"]), int(data["generated"]), float(data["created_at"]))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if self._is_expired(shared, time.time()):
+            return None
+
+        entry = self._lookup(key)
+        if entry is not None:
+            for variant in entry.variants:
+                if variant not in shared.variants:
+                    shared.variants.append(variant)
+            shared.generated = max(shared.generated, entry.generated)
+            shared.created_at = min(shared.created_at, entry.created_at)
+
+        self._store_memory(key, shared)
+        if shared.generated < self.variants_per_entry or not shared.variants:
+            return None
+        self.shared_hits += 1
+        return random.choice(shared.variants)
+
+    def clear(self):
+        """清空缓存（包括磁盘）"""
+        self._entries.clear()
+        if self._disk_executor is not None:
+            self._disk_executor.submit(self._clear_disk)
+
+    def _clear_disk(self):
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute("DELETE FROM perturbation_cache")
+            self._disk.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Perturbation disk cache clear failed: {e}")
+
+    def close(self):
+        """等待未完成的磁盘写入后关闭磁盘缓存连接"""
+        if self._disk_executor is not None:
+            self._disk_executor.shutdown(wait=True)
+            self._disk_executor = None
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "disk_enabled": self._disk is not None
+        }
+
+
+# 全局缓存实例
+_perturbation_cache: Optional[PerturbationCache] = None
+
+
+def init_perturbation_cache(
+    max_entries: int = 2048,
+    ttl: int = 3600,
+    variants_per_entry: int = 4,
+    disk_path: Optional[str] = None
+) -> PerturbationCache:
+    """初始化微扰缓存"""
+    global _perturbation_cache
+    _perturbation_cache = PerturbationCache(
+        max_entries=max_entries,
+        ttl=ttl,
+        variants_per_entry=variants_per_entry,
+        disk_path=disk_path
+    )
+    return _perturbation_cache
+
+
+def get_perturbation_cache() -> Optional[PerturbationCache]:
+    """获取微扰缓存实例（未启用时返回 None）"""
+    return _perturbation_cache
@@ -0,0 +1,239 @@
+"""
+分享结果缓存 - /share/{id} 前置的进程内缓存
+
+- 分享结果生成后不再变化，LRU 缓存不设过期时间
+- /divine 生成结果时直接写入（write-through），热门分享不需要查数据库
+- 布隆过滤器记录所有存在的分享ID（从数据库按主键分页增量同步，不一次性加载全部ID），
+  枚举随机ID的请求在过滤器里就被拒绝
+- 过滤器误判或数据库里确实没有的ID做短时间的负缓存
+- 同一ID的并发查询合并为一次
+"""
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """布隆过滤器（双重哈希，位数组为 bytearray）"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        Args:
+            capacity: 预计元素数
+            error_rate: 元素数不超过 capacity 时的误判率
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class ShareResultCache:
+    """分享结果缓存（LRU + 负缓存 + 布隆过滤器）"""
+
+    def __init__(
+        self,
+        db_service=None,
+        max_entries: int = 50000,
+        negative_ttl: float = 60.0,
+        negative_max_entries: int = 100000,
+        bloom_capacity: int = 1000000,
+        bloom_error_rate: float = 0.01,
+        sync_interval: float = 1.0,
+        sync_batch_size: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            db_service: 异步数据库服务，用于同步布隆过滤器，为空则不启用过滤器
+            max_entries: 最多缓存的分享结果数
+            negative_ttl: 不存在的ID的缓存时间（秒）
+            negative_max_entries: 负缓存最多保存的ID数
+            bloom_capacity: 布隆过滤器的初始容量，超出后自动翻倍重建
+            bloom_error_rate: 布隆过滤器的误判率
+            sync_interval: 过滤器判定不存在时，距上次同步超过该时间（秒）才再次同步
+            sync_batch_size: 同步时每次从数据库读取的ID数
+            clock: 时钟（测试用）
+        """
+        self.db_service = db_service
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.negative_max_entries = negative_max_entries
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.sync_interval = sync_interval
+        self.sync_batch_size = max(1, sync_batch_size)
+        self._clock = clock
+
+        self._results: "OrderedDict[str, Any]" = OrderedDict()
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._bloom: Optional[BloomFilter] = None
+        self._last_id = 0
+        self._last_sync = float('-inf')
+        self._flight = SingleFlight()
+        self.stats = {"hits": 0, "negative_hits": 0, "bloom_rejects": 0, "loads": 0, "syncs": 0}
+
+    def put(self, share_id: str, result: Any):
+        """写入分享结果（/divine 生成结果后调用）"""
+        self._results[share_id] = result
+        self._results.move_to_end(share_id)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        self._negative.pop(share_id, None)
+        if self._bloom is not None:
+            self._bloom.add(share_id)
+
+    async def sync(self) -> int:
+        """
+        把数据库中新增的分享ID加入布隆过滤器（并发调用合并为一次）
+
+        Returns:
+            新增的ID数
+        """
+        if self.db_service is None:
+            return 0
+        return await self._flight.do("\0sync", self._sync)
+
+    async def _sync(self) -> int:
+        self._last_sync = self._clock()
+        bloom = self._bloom
+        last_id = self._last_id
+        if bloom is None:
+            bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        added = 0
+        while True:
+            try:
+                rows = await self.db_service.get_result_ids_since(last_id, self.sync_batch_size)
+            except Exception as e:
+                logger.warning(f"Share cache sync failed: {e}")
+                if bloom is not self._bloom:
+                    return 0  # 未建完的过滤器会漏掉已有ID，继续使用旧的
+                break
+            if not rows:
+                break
+            if bloom.count + len(rows) > bloom.capacity:
+                # 超出容量：按更大的容量从头重建（建完之前继续使用旧过滤器）
+                self.bloom_capacity = max(self.bloom_capacity * 2, (bloom.count + len(rows)) * 2)
+                bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+                last_id = 0
+                added = 0
+                continue
+            for _, share_id in rows:
+                bloom.add(share_id)
+            last_id = rows[-1][0]
+            added += len(rows)
+            if len(rows) < self.sync_batch_size:
+                break
+
+        if bloom is not self._bloom:
+            # 同步期间 put 的ID只写进了旧过滤器
+            for share_id in self._results:
+                bloom.add(share_id)
+            logger.info("Share cache bloom filter built: capacity %d, %d ids", bloom.capacity, added)
+        self._bloom = bloom
+        self._last_id = last_id
+        self.stats["syncs"] += 1
+        return added
+
+    async def _maybe_exists(self, share_id: str) -> bool:
+        """布隆过滤器判断（判定不存在时先增量同步一次再判断）"""
+        if self._bloom is None or share_id in self._bloom:
+            return True
+        if self._clock() - self._last_sync >= self.sync_interval:
+            await self.sync()
+            return share_id in self._bloom
+        return False
+
+    async def get(self, share_id: str, loader: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """
+        获取分享结果
+
+        Args:
+            share_id: 分享ID
+            loader: 缓存未命中时的加载函数，不存在时返回 None，出错时抛出异常（不做负缓存）
+
+        Returns:
+            分享结果，不存在时返回 None
+        """
+        result = self._results.get(share_id)
+        if result is not None:
+            self._results.move_to_end(share_id)
+            self.stats["hits"] += 1
+            return result
+
+        now = self._clock()
+        expires_at = self._negative.get(share_id)
+        if expires_at is not None:
+            if expires_at > now:
+                self.stats["negative_hits"] += 1
+                return None
+            del self._negative[share_id]
+
+        if not await self._maybe_exists(share_id):
+            self.stats["bloom_rejects"] += 1
+            return None
+
+        return await self._flight.do(share_id, lambda: self._load(share_id, loader))
+
+    async def _load(self, share_id: str, loader) -> Optional[Any]:
+        self.stats["loads"] += 1
+        result = await loader()
+        if result is None:
+            self._negative[share_id] = self._clock() + self.negative_ttl
+            while len(self._negative) > self.negative_max_entries:
+                self._negative.popitem(last=False)
+        else:
+            self.put(share_id, result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["bloom_rejects"] + self.stats["loads"]
+        return {
+            "entries": len(self._results),
+            "negative_entries": len(self._negative),
+            "bloom_ids": self._bloom.count if self._bloom is not None else None,
+            "db_free_rate": 1 - self.stats["loads"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+
+# 全局实例（单例）
+_share_cache: Optional[ShareResultCache] = None
+
+
+async def init_share_cache(db_service=None, **kwargs) -> ShareResultCache:
+    """初始化分享结果缓存并同步布隆过滤器"""
+    global _share_cache
+    _share_cache = ShareResultCache(db_service, **kwargs)
+    await _share_cache.sync()
+    return _share_cache
+
+
+def get_share_cache() -> Optional[ShareResultCache]:
+    """获取分享结果缓存（未启用时返回 None）"""
+    return _share_cache
@@ -0,0 +1,152 @@
+"""
+SQLite 连接管理 - 长连接，一个写连接 + 读连接池
+
+- 连接在进程生命周期内复用，不再每次调用都 connect / close
+- WAL 模式：读不阻塞写，写不阻塞读；synchronous=NORMAL 时提交只写 WAL，不等待 fsync
+  （断电可能丢失最后几个事务，但数据库不会损坏）
+- mmap 和加大的页缓存减少读路径上的系统调用
+- 每个连接缓存预编译语句（sqlite3 的 cached_statements），相同 SQL 不重复解析
+- 写连接串行使用，事务以 BEGIN IMMEDIATE 开始，多进程写入时等待 busy_timeout
+  而不是在升级锁时直接失败
+"""
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionManager:
+    """一个写连接 + 最多 readers 个读连接"""
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        mmap_size_mb: int = 64,
+        cache_size_kb: int = 8192,
+        busy_timeout: float = 5.0,
+        cached_statements: int = 128
+    ):
+        """
+        Args:
+            path: 数据库文件路径
+            readers: 读连接数上限（按需创建）
+            mmap_size_mb: 每个连接的内存映射大小（MB），0 表示不使用 mmap
+            cache_size_kb: 每个连接的页缓存大小（KB）
+            busy_timeout: 等待其他进程释放锁的时间（秒）
+            cached_statements: 每个连接缓存的预编译语句数
+        """
+        self.path = path
+        self.max_readers = max(1, readers)
+        self.mmap_size = mmap_size_mb * 1024 * 1024
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self.stats = {"writes": 0, "reads": 0, "reader_waits": 0}
+
+        self._writer = self._connect()
+        mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning(f"SQLite WAL mode unavailable for {path}, using {mode}")
+        self.journal_mode = mode.lower()
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # 事务由 transaction() 显式控制
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    def _check_open(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Database connections are closed")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        在写连接上执行一个事务：正常退出时提交，出错时回滚并重新抛出
+        """
+        with self._write_lock:
+            self._check_open()
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self.stats["writes"] += 1
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """借用一个读连接（都在使用且已达上限时等待归还）"""
+        self._check_open()
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._readers_lock:
+                if len(self._all_readers) < self.max_readers:
+                    conn = self._connect(read_only=True)
+                    self._all_readers.append(conn)
+            if conn is None:
+                self.stats["reader_waits"] += 1
+                conn = self._readers.get()
+        try:
+            self.stats["reads"] += 1
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    def close(self):
+        """关闭全部连接（先让 SQLite 更新查询优化统计）"""
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._writer.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.debug(f"PRAGMA optimize failed: {e}")
+            self._writer.close()
+        with self._readers_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._all_readers.clear()
+        logger.info(f"SQLite connections closed: {self.path}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "journal_mode": self.journal_mode,
+            "readers_open": len(self._all_readers),
+            "readers_idle": self._readers.qsize(),
+            **self.stats,
+        }
@@ -0,0 +1,282 @@
+"""
+写缓冲 - 会话和交互记录异步批量落库
+
+请求处理只把记录放入队列，立即返回；后台任务把队列中的记录攒成一批，
+在一个事务里用 executemany 写入，提交次数从每个请求两次降到每批一次。
+
+- 队列有上限，写满时入队等待（反压），而不是无限占用内存
+- 取到第一条记录后最多再等 flush_interval 凑批，批大小不超过 batch_size
+- 整批写入失败时隔一会儿重试一次，仍失败则逐条写入，只丢弃写不进去的记录
+- 会话不进队列：同一用户的访问在内存中合并（累加访问次数、取最后访问时间），
+  每 session_interval 秒写入一次，反复算的用户每个周期只写一行
+- 本进程还没写过会话的用户（新用户），会话随他的第一条交互记录一起入队，
+  同批（或更早一批）写入，不会出现交互记录先于会话行落库
+- 关闭时先写完队列中的全部记录和未写入的会话
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.models.user_interaction import UserSession, UserInteraction
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """会话和交互记录的写缓冲队列（写入方法名与 DatabaseService 相同）"""
+
+    def __init__(
+        self,
+        db_service,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.1,
+        retry_delay: float = 0.5,
+        session_interval: float = 5.0,
+        known_users: int = 100000
+    ):
+        """
+        Args:
+            db_service: 异步数据库服务
+            max_size: 队列最多保存的记录数，写满时入队等待
+            batch_size: 每批最多写入的记录数
+            flush_interval: 取到第一条记录后等待凑批的时间（秒）
+            retry_delay: 整批写入失败后重试前的等待时间（秒）
+            session_interval: 合并后的会话写入间隔（秒），未写入的用户数达到 max_size 时提前写入
+            known_users: 记住最近多少个已写过会话的用户（其余用户的第一条交互会带上会话一起入队）
+        """
+        self.db = db_service
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.session_interval = session_interval
+        self.max_sessions = max(1, max_size)
+        self._sessions: Dict[str, UserSession] = {}
+        self.max_known_users = max(1, known_users)
+        self._known_users: "OrderedDict[str, None]" = OrderedDict()
+        self._session_task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=max(1, max_size))
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "dropped": 0,
+            "blocked_puts": 0,
+            "session_visits": 0,
+            "session_rows": 0,
+            "max_batch": 0,
+        }
+        self._flush_total = 0.0
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.ensure_future(self._run())
+            self._session_task = asyncio.ensure_future(self._run_sessions())
+
+    async def stop(self):
+        """停止后台任务，队列中的记录全部写入后返回"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._session_task
+        self._session_task = None
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        if rest:
+            await self._flush(rest)
+        await self.flush_sessions()
+        logger.info("Write-behind queue drained: %d records written", self.stats["written"])
+
+    async def _put(self, item):
+        if self._task is None:
+            # 未启动或已停止：直接写入
+            await self._flush([item])
+            return
+        if self._queue.full():
+            self.stats["blocked_puts"] += 1
+        await self._queue.put(item)
+        self.stats["enqueued"] += 1
+
+    async def save_or_update_session(self, session: UserSession):
+        """合并会话（同一用户累加访问次数），定期写入"""
+        self.stats["session_visits"] += session.visit_count
+        pending = self._sessions.get(session.user_id)
+        if pending is None:
+            self._sessions[session.user_id] = session.model_copy()
+        else:
+            pending.visit_count += session.visit_count
+            pending.last_visit = max(pending.last_visit, session.last_visit)
+            pending.user_agent = session.user_agent
+            pending.language = session.language
+        if self._task is None or len(self._sessions) >= self.max_sessions:
+            await self.flush_sessions()
+
+    async def flush_sessions(self):
+        """立即写入合并后的会话"""
+        if not self._sessions:
+            return
+        sessions = list(self._sessions.values())
+        self._sessions = {}
+        for session in sessions:
+            self._remember_user(session.user_id)
+        self.stats["session_rows"] += len(sessions)
+        await self._flush(sessions)
+
+    def _remember_user(self, user_id: str) -> bool:
+        """记录已写过会话的用户，返回之前是否已记录"""
+        known = self._known_users
+        if user_id in known:
+            known.move_to_end(user_id)
+            return True
+        known[user_id] = None
+        if len(known) > self.max_known_users:
+            known.popitem(last=False)
+        return False
+
+    async def _put_interaction(self, interaction: UserInteraction):
+        """交互记录入队；新用户的待写会话先入队，和交互记录一起落库"""
+        if not self._remember_user(interaction.user_id):
+            session = self._sessions.pop(interaction.user_id, None)
+            if session is not None:
+                self.stats["session_rows"] += 1
+                await self._put(session)
+        await self._put(interaction)
+
+    async def _run_sessions(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.session_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush_sessions()
+            except Exception as e:
+                logger.error(f"Write-behind session flush error: {e}", exc_info=True)
+
+    async def save_interaction(self, interaction: UserInteraction):
+        """交互记录入队"""
+        await self._put_interaction(interaction)
+
+    async def save_batch(self, session: Optional[UserSession], interactions: List[UserInteraction]):
+        """会话合并，一批交互记录入队"""
+        if session is not None:
+            await self.save_or_update_session(session)
+        for interaction in interactions:
+            await self._put_interaction(interaction)
+
+    async def _next_batch(self) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    await self._flush(batch)
+                except Exception as e:
+                    logger.error(f"Write-behind flush error: {e}", exc_info=True)
+            if stopping:
+                return
+
+    @staticmethod
+    def _split(items: List[Any]):
+        sessions = [item for item in items if isinstance(item, UserSession)]
+        interactions = [item for item in items if not isinstance(item, UserSession)]
+        return sessions, interactions
+
+    async def _flush(self, items: List[Any]):
+        started = time.perf_counter()
+        sessions, interactions = self._split(items)
+        dropped = 0
+        try:
+            await self.db.save_many(sessions, interactions)
+        except Exception as e:
+            logger.warning(f"Write-behind batch of {len(items)} failed, retrying: {e}")
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.retry_delay)
+            try:
+                await self.db.save_many(sessions, interactions)
+            except Exception:
+                # 逐条写入，找出写不进去的记录
+                for item in items:
+                    try:
+                        await self.db.save_many(*self._split([item]))
+                    except Exception as item_error:
+                        dropped += 1
+                        logger.error(f"Write-behind dropped {type(item).__name__}: {item_error}")
+        self.stats["batches"] += 1
+        self.stats["written"] += len(items) - dropped
+        self.stats["dropped"] += dropped
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(items))
+        self._flush_total += time.perf_counter() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            "queue_depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "avg_batch": (self.stats["written"] / batches) if batches else 0.0,
+            "avg_flush_ms": (self._flush_total / batches * 1000) if batches else 0.0,
+            "pending_sessions": len(self._sessions),
+            **self.stats,
+        }
+
+
+# 全局实例（单例）
+_write_behind: Optional[WriteBehindQueue] = None
+
+
+def init_write_behind_queue(db_service, **kwargs) -> WriteBehindQueue:
+    """初始化写缓冲队列并启动后台写入任务"""
+    global _write_behind
+    _write_behind = WriteBehindQueue(db_service, **kwargs)
+    _write_behind.start()
+    return _write_behind
+
+
+def get_write_behind_queue() -> Optional[WriteBehindQueue]:
+    """获取写缓冲队列（未启用时返回 None）"""
+    return _write_behind
+
+
+async def close_write_behind_queue():
+    """写完队列中的记录后关闭"""
+    global _write_behind
+    if _write_behind is not None:
+        await _write_behind.stop()
+        _write_behind = None
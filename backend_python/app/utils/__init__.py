@@ -2,5 +2,11 @@
 工具函数
 """
 from app.utils.security import hash_ip, get_client_ip, anonymize_user_agent
+from app.utils.deadline import Deadline
+from app.utils.single_flight import SingleFlight
+from app.utils.rate_limiter import MemoryRateLimiter, SQLiteRateLimiter
 
-__all__ = ['hash_ip', 'get_client_ip', 'anonymize_user_agent']
+__all__ = [
+    'hash_ip', 'get_client_ip', 'anonymize_user_agent', 'Deadline', 'SingleFlight',
+    'MemoryRateLimiter', 'SQLiteRateLimiter',
+]
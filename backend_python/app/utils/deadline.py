@@ -0,0 +1,40 @@
+"""
+请求截止时间 - 端到端延迟预算
+
+在接口入口创建，沿调用链传递，每个阶段都可以查询剩余时间
+"""
+import time
+from typing import Optional
+
+
+class Deadline:
+    """单次请求的延迟预算"""
+
+    __slots__ = ("budget", "expires_at")
+
+    def __init__(self, budget_seconds: float):
+        """
+        Args:
+            budget_seconds: 从现在起的总预算（秒）
+        """
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    @classmethod
+    def from_ms(cls, budget_ms: int) -> "Deadline":
+        return cls(budget_ms / 1000.0)
+
+    def remaining(self) -> float:
+        """剩余时间（秒），不小于 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """由剩余预算推导的超时时间，不超过 cap"""
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s)"
@@ -0,0 +1,319 @@
+"""
+速率限制 - 按用户的令牌桶
+
+- 每个用户一个桶：容量为 burst，按 RATE_LIMIT_PER_MINUTE / 60 每秒补充
+- 每个活跃 key 只保存 (令牌数, 上次更新时间)，空闲超过 idle_ttl 的 key 被清理
+  （idle_ttl 不小于桶从空到满的时间，清理不会让被限流的用户提前恢复）
+- 两种后端：
+  - memory：进程内，最快，只适合单 worker
+  - sqlite：一条 UPSERT 语句完成"补充 + 扣减"，多个 uvicorn worker 共享同一个文件；
+    在专用线程中执行，等待写锁时不阻塞事件循环
+- RATE_LIMIT_PER_MINUTE <= 0 视为不限流（不创建限流器）
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _check_cost(cost: int, capacity: float):
+    if cost > capacity:
+        raise ValueError(f"cost {cost} exceeds bucket capacity {capacity:g}")
+
+
+class MemoryRateLimiter:
+    """进程内令牌桶（按最近访问排序，便于从头部清理空闲 key）"""
+
+    def __init__(
+        self,
+        rate_per_minute: int,
+        burst: Optional[int] = None,
+        idle_ttl: float = 600.0,
+        max_keys: int = 100000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            rate_per_minute: 每分钟补充的令牌数
+            burst: 桶容量（默认等于每分钟令牌数）
+            idle_ttl: 空闲多久后清理
+            max_keys: 最多保留的 key 数，超出时清理最久未访问的
+            clock: 时钟（测试用）
+
+        Raises:
+            ValueError: rate_per_minute 不是正数
+        """
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive, got {rate_per_minute}")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or rate_per_minute)
+        self.idle_ttl = max(idle_ttl, self.capacity / self.rate)
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < self.idle_ttl and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def acquire(self, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """
+        尝试扣减令牌
+
+        Args:
+            key: 限流 key（用户ID）
+            cost: 本次消耗的令牌数（按全额扣减）
+
+        Returns:
+            (是否放行, 被拒绝时需要等待的秒数)
+
+        Raises:
+            ValueError: cost 超过桶容量（永远不可能放行，调用方应先拒绝）
+        """
+        _check_cost(cost, self.capacity)
+        now = self._clock()
+        cost = float(cost)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.capacity
+            bucket = self._buckets[key] = [tokens, now]
+        else:
+            tokens = min(self.capacity, bucket[0] + max(0.0, now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            bucket[1] = now
+            self.allowed += 1
+            result = (True, 0.0)
+        else:
+            bucket[0] = tokens
+            bucket[1] = now
+            self.limited += 1
+            result = (False, (cost - tokens) / self.rate)
+        self._evict(now)
+        return result
+
+    async def acquire_async(self, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """acquire 的协程版本（纯内存操作，直接执行）"""
+        return self.acquire(key, cost)
+
+    def close(self):
+        self._buckets.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "active_keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+# 补充和扣减在一条语句里完成：令牌不足时 WHERE 不成立，不更新也不返回行
+_ACQUIRE_SQL = """
+    INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :capacity - :cost, :now)
+    ON CONFLICT(key) DO UPDATE SET
+        tokens = min(:capacity, tokens + max(0, :now - updated) * :rate) - :cost,
+        updated = :now
+    WHERE min(:capacity, tokens + max(0, :now - updated) * :rate) >= :cost
+    RETURNING tokens
+"""
+
+_PEEK_SQL = """
+    SELECT min(:capacity, tokens + max(0, :now - updated) * :rate)
+    FROM rate_buckets WHERE key = :key
+"""
+
+
+class SQLiteRateLimiter:
+    """
+    基于 SQLite 的共享令牌桶（多进程共享同一个数据库文件）
+
+    限流状态丢了也无妨，所以使用 WAL + synchronous=OFF；
+    数据库繁忙超过 busy_timeout 时放行并记录告警，不让限流器拖慢请求
+    """
+
+    def __init__(
+        self,
+        path: str,
+        rate_per_minute: int,
+        burst: Optional[int] = None,
+        idle_ttl: float = 600.0,
+        busy_timeout: float = 0.05,
+        evict_every: int = 1000,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            path: 数据库文件路径
+            rate_per_minute: 每分钟补充的令牌数
+            burst: 桶容量（默认等于每分钟令牌数）
+            idle_ttl: 空闲多久后清理
+            busy_timeout: 等待写锁的最长时间（秒）
+            evict_every: 每多少次调用清理一次空闲 key
+            clock: 时钟，多进程共享时必须是墙上时间
+
+        Raises:
+            ValueError: rate_per_minute 不是正数
+        """
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive, got {rate_per_minute}")
+        self.path = path
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or rate_per_minute)
+        self.idle_ttl = max(idle_ttl, self.capacity / self.rate)
+        self.evict_every = max(1, evict_every)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+        # 锁等待和 busy_timeout 都在这个线程里发生，不占用事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit")
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, timeout=busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_buckets_updated ON rate_buckets (updated)")
+
+    def acquire(self, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """
+        尝试扣减令牌
+
+        Returns:
+            (是否放行, 被拒绝时需要等待的秒数)
+
+        Raises:
+            ValueError: cost 超过桶容量
+        """
+        _check_cost(cost, self.capacity)
+        params = {
+            "key": key,
+            "now": self._clock(),
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "cost": float(cost),
+        }
+        with self._lock:
+            try:
+                row = self._conn.execute(_ACQUIRE_SQL, params).fetchone()
+                if row is not None:
+                    self.allowed += 1
+                    result = (True, 0.0)
+                else:
+                    peek = self._conn.execute(_PEEK_SQL, params).fetchone()
+                    tokens = peek[0] if peek else 0.0
+                    self.limited += 1
+                    result = (False, max(0.0, params["cost"] - tokens) / self.rate)
+
+                self._calls += 1
+                if self._calls % self.evict_every == 0:
+                    self._conn.execute(
+                        "DELETE FROM rate_buckets WHERE updated < ?", (params["now"] - self.idle_ttl,)
+                    )
+                return result
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+                return True, 0.0
+
+    async def acquire_async(self, key: str, cost: int = 1) -> Tuple[bool, float]:
+        """在限流线程中执行 acquire，请求处理中使用"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.acquire, key, cost)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                active = self._conn.execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+            except sqlite3.Error:
+                active = None
+        return {
+            "backend": "sqlite",
+            "active_keys": active,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+
+
+# 全局实例（单例）
+_rate_limiter = None
+
+
+def init_rate_limiter(
+    rate_per_minute: int,
+    backend: str = "memory",
+    burst: Optional[int] = None,
+    idle_ttl: float = 600.0,
+    sqlite_path: str = "data/rate_limit.db"
+):
+    """
+    初始化速率限制器
+
+    Args:
+        rate_per_minute: 每分钟补充的令牌数，<= 0 表示不限流
+        backend: memory 或 sqlite（多 worker 共享）
+        burst: 桶容量（默认等于每分钟令牌数）
+        idle_ttl: 空闲 key 的清理时间（秒）
+        sqlite_path: sqlite 后端的数据库文件
+
+    Returns:
+        限流器；rate_per_minute <= 0 时返回 None
+    """
+    global _rate_limiter
+    if rate_per_minute <= 0:
+        _rate_limiter = None
+        logger.info("Rate limiter disabled: RATE_LIMIT_PER_MINUTE=%d", rate_per_minute)
+        return None
+    if backend == "sqlite":
+        _rate_limiter = SQLiteRateLimiter(sqlite_path, rate_per_minute, burst, idle_ttl)
+    else:
+        _rate_limiter = MemoryRateLimiter(rate_per_minute, burst, idle_ttl)
+    logger.info(
+        "Rate limiter initialized: %s, %d/min, burst %d",
+        backend, rate_per_minute, int(_rate_limiter.capacity)
+    )
+    return _rate_limiter
+
+
+def get_rate_limiter():
+    """获取速率限制器（未启用时返回 None）"""
+    return _rate_limiter
+
+
+def close_rate_limiter():
+    """关闭速率限制器"""
+    global _rate_limiter
+    if _rate_limiter is not None:
+        _rate_limiter.close()
+        _rate_limiter = None
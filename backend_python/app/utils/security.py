@@ -47,31 +47,31 @@ def get_client_ip(request: Request) -> str:
     if forwarded_for:
         # X-Forwarded-For 可能包含多个IP，取第一个
         ip = forwarded_for.split(",")[0].strip()
-        logger.debug(f"IP from X-Forwarded-For: {ip}")
+        logger.debug("IP from X-Forwarded-For: %s", ip)
         return ip
     
     # 2. X-Real-IP (Nginx常用)
     real_ip = request.headers.get("X-Real-IP")
     if real_ip:
-        logger.debug(f"IP from X-Real-IP: {real_ip}")
+        logger.debug("IP from X-Real-IP: %s", real_ip)
         return real_ip
     
     # 3. CF-Connecting-IP (Cloudflare)
     cf_ip = request.headers.get("CF-Connecting-IP")
     if cf_ip:
-        logger.debug(f"IP from CF-Connecting-IP: {cf_ip}")
+        logger.debug("IP from CF-Connecting-IP: %s", cf_ip)
         return cf_ip
     
     # 4. X-Client-IP
     client_ip = request.headers.get("X-Client-IP")
     if client_ip:
-        logger.debug(f"IP from X-Client-IP: {client_ip}")
+        logger.debug("IP from X-Client-IP: %s", client_ip)
         return client_ip
     
     # 5. 直接连接的IP
     if request.client:
         ip = request.client.host
-        logger.debug(f"IP from direct connection: {ip}")
+        logger.debug("IP from direct connection: %s", ip)
         return ip
     
     logger.warning("Could not determine client IP, using 'unknown'")
@@ -0,0 +1,98 @@
+"""
+请求合并（single-flight）- 相同的并发调用只执行一次
+
+第一个调用者发起真实调用，同一 key 的后续调用者等待同一个结果：
+- 结果和异常原样传给所有等待者
+- 单个等待者被取消或超时只影响它自己
+- 所有等待者都离开后才取消底层调用
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_flight_key(*parts: Any) -> str:
+    """由调用参数生成 key（提示词等长文本取哈希）"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class _Flight:
+    """一次进行中的调用"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按 key 合并进行中的异步调用"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "abandoned": 0}
+
+    async def do(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 合并键
+            factory: 没有进行中的调用时用来发起调用
+            timeout: 本调用者最多等待的时间（秒），不影响其他等待者
+
+        Returns:
+            调用结果（调用失败时抛出同样的异常）
+        """
+        self.stats["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.stats["executed"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            if timeout is None:
+                return await asyncio.shield(flight.task)
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # 最后一个等待者离开（取消或超时），没人需要这个结果了
+                self.stats["abandoned"] += 1
+                flight.task.cancel()
+                self._forget(key, flight)
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def in_flight(self) -> int:
+        """进行中的调用数"""
+        return len(self._flights)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "in_flight": len(self._flights),
+            "coalesce_rate": self.stats["coalesced"] / calls if calls else 0.0,
+        }
@@ -0,0 +1,225 @@
+"""
+结构化日志 - 把日志 I/O 移出事件循环
+
+- 队列处理器：请求路径只把 LogRecord 放进队列，格式化和写出在后台线程完成
+- 惰性字段：消息参数和结构化字段在写出时才计算（lazy() 包装的值只在真正输出时调用）
+- 按 logger 采样：高频的 INFO/DEBUG 日志按比例保留，WARNING 及以上始终保留
+- 输出格式：text（与原格式兼容，字段追加为 key=value）或 json（每行一个对象）
+
+用法：
+    logger.info("Fortune generated", extra=log_fields(user_id=user_id, ms=elapsed))
+    logger.info("Extracted features: %s", lazy(features.to_dict))
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord 自带的属性，JSON 输出时不当作额外字段
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "fields"}
+
+
+class lazy:
+    """惰性值：只有日志真正输出时才调用 func"""
+
+    __slots__ = ("func",)
+
+    def __init__(self, func: Callable[[], Any]):
+        self.func = func
+
+    def resolve(self) -> Any:
+        return self.func()
+
+    def __str__(self) -> str:
+        return str(self.func())
+
+    __repr__ = __str__
+
+
+def log_fields(**fields: Any) -> Dict[str, Any]:
+    """构造 extra 参数：logger.info("msg", extra=log_fields(a=1))"""
+    return {"fields": fields}
+
+
+def _resolve(value: Any) -> Any:
+    return value.resolve() if isinstance(value, lazy) else value
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按 logger 名称采样低级别日志
+
+    rates 的 key 是 logger 名称前缀（例如 "app.api"），取最长匹配；
+    WARNING 及以上级别不采样
+    """
+
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.INFO):
+        super().__init__()
+        self.rates = dict(rates)
+        self.max_level = max_level
+        self._cache: Dict[str, float] = {}
+        self.dropped = 0
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    不在调用线程格式化的队列处理器
+
+    标准 QueueHandler.prepare 会在调用线程格式化消息，这里原样入队，
+    由后台线程的处理器格式化；队列满时丢弃并计数，绝不阻塞事件循环
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，结构化字段追加为 key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={_resolve(value)}" for key, value in fields.items())
+        return text
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = _resolve(value)
+        # 直接通过 extra= 传入的其他字段
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = _resolve(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """解析 "app.api.divine=0.1,app.services=0.5" 格式的采样率"""
+    rates: Dict[str, float] = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampler: Optional[SamplingFilter] = None
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "text",
+    sample_rates: Optional[Dict[str, float]] = None,
+    queue_size: int = 10000,
+    stream=None
+) -> QueueListener:
+    """
+    配置根 logger：队列处理器 + 后台线程写出
+
+    重复调用会先停止之前的后台线程
+
+    Args:
+        level: 日志级别
+        fmt: "text" 或 "json"
+        sample_rates: logger 名称前缀 -> INFO/DEBUG 保留比例
+        queue_size: 队列上限，满了丢弃（0 表示不限）
+        stream: 输出流（默认 stderr）
+    """
+    global _listener, _queue_handler, _sampler
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _sampler = SamplingFilter(sample_rates or {})
+    _queue_handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """停止后台线程并写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        if _queue_handler is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """日志子系统统计（采样丢弃数、队列满丢弃数、当前队列长度）"""
+    return {
+        "sampled_out": _sampler.dropped if _sampler else 0,
+        "queue_dropped": _queue_handler.dropped if _queue_handler else 0,
+        "queue_depth": _queue_handler.queue.qsize() if _queue_handler else 0,
+    }
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,3 @@
+"""
+性能基准测试（压测与微基准）
+"""
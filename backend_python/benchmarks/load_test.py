@@ -0,0 +1,386 @@
+"""
+端到端压测 - 单个 worker 能承受多少流量
+
+启动本地 Mock LLM 和使用临时 SQLite 的 app.main:app（独立 uvicorn 进程），
+用开环（open-loop）负载发生器按固定到达率发请求：
+- 请求按计划时间发出，不等待前一个请求返回
+- 延迟从计划发出时间算起，排队等待也计入（避免 coordinated omission）
+- 并发上限用于保护压测进程本身，超出部分排队
+
+结果输出为 JSON（吞吐、p50/p95/p99/p999 延迟、错误率），可以在版本之间对比。
+
+用法：
+    python -m benchmarks.load_test run --rps 50 --duration 30 --output report.json
+    python -m benchmarks.load_test compare old.json new.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from tools.mock_llm_server import LatencyDistribution, MockLLMConfig, MockLLMServer  # noqa: E402
+
+# 压测结束后读取 /stats/system 用的密钥（只在临时应用进程中有效）
+STATS_API_KEY = "bench-stats-key"
+
+# 默认流量配比（接口名 -> 权重）
+DEFAULT_MIX = {
+    "divine": 60,
+    "share": 25,
+    "stats_global": 5,
+    "stats_user": 5,
+    "stats_user_recent": 5,
+}
+
+QUESTIONS_ZH = ["我该辞职吗？", "他还爱我吗", "", "明天会好吗？", "我是不是太焦虑了", "要不要换个城市生活？"]
+QUESTIONS_EN = ["Should I quit?", "Does she love me", "", "Will tomorrow be better?", "Am I overthinking this"]
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """最近秩分位数（输入已排序）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p * len(sorted_values) - 1e-9) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict[str, Any]:
+    """汇总单个接口（或全部）的结果，延迟单位毫秒"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    to_ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "throughput_rps": count / duration if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": to_ms(sum(ordered) / count) if count else None,
+            "p50": to_ms(percentile(ordered, 0.50)),
+            "p95": to_ms(percentile(ordered, 0.95)),
+            "p99": to_ms(percentile(ordered, 0.99)),
+            "p999": to_ms(percentile(ordered, 0.999)),
+            "max": to_ms(ordered[-1]) if count else None,
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppProcess:
+    """以独立进程运行 app.main:app（临时 SQLite，指向 Mock LLM）"""
+
+    def __init__(self, llm_base_url: str, workdir: str, extra_env: Optional[Dict[str, str]] = None):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workdir = workdir
+        self.env = {
+            **os.environ,
+            "LLM_API_KEY": "sk-mock",
+            "LLM_BASE_URL": llm_base_url,
+            "LLM_MODEL": "gpt-4o-mini",
+            "DATABASE_URL": f"sqlite:///{workdir}/destiny.db",
+            "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+            "LOG_LEVEL": "WARNING",
+            # 压测用户数有限，每个用户的请求频率远高于线上限额
+            "RATE_LIMIT_ENABLED": "false",
+            "STATS_API_KEY": STATS_API_KEY,
+            **(extra_env or {}),
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 60.0):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app",
+             "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=str(BACKEND_DIR),
+            env=self.env,
+            stdout=open(os.path.join(self.workdir, "app.log"), "wb"),
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"App exited early, see {self.workdir}/app.log")
+            try:
+                if httpx.get(f"{self.base_url}/health", timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("App did not become healthy in time")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadGenerator:
+    """开环负载发生器"""
+
+    def __init__(
+        self,
+        base_url: str,
+        rps: float,
+        duration: float,
+        concurrency: int,
+        mix: Dict[str, int],
+        users: int = 1000,
+        arrival: str = "poisson",
+        timeout: float = 30.0,
+        seed: int = 42
+    ):
+        self.base_url = base_url
+        self.rps = rps
+        self.duration = duration
+        self.concurrency = concurrency
+        self.endpoints = list(mix)
+        self.weights = [mix[name] for name in self.endpoints]
+        self.users = users
+        self.arrival = arrival
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+
+        self.share_ids: List[str] = []
+        self.results: Dict[str, Tuple[List[float], List[int]]] = {
+            name: ([], [0]) for name in self.endpoints
+        }
+        self.status_codes: Dict[str, int] = {}
+        self.max_queue_delay = 0.0
+
+    def _client_ip(self) -> str:
+        # 用 X-Forwarded-For 模拟不同用户
+        user = self.rng.randrange(self.users)
+        return f"10.{(user >> 16) & 255}.{(user >> 8) & 255}.{user & 255}"
+
+    def _build_request(self, endpoint: str) -> Tuple[str, str, Optional[Dict]]:
+        if endpoint == "share" and not self.share_ids:
+            endpoint = "divine"
+        if endpoint == "divine":
+            language = self.rng.choice(("zh", "en"))
+            question = self.rng.choice(QUESTIONS_ZH if language == "zh" else QUESTIONS_EN)
+            return "POST", "/api/v1/divine", {"question": question, "language": language}
+        if endpoint == "share":
+            return "GET", f"/api/v1/share/{self.rng.choice(self.share_ids)}", None
+        if endpoint == "stats_global":
+            return "GET", "/api/v1/stats/global", None
+        if endpoint == "stats_user":
+            return "GET", "/api/v1/stats/user", None
+        return "GET", "/api/v1/stats/user/recent", None
+
+    async def _fire(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, endpoint: str, scheduled: float):
+        method, path, body = self._build_request(endpoint)
+        latencies, errors = self.results[endpoint]
+        async with semaphore:
+            self.max_queue_delay = max(self.max_queue_delay, time.perf_counter() - scheduled)
+            try:
+                response = await client.request(
+                    method, path, json=body, headers={"X-Forwarded-For": self._client_ip()}
+                )
+                code = str(response.status_code)
+                ok = response.status_code == 200 and response.json().get("success", False)
+                if ok and endpoint == "divine":
+                    self.share_ids.append(response.json()["data"]["id"])
+            except (httpx.HTTPError, ValueError) as e:
+                code = type(e).__name__
+                ok = False
+        latencies.append(time.perf_counter() - scheduled)
+        if not ok:
+            errors[0] += 1
+        self.status_codes[code] = self.status_codes.get(code, 0) + 1
+
+    async def run(self) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        tasks = []
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.timeout) as client:
+            started = time.perf_counter()
+            next_at = started
+            end_at = started + self.duration
+            while next_at < end_at:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+                tasks.append(asyncio.ensure_future(self._fire(client, semaphore, endpoint, next_at)))
+                gap = self.rng.expovariate(self.rps) if self.arrival == "poisson" else 1.0 / self.rps
+                next_at += gap
+            sent_in = time.perf_counter() - started
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+        all_latencies: List[float] = []
+        all_errors = 0
+        endpoints = {}
+        for name, (latencies, errors) in self.results.items():
+            endpoints[name] = summarize(latencies, errors[0], elapsed)
+            all_latencies.extend(latencies)
+            all_errors += errors[0]
+        return {
+            "overall": summarize(all_latencies, all_errors, elapsed),
+            "endpoints": endpoints,
+            "status_codes": self.status_codes,
+            "offered_rps": self.rps,
+            "send_seconds": sent_in,
+            "elapsed_seconds": elapsed,
+            "max_queue_delay_ms": round(self.max_queue_delay * 1000, 3),
+        }
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    """启动依赖、预热、压测并返回报告"""
+    mix = dict(DEFAULT_MIX)
+    if args.mix:
+        mix = {k: int(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+
+    mock_config = MockLLMConfig(
+        latency=LatencyDistribution.parse(args.llm_latency),
+        tokens_per_second=args.llm_tokens_per_second,
+        error_rate=args.llm_error_rate,
+        timeout_rate=args.llm_timeout_rate,
+        seed=args.seed
+    )
+    extra_env = dict(item.split("=", 1) for item in args.env) if args.env else {}
+
+    workdir = tempfile.mkdtemp(prefix="destiny-bench-")
+    mock = MockLLMServer(mock_config).start()
+    app = AppProcess(mock.base_url, workdir, extra_env)
+    try:
+        app.start()
+        if args.warmup > 0:
+            asyncio.run(LoadGenerator(
+                app.base_url, args.rps, args.warmup, args.concurrency, mix, seed=args.seed + 1
+            ).run())
+        result = asyncio.run(LoadGenerator(
+            app.base_url, args.rps, args.duration, args.concurrency, mix,
+            users=args.users, arrival=args.arrival, timeout=args.timeout, seed=args.seed
+        ).run())
+        result["mock_llm"] = mock.app.state.stats
+        try:
+            result["llm_stats"] = httpx.get(f"{app.base_url}/api/v1/stats/llm", timeout=5).json().get("data")
+        except (httpx.HTTPError, ValueError):
+            result["llm_stats"] = None
+        try:
+            result["system_stats"] = httpx.get(
+                f"{app.base_url}/api/v1/stats/system", headers={"X-API-Key": STATS_API_KEY}, timeout=5
+            ).json().get("data")
+        except (httpx.HTTPError, ValueError):
+            result["system_stats"] = None
+    finally:
+        app.stop()
+        mock.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result["config"] = {
+        "rps": args.rps,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+        "arrival": args.arrival,
+        "users": args.users,
+        "mix": mix,
+        "llm": mock_config.to_dict(),
+        "env": extra_env,
+        "python": sys.version.split()[0],
+        "timestamp": int(time.time()),
+    }
+    if args.keep_workdir:
+        result["config"]["workdir"] = workdir
+    return result
+
+
+def compare_reports(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """对比两份报告：吞吐、错误率、各分位数延迟的变化（new / old）"""
+
+    def change(before, after) -> Dict[str, Any]:
+        ratio = after / before if before and after is not None else None
+        return {"old": before, "new": after, "ratio": round(ratio, 3) if ratio is not None else None}
+
+    def diff(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+        out = {
+            "throughput_rps": change(a["throughput_rps"], b["throughput_rps"]),
+            "error_rate": change(a["error_rate"], b["error_rate"]),
+        }
+        for key in ("p50", "p95", "p99", "p999"):
+            out[key] = change(a["latency_ms"][key], b["latency_ms"][key])
+        return out
+
+    result = {"overall": diff(old["overall"], new["overall"]), "endpoints": {}}
+    for name in old["endpoints"]:
+        if name in new["endpoints"] and old["endpoints"][name]["requests"] and new["endpoints"][name]["requests"]:
+            result["endpoints"][name] = diff(old["endpoints"][name], new["endpoints"][name])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Destiny API 端到端压测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="运行压测")
+    run.add_argument("--rps", type=float, default=50.0, help="目标到达率（请求/秒）")
+    run.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    run.add_argument("--warmup", type=float, default=3.0, help="预热时长（秒，不计入结果）")
+    run.add_argument("--concurrency", type=int, default=256, help="最大并发连接数")
+    run.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson", help="到达过程")
+    run.add_argument("--users", type=int, default=1000, help="模拟用户数（X-Forwarded-For）")
+    run.add_argument("--mix", default=None, help="流量配比，例如 divine=60,share=30,stats_global=10")
+    run.add_argument("--timeout", type=float, default=30.0, help="单请求超时（秒）")
+    run.add_argument("--llm-latency", default="lognormal:0.4,0.5", help="Mock LLM 首字延迟分布")
+    run.add_argument("--llm-tokens-per-second", type=float, default=0.0, help="Mock LLM 输出速率")
+    run.add_argument("--llm-error-rate", type=float, default=0.0, help="Mock LLM 错误率")
+    run.add_argument("--llm-timeout-rate", type=float, default=0.0, help="Mock LLM 挂起比例")
+    run.add_argument("--env", action="append", help="传给应用进程的环境变量，例如 --env VERDICT_SOURCE=bank")
+    run.add_argument("--seed", type=int, default=42, help="随机种子")
+    run.add_argument("--output", default=None, help="报告输出路径（默认打印到标准输出）")
+    run.add_argument("--keep-workdir", action="store_true", help="保留临时目录（数据库和日志）")
+
+    compare = sub.add_parser("compare", help="对比两份报告")
+    compare.add_argument("old", help="旧版本报告")
+    compare.add_argument("new", help="新版本报告")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmark(args)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            Path(args.output).write_text(text, encoding="utf-8")
+            overall = report["overall"]
+            print(
+                f"{overall['requests']} requests, {overall['throughput_rps']:.1f} rps, "
+                f"p99 {overall['latency_ms']['p99']} ms, errors {overall['error_rate']:.2%} -> {args.output}"
+            )
+        else:
+            print(text)
+    else:
+        old = json.loads(Path(args.old).read_text(encoding="utf-8"))
+        new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+        print(json.dumps(compare_reports(old, new), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+热路径微基准 - 每个请求都会执行的函数
+
+测量 ns/op（多轮取最快一轮）和每次调用的内存分配（tracemalloc）：
+- alloc_bytes：单次调用期间的峰值分配（临时对象）
+- retained_bytes：调用结束后仍存活的分配（返回值等）
+
+与保存的基线对比，超出容差即以非零状态退出（可放在 CI 或发布前检查）。
+对比时用同一进程里测得的参照负载耗时做归一化，抵消机器快慢和 CPU 频率的差异。
+
+用法：
+    python -m benchmarks.micro                              # 运行并打印
+    python -m benchmarks.micro --save benchmarks/micro_baseline.json
+    python -m benchmarks.micro --check benchmarks/micro_baseline.json --tolerance 0.5
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from app.agents.fortune_agent import (  # noqa: E402
+    InputFeatures,
+    LLMPerturbation,
+    determine_state,
+    select_verdict,
+)
+from app.api.divine import FortuneResult  # noqa: E402
+from app.models.user_interaction import UserInteraction  # noqa: E402
+from app.utils.security import hash_ip, hash_question  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "micro_baseline.json"
+
+QUESTION = "我是不是应该换一份工作？"
+FEATURES = InputFeatures.from_input(QUESTION, history_count=2, hour=23)
+STATE = determine_state(FEATURES)
+MOTHER = select_verdict(STATE, FEATURES, "zh")
+NOW = datetime(2026, 1, 1, 23, 30)
+
+
+class _PromptOnlyLLM:
+    """只用于构造 LLMPerturbation，不会被调用"""
+
+    async def generate(self, *args, **kwargs):
+        raise AssertionError("micro benchmarks never call the LLM")
+
+
+PERTURBATION = LLMPerturbation(_PromptOnlyLLM())
+
+
+def _user_interaction() -> UserInteraction:
+    return UserInteraction(
+        user_id="user_7c4da935232753d1",
+        session_id=None,
+        question=QUESTION,
+        question_hash="6f1ed002ab5595859014ebf0951522d9",
+        result=MOTHER,
+        language="zh",
+        category="general",
+        is_night=True,
+        timestamp=NOW,
+        response_time_ms=412,
+        llm_model="fortune_agent",
+        result_id="1a2b3c4d"
+    )
+
+
+def _fortune_result() -> FortuneResult:
+    return FortuneResult(
+        id="1a2b3c4d",
+        text=MOTHER,
+        language="zh",
+        timestamp=1767281400000,
+        shareText="我刚算了一卦，有点不舒服。",
+        category="general"
+    )
+
+
+# 名称 -> 被测函数（无参数）
+BENCHMARKS: Dict[str, Callable[[], Any]] = {
+    "InputFeatures.from_input": lambda: InputFeatures.from_input(QUESTION, history_count=2, hour=23),
+    "determine_state": lambda: determine_state(FEATURES),
+    "select_verdict": lambda: select_verdict(STATE, FEATURES, "zh"),
+    "LLMPerturbation.build_prompt": lambda: PERTURBATION.build_prompt(MOTHER, FEATURES, "zh"),
+    "hash_ip": lambda: hash_ip("203.0.113.42"),
+    "hash_question": lambda: hash_question(QUESTION),
+    "UserInteraction": _user_interaction,
+    "FortuneResult": _fortune_result,
+}
+
+
+def _reference_workload():
+    """参照负载：纯解释器开销，用于归一化机器速度"""
+    total = 0
+    for i in range(100):
+        total += i * i
+    return total
+
+
+def _calibrate(func: Callable[[], Any], target_seconds: float) -> int:
+    """找到一轮大约耗时 target_seconds 的循环次数"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target_seconds / 4 or loops >= 1 << 24:
+            return max(1, int(loops * target_seconds / max(elapsed, 1e-9)))
+        loops *= 4
+
+
+def measure_time(func: Callable[[], Any], repeats: int, target_seconds: float) -> Tuple[float, float]:
+    """返回 (最快一轮的 ns/op, 中位数 ns/op)"""
+    loops = _calibrate(func, target_seconds)
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter_ns()
+            for _ in range(loops):
+                func()
+            samples.append((time.perf_counter_ns() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    samples.sort()
+    return samples[0], samples[len(samples) // 2]
+
+
+def measure_allocations(func: Callable[[], Any], calls: int = 200) -> Tuple[float, float]:
+    """返回 (单次调用峰值分配字节数, 每次调用存活字节数)"""
+    func()  # 触发惰性初始化，避免计入一次性分配
+    keep: List[Any] = []
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(5):
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            keep.append(func())
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 结果列表本身的开销不算在被测函数头上
+    retained = max(0.0, (after - before - sys.getsizeof(keep)) / calls)
+    return float(min(peaks)), retained
+
+
+def run_suite(
+    names: Optional[List[str]] = None,
+    repeats: int = 7,
+    target_seconds: float = 0.05
+) -> Dict[str, Any]:
+    """运行微基准，返回可保存为基线的结果"""
+    reference = measure_time(_reference_workload, repeats, target_seconds)[0]
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        best, median = measure_time(func, repeats, target_seconds)
+        alloc, retained = measure_allocations(func)
+        results[name] = {
+            "ns_per_op": round(best, 1),
+            "median_ns_per_op": round(median, 1),
+            "alloc_bytes": round(alloc, 1),
+            "retained_bytes": round(retained, 1),
+        }
+    reference = min(reference, measure_time(_reference_workload, repeats, target_seconds)[0])
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": int(time.time()),
+        "reference_ns": round(reference, 1),
+        "results": results,
+    }
+
+
+def check_regressions(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.5,
+    alloc_tolerance: float = 0.1
+) -> List[str]:
+    """
+    与基线对比
+
+    Args:
+        tolerance: ns/op 允许的相对增长（计时受机器影响，默认较宽）
+        alloc_tolerance: 分配字节数允许的相对增长（更稳定，默认较严）
+
+    Returns:
+        回归描述列表，空列表表示通过
+    """
+    problems = []
+    # 按参照负载换算到当前机器的速度
+    scale = 1.0
+    if baseline.get("reference_ns") and current.get("reference_ns"):
+        scale = current["reference_ns"] / baseline["reference_ns"]
+    for name, base in baseline.get("results", {}).items():
+        now = current["results"].get(name)
+        if now is None:
+            continue
+        expected = base["ns_per_op"] * scale
+        if now["ns_per_op"] > expected * (1 + tolerance):
+            problems.append(
+                f"{name}: {now['ns_per_op']:.0f} ns/op vs baseline {expected:.0f} ns/op (scaled x{scale:.2f})"
+            )
+        for key in ("alloc_bytes", "retained_bytes"):
+            # 64 字节以内的波动视为噪声（小对象分配粒度）
+            if now[key] > base[key] * (1 + alloc_tolerance) + 64:
+                problems.append(f"{name}: {key} {now[key]:.0f} vs baseline {base[key]:.0f}")
+    return problems
+
+
+def _print_table(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"{'benchmark':32} {'ns/op':>10} {'base':>10} {'alloc B':>9} {'kept B':>9}")
+    base_results = (baseline or {}).get("results", {})
+    scale = 1.0
+    if baseline and baseline.get("reference_ns") and report.get("reference_ns"):
+        scale = report["reference_ns"] / baseline["reference_ns"]
+    for name, r in report["results"].items():
+        base = base_results.get(name, {}).get("ns_per_op")
+        base = base * scale if base else None
+        base_text = f"{base:.0f}" if base else "-"
+        print(f"{name:32} {r['ns_per_op']:>10.0f} {base_text:>10} {r['alloc_bytes']:>9.0f} {r['retained_bytes']:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Destiny 热路径微基准")
+    parser.add_argument("--only", action="append", help="只运行指定的基准（可重复）")
+    parser.add_argument("--repeats", type=int, default=7, help="计时轮数（取最快一轮）")
+    parser.add_argument("--target", type=float, default=0.05, help="每轮目标耗时（秒）")
+    parser.add_argument("--save", metavar="PATH", help="把结果保存为基线")
+    parser.add_argument("--check", metavar="PATH", nargs="?", const=str(DEFAULT_BASELINE), help="与基线对比")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="ns/op 允许的相对增长")
+    parser.add_argument("--alloc-tolerance", type=float, default=0.1, help="分配字节数允许的相对增长")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    report = run_suite(args.only, args.repeats, args.target)
+    baseline = json.loads(Path(args.check).read_text(encoding="utf-8")) if args.check else None
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_table(report, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline saved to {args.save}")
+
+    if baseline is not None:
+        problems = check_regressions(report, baseline, args.tolerance, args.alloc_tolerance)
+        if problems:
+            print("Regressions:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
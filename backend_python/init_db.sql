@@ -27,7 +27,7 @@ CREATE TABLE IF NOT EXISTS prompt_templates (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     language VARCHAR(2) NOT NULL CHECK (language IN ('zh', 'en')),
-    template_type VARCHAR(50) NOT NULL CHECK (template_type IN ('base', 'night', 'special')),
+    template_type VARCHAR(50) NOT NULL CHECK (template_type IN ('base', 'night', 'special', 'perturb')),
     template_content TEXT NOT NULL,
     version INTEGER NOT NULL DEFAULT 1,
     is_active BOOLEAN NOT NULL DEFAULT true,
@@ -94,6 +94,57 @@ User question: {question}
 
 Your verdict:', 1, true);
 
+-- 插入默认微扰模板（判词母句润色，Agent 当前使用的模板类型）
+INSERT INTO prompt_templates (name, language, template_type, template_content, version, is_active) 
+VALUES
+('perturb_zh', 'zh', 'perturb', 
+'你是语言润色助手。给定一个判词母句，你只能调整语气和节奏。
+
+【严格禁止】
+1. 添加任何新信息
+2. 添加建议或解释
+3. 改变原句的核心含义
+4. 使用温柔或安慰性语气
+5. 添加形容词或副词（除非为了语气）
+
+【允许操作】
+1. 调整语序
+2. 改变停顿节奏（逗号、句号位置）
+3. 调整强硬或柔和的程度
+4. 使用同义替换（不改变含义）
+
+母句：{mother_verdict}
+
+时间：{hour}点
+尝试次数：{attempt_count}次
+输入长度：{char_length}字
+
+请根据时间和次数调整语气强度，输出调整后的判词（仅一句话）：', 1, true),
+
+('perturb_en', 'en', 'perturb', 
+'You are a language polisher. Given a verdict, you can only adjust tone and rhythm.
+
+【STRICTLY FORBIDDEN】
+1. Add any new information
+2. Add advice or explanation
+3. Change core meaning
+4. Use gentle or comforting tone
+5. Add adjectives or adverbs (unless for tone)
+
+【ALLOWED OPERATIONS】
+1. Adjust word order
+2. Change pause rhythm (comma, period position)
+3. Adjust harshness or softness level
+4. Use synonyms (without changing meaning)
+
+Mother verdict: {mother_verdict}
+
+Time: {hour}:00
+Attempt count: {attempt_count}
+Input length: {char_length} chars
+
+Adjust tone based on time and count, output adjusted verdict (one sentence only):', 1, true);
+
 -- 统计视图：每日请求统计
 CREATE OR REPLACE VIEW daily_stats AS
 SELECT 
@@ -0,0 +1,98 @@
+"""
+异步数据库服务测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.user_interaction import UserInteraction
+from app.services.async_database import AsyncDatabaseService
+from app.services.database_service import DatabaseService
+
+
+def _interaction(i: int) -> UserInteraction:
+    return UserInteraction(
+        user_id="user_async", session_id=None, question="q", question_hash="h",
+        result=f"r{i}", language="zh", category="general", is_night=False,
+        timestamp=datetime.now(), response_time_ms=5, llm_model="m", result_id=f"as{i:06d}"
+    )
+
+
+def test_calls_run_off_the_event_loop():
+    """数据库调用不在事件循环线程执行，写操作都在同一个写线程"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseService(os.path.join(tmpdir, "test.db"), readers=2)
+        async_db = AsyncDatabaseService(db, readers=2)
+        threads = {"write": set(), "read": set()}
+        original_save, original_get = db.save_interaction, db.get_interaction_by_result_id
+
+        def save(interaction):
+            threads["write"].add(threading.current_thread().name)
+            return original_save(interaction)
+
+        def get(result_id):
+            threads["read"].add(threading.current_thread().name)
+            return original_get(result_id)
+
+        db.save_interaction, db.get_interaction_by_result_id = save, get
+
+        async def run():
+            await asyncio.gather(*(async_db.save_interaction(_interaction(i)) for i in range(20)))
+            rows = await asyncio.gather(*(async_db.get_interaction_by_result_id(f"as{i:06d}") for i in range(20)))
+            assert [row["result"] for row in rows] == [f"r{i}" for i in range(20)]
+            assert await async_db.get_interaction_by_result_id("missing") is None
+
+        asyncio.run(run())
+        assert len(threads["write"]) == 1 and next(iter(threads["write"])).startswith("db-writer")
+        assert all(name.startswith("db-reader") for name in threads["read"])
+
+        stats = async_db.get_stats()
+        assert stats["writer"]["completed"] == 20 and stats["readers"]["completed"] == 21
+        assert stats["writer"]["queue_depth"] == 0
+        async_db.close()
+        db.close()
+
+
+def test_slow_query_does_not_block_loop():
+    """慢查询执行期间事件循环仍在处理其他任务；排队等待计入统计"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseService(os.path.join(tmpdir, "test.db"), readers=1)
+        async_db = AsyncDatabaseService(db, readers=1)
+
+        def slow_stats():
+            time.sleep(0.1)
+            return {"total_users": 0}
+
+        db.get_global_stats = slow_stats
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                for _ in range(10):
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            await asyncio.gather(async_db.get_global_stats(), async_db.get_global_stats(), ticker())
+            assert ticks == 10
+
+        asyncio.run(run())
+        readers = async_db.get_stats()["readers"]
+        assert readers["failed"] == 0 and readers["max_wait_ms"] >= 50  # 第二个查询排在第一个后面
+        async_db.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    test_calls_run_off_the_event_loop()
+    test_slow_query_does_not_block_loop()
+    print("All async database tests passed")
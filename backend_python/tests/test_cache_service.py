@@ -0,0 +1,222 @@
+"""
+共享缓存测试（用进程内的 FakeRedis 代替 Redis 服务）
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import InputFeatures, LLMPerturbation
+from app.services.cache_service import CacheService, MemoryCacheBackend, RedisCacheBackend
+from app.services.perturbation_cache import PerturbationCache
+
+
+class FakeRedis:
+    """redis.asyncio.Redis 的最小子集：mget / set(ex, px, nx) / pipeline / delete / exists"""
+
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+        self.fail = False
+
+    def _check(self):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.round_trips += 1
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key, value, ex=None, px=None, nx=False):
+        if nx and self._get(key) is not None:
+            return None
+        ttl = ex or (px / 1000 if px else None)
+        self.data[key] = (value, time.monotonic() + ttl if ttl else 0)
+        return True
+
+    async def ping(self):
+        self._check()
+        return True
+
+    async def mget(self, keys):
+        self._check()
+        return [self._get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        self._check()
+        return self._set(key, value, ex, px, nx)
+
+    async def delete(self, *keys):
+        self._check()
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def exists(self, key):
+        self._check()
+        return int(self._get(key) is not None)
+
+    async def aclose(self):
+        pass
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+        return self
+
+    async def execute(self):
+        self.redis._check()
+        return [self.redis._set(*args, **kwargs) for args, kwargs in self.commands]
+
+
+def _service(redis=None, **kwargs):
+    return CacheService(RedisCacheBackend(redis or FakeRedis()), **kwargs)
+
+
+def test_pipelined_get_many_and_ttl():
+    """多个 key 一次往返读写，过期后读不到"""
+    async def run():
+        redis = FakeRedis()
+        cache = _service(redis)
+        await cache.set_many({"a": {"n": 1}, "b": [1, 2], "c": "三"}, ttl=0.05)
+        assert redis.round_trips == 1
+        assert await cache.get_many(["a", "b", "c", "missing"]) == [{"n": 1}, [1, 2], "三", None]
+        assert redis.round_trips == 2
+        assert all(key.startswith("destiny:") for key in redis.data)
+
+        await asyncio.sleep(0.08)
+        assert await cache.get_many(["a", "b"]) == [None, None]
+        stats = cache.get_stats()
+        assert stats["hits"] == 3 and stats["misses"] == 3
+
+    asyncio.run(run())
+
+
+def test_get_or_set_stampede():
+    """并发未命中只加载一次；另一个进程持锁时等待其结果"""
+    async def run():
+        redis = FakeRedis()
+        first, second = _service(redis), _service(redis)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"value": 42}
+
+        results = await asyncio.gather(*(
+            (first if i % 2 else second).get_or_set("hot", loader, ttl=60)
+            for i in range(20)
+        ))
+        assert results == [{"value": 42}] * 20
+        assert len(calls) == 1
+        assert not any(key.endswith(":lock") for key in redis.data)
+
+        # None 不缓存
+        async def empty():
+            calls.append(1)
+            return None
+
+        assert await first.get_or_set("nothing", empty) is None
+        assert await first.get_or_set("nothing", empty) is None
+        assert len(calls) == 3
+
+    asyncio.run(run())
+
+
+def test_falls_back_to_memory_when_redis_fails():
+    """Redis 出错时改用进程内缓存，冷却后重新使用 Redis"""
+    async def run():
+        redis = FakeRedis()
+        cache = _service(redis, retry_interval=0.05)
+        redis.fail = True
+        await cache.set("k", "v")
+        assert cache.using_fallback
+        assert await cache.get("k") == "v"  # 由进程内缓存提供
+        assert cache.get_stats()["errors"] == 1
+
+        redis.fail = False
+        await asyncio.sleep(0.06)
+        assert await cache.get("k") is None  # 已回到 Redis
+        assert not cache.using_fallback
+
+        # 启动时 Redis 不可用
+        redis.fail = True
+        down = _service(redis)
+        await down.start()
+        assert down.using_fallback
+
+        # 未配置 Redis 时只用进程内缓存
+        local = CacheService(fallback=MemoryCacheBackend(max_entries=2))
+        await local.set_many({"a": 1, "b": 2, "c": 3})
+        assert await local.get_many(["a", "b", "c"]) == [None, 2, 3]
+
+    asyncio.run(run())
+
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def observed_latency(self):
+        return None
+
+    async def generate(self, prompt, **kwargs):
+        self.calls += 1
+        return f"variant-{self.calls}"
+
+
+def test_perturbation_shared_between_processes():
+    """一个进程生成的微扰变体，另一个进程通过共享缓存直接命中"""
+    async def run():
+        redis = FakeRedis()
+        features = InputFeatures.from_input("我该怎么办？", history_count=1, hour=14)
+        llm_a, llm_b = CountingLLM(), CountingLLM()
+        worker_a = LLMPerturbation(
+            llm_a, cache=PerturbationCache(variants_per_entry=2), shared_cache=_service(redis)
+        )
+        shared_b = _service(redis)
+        worker_b = LLMPerturbation(
+            llm_b, cache=PerturbationCache(variants_per_entry=2), shared_cache=shared_b
+        )
+
+        for _ in range(2):
+            await worker_a.perturb("母句", features, "zh")
+        await asyncio.gather(*worker_a.shared_cache._background)
+        assert llm_a.calls == 2
+
+        assert (await worker_b.perturb("母句", features, "zh"))[0] in ("variant-1", "variant-2")
+        assert llm_b.calls == 0
+        assert worker_b.cache.get_stats()["shared_hits"] == 1
+
+        # 批量预取：一次 MGET
+        other = InputFeatures.from_input("a", history_count=9, hour=3)
+        trips = redis.round_trips
+        await worker_b.prefetch([("母句", features), ("另一句", other)], "zh", worker_b.get_template("zh"))
+        assert redis.round_trips == trips + 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_pipelined_get_many_and_ttl()
+    test_get_or_set_stampede()
+    test_falls_back_to_memory_when_redis_fails()
+    test_perturbation_shared_between_processes()
+    print("All cache service tests passed")
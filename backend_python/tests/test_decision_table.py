@@ -0,0 +1,101 @@
+"""
+预编译决策表测试 - 查表结果必须与规则原文完全一致
+"""
+import random
+import sys
+from itertools import product
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import (
+    InputFeatures,
+    VerdictPool,
+    DecisionTable,
+    classify,
+    classify_many,
+    determine_state,
+    determine_state_by_rules,
+    select_verdict,
+    verdict_residue_by_rules,
+)
+
+
+def _reference(features: InputFeatures, language: str):
+    state = determine_state_by_rules(features)
+    verdicts = VerdictPool.get_verdicts(state, language)
+    return state, verdict_residue_by_rules(features, len(verdicts))
+
+
+def _features(char_length, has_question_mark, hour, attempt_count):
+    return InputFeatures(
+        is_empty=char_length == 0,
+        char_length=char_length,
+        has_question_mark=has_question_mark,
+        hour=hour,
+        attempt_count=attempt_count
+    )
+
+
+def test_exhaustive_small_space():
+    """穷举常见取值范围"""
+    for char_length, qm, hour, attempts in product(range(0, 42), (False, True), range(24), range(0, 9)):
+        features = _features(char_length, qm, hour, attempts)
+        for language in ("zh", "en"):
+            expected = _reference(features, language)
+            assert classify(features, language) == expected, features.to_dict()
+            assert determine_state(features) == expected[0]
+            assert select_verdict(expected[0], features, language) == \
+                VerdictPool.get_verdicts(expected[0], language)[expected[1]]
+
+
+def test_random_property():
+    """随机抽样（包括超出常见范围的取值）"""
+    rng = random.Random(20260113)
+    for _ in range(20000):
+        features = _features(
+            char_length=rng.randint(0, 500),
+            has_question_mark=rng.random() < 0.5,
+            hour=rng.randint(0, 23),
+            attempt_count=rng.randint(-2, 1000)
+        )
+        # 构造函数允许 is_empty 与长度不一致，同样要覆盖
+        if rng.random() < 0.1:
+            features.is_empty = not features.is_empty
+        language = rng.choice(("zh", "en"))
+        assert classify(features, language) == _reference(features, language), features.to_dict()
+
+
+def test_classify_many_matches_single():
+    """批量入口与单条查表一致"""
+    rng = random.Random(7)
+    batch = [
+        _features(rng.randint(0, 60), rng.random() < 0.5, rng.randint(0, 23), rng.randint(1, 10))
+        for _ in range(500)
+    ]
+    assert classify_many(batch, "en") == [classify(f, "en") for f in batch]
+
+
+def test_large_modulus_fallback():
+    """modulus 超过展开上限时仍与规则一致"""
+    table = DecisionTable(modulus=35)
+    assert not table.expand_residue
+    features = _features(17, True, 3, 4)
+    state, residue = table.lookup(features)
+    assert state == determine_state_by_rules(features)
+    assert residue == verdict_residue_by_rules(features, 35)
+
+    # 判词池长度的最小公倍数很大时不能溢出
+    modulus = 7 * 11 * 13 * 16
+    table = DecisionTable(modulus=modulus)
+    for features in (_features(17, True, 3, 4), _features(0, False, 23, 900)):
+        assert table.lookup(features) == (determine_state_by_rules(features), verdict_residue_by_rules(features, modulus))
+
+
+if __name__ == "__main__":
+    test_exhaustive_small_space()
+    test_random_property()
+    test_classify_many_matches_single()
+    test_large_modulus_fallback()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,103 @@
+"""
+批量算卦测试
+"""
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.agents.fortune_agent import FortuneAgent, init_fortune_agent
+from app.api import divine
+from app.config.settings import get_settings
+from app.services.async_database import close_async_database_service, init_async_database_service
+from app.services.database_service import DatabaseService
+
+
+class JitteryLLM:
+    """随机延迟后原样返回母句的假 LLM 服务，记录最大并发数"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.02))
+        finally:
+            self.active -= 1
+        return re.search(r"母句：(.*)", prompt).group(1)
+
+    def observed_latency(self):
+        return None
+
+
+def test_batch_endpoint_order_rows_and_size_limit():
+    """结果与问题一一对应，会话和交互在一个事务中写入，超出批大小上限时拒绝"""
+    app = FastAPI()
+    app.include_router(divine.router, prefix="/api/v1")
+    settings = get_settings()
+    previous_max = settings.DIVINE_BATCH_MAX_SIZE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseService(os.path.join(tmpdir, "test.db"))
+        init_async_database_service(db, readers=2)
+        init_fortune_agent(JitteryLLM(), batch_concurrency=4)
+        try:
+            client = TestClient(app)
+            questions = [f"第{i}个问题？" for i in range(12)]
+            writes_before = db.get_connection_stats()["writes"]
+            body = client.post("/api/v1/divine/batch", json={"questions": questions, "language": "zh"}).json()
+            assert body["success"] is True
+            assert len(body["data"]) == len(questions)
+            assert db.get_connection_stats()["writes"] - writes_before == 1
+
+            for question, result in zip(questions, body["data"]):
+                row = db.get_interaction_by_result_id(result["id"])
+                assert row["question"] == question
+                assert row["result"] == result["text"]
+
+            conn = sqlite3.connect(db.db_path)
+            try:
+                assert conn.execute("SELECT COUNT(*) FROM user_interactions").fetchone()[0] == 12
+                assert conn.execute("SELECT COUNT(*), SUM(visit_count) FROM user_sessions").fetchone() == (1, 1)
+            finally:
+                conn.close()
+
+            settings.DIVINE_BATCH_MAX_SIZE = 5
+            body = client.post("/api/v1/divine/batch", json={"questions": ["问题"] * 6}).json()
+            assert body["success"] is False and body["error"] == "BATCH_TOO_LARGE"
+        finally:
+            settings.DIVINE_BATCH_MAX_SIZE = previous_max
+            close_async_database_service()
+            db.close()
+
+
+def test_execute_many_bounds_concurrency():
+    """批量微扰的并发不超过 batch_concurrency，结果顺序与问题一致"""
+    llm = JitteryLLM()
+    agent = FortuneAgent(llm, batch_concurrency=3)
+    questions = [f"问题{i}" * (i + 1) for i in range(20)]
+    results = asyncio.run(agent.execute_many(questions, language="zh", user_id="user_b"))
+    assert 1 < llm.max_active <= 3
+
+    # 与逐条执行（同样的尝试次数）得到的判词一致
+    sequential = FortuneAgent(JitteryLLM())
+    expected = [asyncio.run(sequential.execute(q, language="zh", user_id="user_b"))["result"] for q in questions]
+    assert [r["result"] for r in results] == expected
+
+
+if __name__ == "__main__":
+    test_batch_endpoint_order_rows_and_size_limit()
+    test_execute_many_bounds_concurrency()
+    print("All batch tests passed")
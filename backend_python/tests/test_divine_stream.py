@@ -0,0 +1,105 @@
+"""
+流式算卦接口测试
+"""
+import json
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.agents.fortune_agent import init_fortune_agent
+from app.api import divine
+
+
+class StreamingLLM:
+    """逐块返回固定片段的假 LLM 服务，把输出记到共享日志"""
+
+    def __init__(self, chunks, log):
+        self.chunks = chunks
+        self.log = log
+
+    async def stream(self, prompt, language='zh', **kwargs):
+        for text in self.chunks:
+            self.log.append("token")
+            yield text
+
+    def observed_latency(self):
+        return None
+
+
+class RecordingDatabase:
+    """记录写入顺序的假数据库服务"""
+
+    def __init__(self, log):
+        self.log = log
+
+    async def save_or_update_session(self, session):
+        self.log.append("session")
+
+    async def save_interaction(self, interaction):
+        self.log.append("interaction")
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _client(log):
+    app = FastAPI()
+    app.include_router(divine.router, prefix="/api/v1")
+    database = RecordingDatabase(log)
+    divine.get_async_database_service = lambda: database
+    return TestClient(app)
+
+
+def test_stream_event_sequence_and_writes_after_verdict():
+    """事件顺序为 verdict → token* → done，会话和交互在判词发出后才写入"""
+    original = divine.get_async_database_service
+    log = []
+    try:
+        init_fortune_agent(StreamingLLM(["新", "判词"], log))
+        response = _client(log).post("/api/v1/divine/stream", json={"question": "我该走吗？", "language": "zh"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _events(response.text)
+        assert [name for name, _ in events] == ["verdict", "token", "token", "done"]
+        assert events[0][1]["language"] == "zh"
+        assert "".join(data["text"] for name, data in events if name == "token") == "新判词"
+        assert events[-1][1]["text"] == "新判词"
+        assert log == ["token", "token", "session", "interaction"]
+    finally:
+        divine.get_async_database_service = original
+
+
+def test_stream_reports_error_event():
+    """执行出错时发送 error 事件后结束"""
+    original = divine.get_async_database_service
+    log = []
+    try:
+        agent = init_fortune_agent(StreamingLLM([], log))
+
+        async def broken(**kwargs):
+            yield {"event": "verdict", "text": "母句", "state": "first_time"}
+            raise RuntimeError("boom")
+
+        agent.execute_stream = broken
+        response = _client(log).post("/api/v1/divine/stream", json={"question": "？", "language": "en"})
+        events = _events(response.text)
+        assert [name for name, _ in events] == ["verdict", "error"]
+        assert events[-1][1]["error"] == "INTERNAL_ERROR"
+        assert log == []
+    finally:
+        divine.get_async_database_service = original
+
+
+if __name__ == "__main__":
+    test_stream_event_sequence_and_writes_after_verdict()
+    test_stream_reports_error_event()
+    print("All stream endpoint tests passed")
@@ -0,0 +1,394 @@
+"""
+LLM 服务测试（使用假的 acompletion，不访问网络）
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from app.services import llm_service as llm_module
+from app.services.llm_service import LLMService
+from app.agents.fortune_agent import InputFeatures, LLMPerturbation
+from app.services.circuit_breaker import CircuitBreaker, CircuitState
+from app.services.http_pool import HTTPPool
+from app.utils.deadline import Deadline
+from app.utils.single_flight import SingleFlight
+
+
+class FakeCompletion:
+    """按模型配置延迟和错误的假 acompletion"""
+
+    def __init__(self, delays=None, failures=None):
+        self.delays = delays or {}
+        self.failures = failures or set()
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, **params):
+        model = params["model"]
+        self.calls.append(model)
+        try:
+            await asyncio.sleep(self.delays.get(model, 0))
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.failures:
+            raise RuntimeError(f"{model} unavailable")
+        message = SimpleNamespace(content=f" {model} says hi ")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeStreamCompletion:
+    """stream=True 时逐块返回的假 acompletion"""
+
+    def __init__(self, chunks, failures=None):
+        self.chunks = chunks
+        self.failures = failures or set()
+        self.calls = []
+
+    async def __call__(self, **params):
+        model = params["model"]
+        self.calls.append(model)
+        assert params.get("stream") is True
+        if model in self.failures:
+            raise RuntimeError(f"{model} unavailable")
+        return self._iterate()
+
+    async def _iterate(self):
+        for text in self.chunks:
+            await asyncio.sleep(0)
+            delta = SimpleNamespace(content=text)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def _service(fake, **config) -> LLMService:
+    llm_module.acompletion = fake
+    base = {"default_model": "primary", "fallback_model": "backup"}
+    base.update(config)
+    return LLMService(base)
+
+
+def test_fallback_model_after_failure():
+    """主模型失败时使用备用模型"""
+    fake = FakeCompletion(failures={"primary"})
+    service = _service(fake)
+    assert asyncio.run(service.generate("hi")) == "backup says hi"
+    assert fake.calls == ["primary", "backup"]
+
+
+def test_raise_on_error():
+    """主备都失败且 raise_on_error=True 时抛出异常"""
+    fake = FakeCompletion(failures={"primary", "backup"})
+    service = _service(fake)
+    try:
+        asyncio.run(service.generate("hi", raise_on_error=True))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected RuntimeError")
+    assert asyncio.run(service.generate("hi")) in service.fallback_responses["zh"]
+
+
+def test_hedge_wins_and_cancels_loser():
+    """主模型慢时备用模型先返回，主模型请求被取消"""
+    fake = FakeCompletion(delays={"primary": 1.0, "backup": 0.01})
+    service = _service(fake, hedge_enabled=True, hedge_default_delay=0.05)
+    assert asyncio.run(service.generate("hi")) == "backup says hi"
+    assert fake.cancelled == ["primary"]
+    stats = service.get_hedge_stats()
+    assert stats["hedged"] == 1
+    assert stats["wins"] == {"primary": 0, "hedge": 1}
+
+
+def test_no_hedge_when_primary_is_fast():
+    """主模型在对冲延迟内返回时不发起对冲"""
+    fake = FakeCompletion()
+    service = _service(fake, hedge_enabled=True, hedge_default_delay=0.5)
+    assert asyncio.run(service.generate("hi")) == "primary says hi"
+    assert fake.calls == ["primary"]
+    assert service.get_hedge_stats()["hedge_rate"] == 0.0
+
+
+def test_no_hedge_to_same_model():
+    """备用模型与主模型相同时不启用对冲，避免把同一个请求发两次"""
+    fake = FakeCompletion(delays={"primary": 0.1})
+    service = _service(fake, fallback_model="primary", hedge_enabled=True, hedge_default_delay=0.01)
+    assert service.get_hedge_stats()["enabled"] is False
+    assert asyncio.run(service.generate("hi")) == "primary says hi"
+    assert fake.calls == ["primary"]
+
+    # 单次调用指定的模型就是备用模型时也不对冲
+    service = _service(fake, hedge_enabled=True, hedge_default_delay=0.01)
+    fake.calls.clear()
+    assert asyncio.run(service.generate("hi", model="backup")) == "backup says hi"
+    assert fake.calls == ["backup"]
+
+
+def test_deadline_bounds_upstream_call():
+    """上游超时由剩余预算决定，而不是固定 30 秒"""
+    fake = FakeCompletion(delays={"primary": 5.0, "backup": 5.0})
+    service = _service(fake)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await service.generate("hi", deadline=Deadline(0.1))
+        return result, loop.time() - started
+
+    result, elapsed = asyncio.run(run())
+    assert elapsed < 0.5
+    assert result in service.fallback_responses["zh"]
+    assert fake.calls == ["primary"]  # 预算耗尽，不再尝试备用模型
+
+
+def test_perturbation_skipped_when_budget_below_latency():
+    """剩余预算低于 LLM 典型延迟时直接返回母句"""
+    fake = FakeCompletion()
+    service = _service(fake)
+    for _ in range(service.latency.min_samples):
+        service.latency.record("primary", 1.0)
+
+    features = InputFeatures(False, 8, False, 14, 1)
+    perturbation = LLMPerturbation(service)
+    result = asyncio.run(perturbation.perturb("母句", features, "zh", deadline=Deadline(0.5)))
+    assert result == ("母句", None)
+    assert fake.calls == []
+
+
+def test_breaker_opens_and_fails_fast():
+    """连续失败后熔断，后续请求不再访问上游"""
+    fake = FakeCompletion(failures={"primary"})
+    service = _service(fake, breaker_config={"window_size": 4, "min_calls": 4, "open_seconds": 60})
+    for _ in range(4):
+        asyncio.run(service.generate("hi"))
+    assert service.get_breaker_states()["primary"]["state"] == "open"
+
+    fake.calls.clear()
+    assert asyncio.run(service.generate("hi")) == "backup says hi"
+    assert fake.calls == ["backup"]
+
+
+def test_breaker_half_open_probe():
+    """冷却后放行一个探测请求，成功则恢复"""
+    breaker = CircuitBreaker("m", window_size=2, min_calls=2, open_seconds=0.0)
+    breaker.allow_request()
+    breaker.record_failure()
+    breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state is CircuitState.OPEN
+
+    assert breaker.allow_request()  # 冷却结束，进入半开并放行探测
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert not breaker.allow_request()  # 探测名额已用完
+    breaker.record_success(0.1)
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_stream_falls_back_before_first_chunk():
+    """主模型在输出前失败时流式改用备用模型"""
+    fake = FakeStreamCompletion(["你", "好"], failures={"primary"})
+    service = _service(fake)
+
+    async def run():
+        return [delta async for delta in service.stream("hi")]
+
+    assert asyncio.run(run()) == ["你", "好"]
+    assert fake.calls == ["primary", "backup"]
+    # 流式延迟单独记录，不进入对冲和预算判断使用的样本
+    assert service.latency.models() == []
+    assert service.stream_latency.models() == ["backup"]
+
+
+def test_perturb_stream_keeps_first_line():
+    """流式微扰只输出第一行"""
+    fake = FakeStreamCompletion(["  新", "判词\n解释", "说明"])
+    service = _service(fake)
+    features = InputFeatures(False, 8, False, 14, 1)
+    perturbation = LLMPerturbation(service)
+
+    async def run():
+        return [delta async for delta in perturbation.perturb_stream("母句", features, "zh")]
+
+    chunks = asyncio.run(run())
+    assert "".join(text for text, _ in chunks) == "新判词"
+    assert {version for _, version in chunks} == {0}
+
+
+def test_perturb_stream_falls_back_to_mother():
+    """流式调用全部失败时输出母句"""
+    fake = FakeStreamCompletion([], failures={"primary", "backup"})
+    service = _service(fake)
+    features = InputFeatures(False, 8, False, 14, 1)
+    perturbation = LLMPerturbation(service)
+
+    async def run():
+        return [delta async for delta in perturbation.perturb_stream("母句", features, "zh")]
+
+    assert asyncio.run(run()) == [("母句", None)]
+
+
+def test_identical_calls_are_coalesced():
+    """相同的并发调用只请求一次上游，参数不同则分开请求"""
+    fake = FakeCompletion(delays={"primary": 0.05})
+    service = _service(fake)
+
+    async def run():
+        return await asyncio.gather(
+            *(service.generate("same prompt", temperature=0.3, max_tokens=100) for _ in range(10)),
+            service.generate("same prompt", temperature=0.5, max_tokens=100)
+        )
+
+    results = asyncio.run(run())
+    assert set(results) == {"primary says hi"}
+    assert fake.calls == ["primary", "primary"]
+    stats = service.get_single_flight_stats()
+    assert stats["coalesced"] == 9
+    assert stats["in_flight"] == 0
+
+
+def test_coalesced_call_not_bound_by_leader_deadline():
+    """合并调用不使用第一个调用者的截止时间，预算更长的调用者仍能拿到结果"""
+    fake = FakeCompletion(delays={"primary": 0.2})
+    service = _service(fake)
+
+    async def run():
+        leader = asyncio.ensure_future(service.generate("p", raise_on_error=True, deadline=Deadline(0.05)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(service.generate("p", raise_on_error=True, deadline=Deadline(2.0)))
+        results = await asyncio.gather(leader, follower, return_exceptions=True)
+        return results
+
+    leader_result, follower_result = asyncio.run(run())
+    assert isinstance(leader_result, asyncio.TimeoutError)
+    assert follower_result == "primary says hi"
+    assert fake.calls == ["primary"]
+
+
+def test_coalesced_error_reaches_every_caller():
+    """上游失败时所有等待者都拿到同一个异常"""
+    fake = FakeCompletion(delays={"primary": 0.02, "backup": 0.02}, failures={"primary", "backup"})
+    service = _service(fake)
+
+    async def run():
+        return await asyncio.gather(
+            *(service.generate("p", raise_on_error=True) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert fake.calls == ["primary", "backup"]
+
+
+def test_single_flight_cancellation():
+    """一个等待者取消不影响其他等待者；全部离开后才取消底层调用"""
+    flight = SingleFlight()
+    started = []
+    cancelled = []
+
+    async def call():
+        started.append(1)
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "ok"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", call))
+        second = asyncio.ensure_future(flight.do("k", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "ok"
+        assert first.cancelled()
+
+        lonely = asyncio.ensure_future(flight.do("k2", call))
+        await asyncio.sleep(0.01)
+        lonely.cancel()
+        await asyncio.sleep(0)
+        try:
+            await flight.do("k3", call, timeout=0.01)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected TimeoutError")
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert len(started) == 3
+    assert len(cancelled) == 2
+    assert flight.in_flight() == 0
+
+
+async def _start_http_server():
+    """最简单的 keep-alive HTTP/1.1 服务，返回 (server, base_url)"""
+
+    async def handle(reader, writer):
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+def test_http_pool_warm_and_close():
+    """预热并发建立连接，进行中请求数在响应体关闭后归零，关闭时从 litellm 摘除"""
+
+    async def run():
+        server, base_url = await _start_http_server()
+        pool = HTTPPool(base_url=base_url, http2=False, warm_connections=3)
+        try:
+            assert await pool.warm() == 3
+            assert llm_module.litellm.aclient_session is pool.client
+            stats = pool.get_stats()
+            assert stats["requests"] == 3
+            assert stats["peak_in_flight_requests"] == 3
+            assert stats["in_flight_requests"] == 0
+
+            async with pool.client.stream("GET", f"{base_url}/models") as response:
+                assert response.status_code == 200
+                stats = pool.get_stats()
+                assert stats["in_flight_requests"] == 1
+                assert stats["utilization"] == 1 / pool.max_connections
+            assert pool.get_stats()["in_flight_requests"] == 0
+        finally:
+            await pool.close()
+            server.close()
+        assert llm_module.litellm.aclient_session is None
+        assert pool.get_stats()["open"] is False
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_fallback_model_after_failure()
+    test_raise_on_error()
+    test_hedge_wins_and_cancels_loser()
+    test_no_hedge_when_primary_is_fast()
+    test_no_hedge_to_same_model()
+    test_deadline_bounds_upstream_call()
+    test_perturbation_skipped_when_budget_below_latency()
+    test_breaker_opens_and_fails_fast()
+    test_breaker_half_open_probe()
+    test_stream_falls_back_before_first_chunk()
+    test_perturb_stream_keeps_first_line()
+    test_perturb_stream_falls_back_to_mother()
+    test_identical_calls_are_coalesced()
+    test_coalesced_call_not_bound_by_leader_deadline()
+    test_coalesced_error_reaches_every_caller()
+    test_single_flight_cancellation()
+    test_http_pool_warm_and_close()
+    print("✓ 所有测试通过！")
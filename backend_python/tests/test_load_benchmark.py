@@ -0,0 +1,43 @@
+"""
+压测报告统计测试
+"""
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.load_test import compare_reports, percentile, summarize
+
+
+def test_percentile_nearest_rank():
+    """最近秩分位数"""
+    values = [float(i) for i in range(1, 1001)]
+    assert percentile(values, 0.5) == 500.0
+    assert percentile(values, 0.99) == 990.0
+    assert percentile(values, 0.999) == 999.0
+    assert percentile([], 0.5) is None
+
+
+def test_summarize_and_compare():
+    """汇总结果可以在两份报告之间对比"""
+    old = summarize([0.01] * 99 + [1.0], errors=1, duration=10.0)
+    assert old["requests"] == 100
+    assert old["throughput_rps"] == 10.0
+    assert old["error_rate"] == 0.01
+    assert old["latency_ms"]["p50"] == 10.0
+    assert old["latency_ms"]["max"] == 1000.0
+
+    new = summarize([0.005] * 100, errors=0, duration=10.0)
+    report = compare_reports(
+        {"overall": old, "endpoints": {"divine": old}},
+        {"overall": new, "endpoints": {"divine": new}}
+    )
+    assert report["overall"]["p50"]["ratio"] == 0.5
+    assert report["endpoints"]["divine"]["error_rate"]["new"] == 0.0
+
+
+if __name__ == "__main__":
+    test_percentile_nearest_rank()
+    test_summarize_and_compare()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,49 @@
+"""
+热路径微基准测试 - 分配字节数与基线对比（计时受机器影响，只在命令行中检查）
+"""
+import json
+import platform
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.micro import BENCHMARKS, DEFAULT_BASELINE, check_regressions, run_suite
+
+
+def test_suite_reports_every_benchmark():
+    """每个基准都有 ns/op 和分配数据"""
+    report = run_suite(repeats=1, target_seconds=0.001)
+    assert set(report["results"]) == set(BENCHMARKS)
+    for result in report["results"].values():
+        assert result["ns_per_op"] > 0
+        assert result["alloc_bytes"] >= 0
+
+
+def test_check_regressions():
+    """超过容差才算回归，计时按参照负载换算"""
+    baseline = {"reference_ns": 100.0, "results": {"f": {"ns_per_op": 1000.0, "alloc_bytes": 500.0, "retained_bytes": 0.0}}}
+    slower_machine = {"reference_ns": 200.0, "results": {"f": {"ns_per_op": 1900.0, "alloc_bytes": 500.0, "retained_bytes": 0.0}}}
+    assert check_regressions(slower_machine, baseline, tolerance=0.3) == []
+
+    regressed = {"reference_ns": 100.0, "results": {"f": {"ns_per_op": 1500.0, "alloc_bytes": 900.0, "retained_bytes": 0.0}}}
+    problems = check_regressions(regressed, baseline, tolerance=0.3)
+    assert len(problems) == 2
+
+
+def test_allocations_within_baseline():
+    """分配字节数不超过保存的基线（同一 Python 版本下才有可比性）"""
+    baseline = json.loads(DEFAULT_BASELINE.read_text(encoding="utf-8"))
+    if baseline["python"].rsplit(".", 1)[0] != platform.python_version().rsplit(".", 1)[0]:
+        return
+    report = run_suite(repeats=1, target_seconds=0.001)
+    # 只检查分配（计时容差设为无穷大）
+    assert check_regressions(report, baseline, tolerance=float("inf")) == []
+
+
+if __name__ == "__main__":
+    test_suite_reports_every_benchmark()
+    test_check_regressions()
+    test_allocations_within_baseline()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,107 @@
+"""
+Mock LLM 服务测试 - 通过真实的 litellm 调用链访问本地 Mock 服务
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from fastapi.testclient import TestClient
+
+from app.agents.fortune_agent import InputFeatures, LLMPerturbation
+from app.services import llm_service as llm_module
+from app.services.llm_service import LLMService
+from tools.mock_llm_server import (
+    LatencyDistribution,
+    MockLLMConfig,
+    MockLLMServer,
+    create_app,
+    extract_mother_verdict,
+    perturb_verdict,
+)
+
+FEATURES = InputFeatures(False, 8, False, 23, 2)
+
+
+def _service(base_url: str) -> LLMService:
+    # 其他测试可能替换了 acompletion，这里要走真实的 litellm
+    import litellm
+    llm_module.acompletion = litellm.acompletion
+    return LLMService({
+        "api_key": "sk-mock",
+        "base_url": base_url,
+        "default_model": "gpt-4o-mini",
+        "fallback_model": "gpt-4o-mini",
+        "timeout": 5.0,
+    })
+
+
+def test_deterministic_perturbation():
+    """同一提示词得到同一输出，且保留母句内容"""
+    prompt = LLMPerturbation(None).build_prompt("你在等一个不会来的答案。", FEATURES, "zh")
+    mother = extract_mother_verdict(prompt)
+    assert mother == "你在等一个不会来的答案。"
+    assert perturb_verdict(mother, prompt) == perturb_verdict(mother, prompt)
+    assert perturb_verdict(mother, prompt).endswith("答案。")
+
+    en_prompt = LLMPerturbation(None).build_prompt("Stop asking.", FEATURES, "en")
+    assert extract_mother_verdict(en_prompt) == "Stop asking."
+
+
+def test_fault_injection():
+    """按比例注入 500 和 429"""
+    client = TestClient(create_app(MockLLMConfig(error_rate=1.0)))
+    response = client.post("/v1/chat/completions", json={"model": "m", "messages": []})
+    assert response.status_code == 500
+
+    client = TestClient(create_app(MockLLMConfig(rate_limit_rate=1.0)))
+    response = client.post("/v1/chat/completions", json={"model": "m", "messages": []})
+    assert response.status_code == 429
+    assert client.get("/_mock/stats").json()["stats"]["rate_limited"] == 1
+
+
+def test_latency_distributions():
+    """各分布采样非负，fixed 返回固定值"""
+    import random
+    rng = random.Random(1)
+    assert LatencyDistribution.parse("fixed:0.25").sample(rng) == 0.25
+    for spec in ("uniform:0.1,0.5", "normal:0.3,0.5", "lognormal:0.3,0.8", "exp:0.2"):
+        samples = [LatencyDistribution.parse(spec).sample(rng) for _ in range(200)]
+        assert min(samples) >= 0.0
+
+
+def test_llm_service_against_mock():
+    """LLMService 的普通调用和流式调用都能通过 litellm 访问 Mock 服务"""
+    with MockLLMServer(MockLLMConfig(tokens_per_second=500, seed=1)) as server:
+        service = _service(server.base_url)
+        perturbation = LLMPerturbation(service)
+        prompt = perturbation.build_prompt("你在等一个不会来的答案。", FEATURES, "zh")
+        expected = perturb_verdict("你在等一个不会来的答案。", prompt)
+
+        async def run():
+            await service.start()
+            try:
+                text, _ = await perturbation.perturb("你在等一个不会来的答案。", FEATURES, "zh")
+                streamed = [d async for d, _ in perturbation.perturb_stream("你在等一个不会来的答案。", FEATURES, "zh")]
+                # 预热和两次调用都走共享连接池
+                assert service.get_pool_stats()["requests"] >= 3
+                return text, streamed
+            finally:
+                await service.close()
+
+        text, streamed = asyncio.run(run())
+        assert text == expected
+        assert len(streamed) > 1
+        assert "".join(streamed) == expected
+
+
+if __name__ == "__main__":
+    test_deterministic_perturbation()
+    test_fault_injection()
+    test_latency_distributions()
+    test_llm_service_against_mock()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,93 @@
+"""
+微扰缓存测试
+"""
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import InputFeatures, LLMPerturbation
+from app.services.perturbation_cache import PerturbationCache
+
+
+class CountingLLM:
+    """记录调用次数的假 LLM 服务"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        self.calls += 1
+        return f"变体{self.calls}"
+
+
+def _features(char_length: int, attempt_count: int, hour: int = 14) -> InputFeatures:
+    return InputFeatures(
+        is_empty=char_length == 0,
+        char_length=char_length,
+        has_question_mark=False,
+        hour=hour,
+        attempt_count=attempt_count
+    )
+
+
+def test_quantized_key_shares_entries():
+    """同一量化分桶内的特征共享缓存条目"""
+    key_a = PerturbationCache.make_key("母句", _features(6, 3), "zh")
+    key_b = PerturbationCache.make_key("母句", _features(12, 4, hour=15), "zh")
+    key_c = PerturbationCache.make_key("母句", _features(40, 3), "zh")
+    assert key_a == key_b
+    assert key_a != key_c
+
+
+def test_perturb_fills_then_serves_from_cache():
+    """条目填满变体后不再调用 LLM"""
+    llm = CountingLLM()
+    cache = PerturbationCache(variants_per_entry=3)
+    perturbation = LLMPerturbation(llm, cache=cache)
+    features = _features(8, 1)
+
+    async def run():
+        return [(await perturbation.perturb("母句", features, "zh"))[0] for _ in range(10)]
+
+    results = asyncio.run(run())
+    assert llm.calls == 3
+    assert set(results) == {"变体1", "变体2", "变体3"}
+    assert cache.get_stats()["hits"] == 7
+
+
+def test_disk_tier_survives_restart():
+    """磁盘缓存在新实例中依然可用"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "cache.db")
+        cache = PerturbationCache(variants_per_entry=2, disk_path=path)
+        cache.add_variant("k", "甲")
+        cache.add_variant("k", "乙")
+        cache.close()
+
+        restarted = PerturbationCache(variants_per_entry=2, disk_path=path)
+        assert asyncio.run(restarted.get_variant("k")) in {"甲", "乙"}
+        assert restarted.get_stats()["disk_hits"] == 1
+        # 已在内存中，不再读磁盘
+        assert asyncio.run(restarted.get_variant("k")) in {"甲", "乙"}
+        assert restarted.get_stats()["disk_hits"] == 1
+        restarted.close()
+
+
+def test_expired_entries_are_ignored():
+    """过期条目视为未命中"""
+    cache = PerturbationCache(variants_per_entry=1, ttl=1)
+    cache.add_variant("k", "甲")
+    cache._entries["k"].created_at -= 10
+    assert asyncio.run(cache.get_variant("k")) is None
+
+
+if __name__ == "__main__":
+    test_quantized_key_shares_entries()
+    test_perturb_fills_then_serves_from_cache()
+    test_disk_tier_survives_restart()
+    test_expired_entries_are_ignored()
+    print("✓ 所有测试通过！")
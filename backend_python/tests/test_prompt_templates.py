@@ -0,0 +1,221 @@
+"""
+提示词模板注册表测试
+"""
+import asyncio
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import FortuneAgent, InputFeatures, LLMPerturbation
+from app.agents.prompt_templates import (
+    BUILTIN_COMPILED,
+    PERTURB_TEMPLATE_TYPE,
+    CompiledTemplate,
+    init_prompt_template_registry,
+)
+from app.models.user_interaction import UserInteraction
+from app.services.database_service import DatabaseService
+from app.services.perturbation_cache import PerturbationCache
+
+
+class PromptRecordingLLM:
+    """记录最近一次提示词的假 LLM 服务"""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        self.prompts.append(prompt)
+        return f"变体{len(self.prompts)}"
+
+    def observed_latency(self):
+        return None
+
+
+def _db(tmpdir: str) -> DatabaseService:
+    return DatabaseService(str(Path(tmpdir) / "test.db"))
+
+
+def test_builtin_template_matches_original_prompt():
+    """内置模板渲染结果与原先硬编码的提示词一致"""
+    features = InputFeatures.from_input("我该换工作吗？", history_count=3, hour=23)
+    prompt = LLMPerturbation(PromptRecordingLLM()).build_prompt("母句", features, "zh")
+    assert "母句：母句\n\n时间：23点\n尝试次数：4次\n输入长度：7字\n" in prompt
+    assert prompt.startswith("你是语言润色助手。")
+
+    prompt_en = LLMPerturbation(PromptRecordingLLM()).build_prompt("Verdict.", features, "en")
+    assert "Mother verdict: Verdict.\n\nTime: 23:00\nAttempt count: 4\n" in prompt_en
+
+
+def test_compile_rejects_unknown_slots():
+    """模板中使用不支持的槽位时编译失败"""
+    try:
+        CompiledTemplate("bad", "zh", 1, "母句：{mother_verdict} 问题：{question}")
+    except ValueError as e:
+        assert "question" in str(e)
+    else:
+        raise AssertionError("unknown slot should be rejected")
+
+    template = CompiledTemplate("ok", "zh", 1, "{mother_verdict}|{hour:02d}|{{literal}}")
+    assert template.render({"mother_verdict": "X", "hour": 3}) == "X|03|{literal}"
+    features = InputFeatures.from_input("问题", history_count=0, hour=3)
+    assert template.render_features("X", features) == "X|03|{literal}"
+
+
+def test_compile_rejects_mismatched_format_spec():
+    """格式说明与取值类型不匹配时编译失败，已编译的模板渲染失败时微扰回退母句"""
+    for content in ("{mother_verdict} {hour:s}", "{hour_bucket:d}", "{char_length:%Y}"):
+        try:
+            CompiledTemplate("bad", "zh", 1, content)
+        except ValueError as e:
+            assert "bad v1" in str(e)
+        else:
+            raise AssertionError(f"{content!r} should be rejected")
+
+    class BrokenTemplate:
+        language = "zh"
+        version = 9
+        label = "broken@v9"
+
+        def render_features(self, mother_verdict, features):
+            raise ValueError("Unknown format code 's' for object of type 'int'")
+
+    llm = PromptRecordingLLM()
+    perturbation = LLMPerturbation(llm)
+    features = InputFeatures.from_input("问题", history_count=0, hour=14)
+
+    async def run():
+        streamed = [d async for d in perturbation.perturb_stream("母句", features, "zh", template=BrokenTemplate())]
+        return await perturbation.perturb("母句", features, "zh", template=BrokenTemplate()), streamed
+
+    assert asyncio.run(run()) == (("母句", None), [("母句", None)])
+    assert llm.prompts == []
+
+
+def test_publish_hot_reloads_and_clears_cache():
+    """发布新版本后重新加载生效，签名不变时不重复加载"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = _db(tmpdir)
+        registry = init_prompt_template_registry(db)
+        assert registry.get("zh").version == 1  # 默认模板已写入数据库
+        assert registry.load() is False
+
+        llm = PromptRecordingLLM()
+        cache = PerturbationCache(variants_per_entry=1)
+        perturbation = LLMPerturbation(llm, cache=cache, templates=registry)
+        features = InputFeatures.from_input("问题", history_count=0, hour=14)
+
+        async def run():
+            return await perturbation.perturb("母句", features, "zh")
+
+        assert asyncio.run(run()) == ("变体1", 1)
+        assert asyncio.run(run()) == ("变体1", 1)  # 命中缓存
+
+        version = db.publish_prompt_template(
+            "perturb_zh", "zh", PERTURB_TEMPLATE_TYPE, "新模板：{mother_verdict}（{hour_bucket}）"
+        )
+        assert version == 2
+        assert registry.load() is True
+        assert registry.get("zh").label == "perturb_zh@v2"
+        assert registry.get("en").version == 1
+
+        # 版本变化后缓存失效，使用新模板
+        assert asyncio.run(run()) == ("变体2", 2)
+        assert llm.prompts[-1] == f"新模板：母句（{features.hour_bucket}）"
+
+
+def test_invalid_template_keeps_previous_version():
+    """数据库中的新版本编译失败时继续使用之前的模板"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = _db(tmpdir)
+        registry = init_prompt_template_registry(db)
+        db.publish_prompt_template("perturb_zh", "zh", PERTURB_TEMPLATE_TYPE, "{unknown}")
+        registry.load()
+        assert registry.get("zh").version == 1
+        db.publish_prompt_template("perturb_zh", "zh", PERTURB_TEMPLATE_TYPE, "{mother_verdict}{hour:s}")
+        registry.load()
+        assert registry.get("zh").version == 1
+
+
+def test_prompt_version_recorded_with_interaction():
+    """交互记录保存生成判词时的模板版本"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = _db(tmpdir)
+        registry = init_prompt_template_registry(db)
+        agent = FortuneAgent(PromptRecordingLLM(), prompt_templates=registry)
+        result = asyncio.run(agent.execute("问题", language="zh", user_id="user_a"))
+        assert result["prompt_version"] == 1
+
+        db.save_interaction(UserInteraction(
+            user_id="user_a",
+            question="问题",
+            question_hash="h",
+            result=result["result"],
+            language="zh",
+            timestamp=datetime.now(),
+            result_id="abcd1234",
+            prompt_version=result["prompt_version"]
+        ))
+        conn = sqlite3.connect(db.db_path)
+        try:
+            row = conn.execute(
+                "SELECT prompt_version FROM user_interactions WHERE result_id = ?", ("abcd1234",)
+            ).fetchone()
+        finally:
+            conn.close()
+        assert row[0] == 1
+
+
+class FailingLLM(PromptRecordingLLM):
+    """调用总是失败的假 LLM 服务"""
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        raise RuntimeError("upstream down")
+
+    async def stream(self, prompt, language='zh', **kwargs):
+        raise RuntimeError("upstream down")
+        yield  # pragma: no cover
+
+
+def test_fallback_records_no_prompt_version():
+    """LLM 失败回退母句时，结果不算作模板产出，不记录模板版本"""
+    agent = FortuneAgent(FailingLLM())
+
+    async def run():
+        single = await agent.execute("问题", language="zh", user_id="user_f")
+        batch = await agent.execute_many(["问题一", "问题二"], language="zh", user_id="user_f")
+        events = [event async for event in agent.execute_stream("问题", language="zh", user_id="user_f")]
+        return single, batch, events[-1]
+
+    single, batch, streamed = asyncio.run(run())
+    for result in [single, *batch, streamed]:
+        assert result["prompt_version"] is None
+    assert streamed["event"] == "result"
+
+    # 微扰成功时记录模板版本
+    ok = asyncio.run(FortuneAgent(PromptRecordingLLM()).execute("问题", language="zh"))
+    assert ok["prompt_version"] == BUILTIN_COMPILED["zh"].version
+
+
+def test_agent_without_registry_uses_builtin():
+    """未配置注册表时使用内置模板（版本 0）"""
+    agent = FortuneAgent(PromptRecordingLLM())
+    result = asyncio.run(agent.execute("问题", language="en"))
+    assert result["prompt_version"] == BUILTIN_COMPILED["en"].version == 0
+
+
+if __name__ == "__main__":
+    test_builtin_template_matches_original_prompt()
+    test_compile_rejects_unknown_slots()
+    test_compile_rejects_mismatched_format_spec()
+    test_publish_hot_reloads_and_clears_cache()
+    test_invalid_template_keeps_previous_version()
+    test_prompt_version_recorded_with_interaction()
+    test_fallback_records_no_prompt_version()
+    test_agent_without_registry_uses_builtin()
+    print("All prompt template tests passed")
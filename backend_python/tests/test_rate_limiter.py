@@ -0,0 +1,207 @@
+"""
+速率限制测试
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.api.divine import _rate_limited
+from app.utils.rate_limiter import (
+    MemoryRateLimiter,
+    SQLiteRateLimiter,
+    close_rate_limiter,
+    init_rate_limiter,
+)
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _exercise_bucket(make_limiter):
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    # 容量 3，每分钟 6 个（每 10 秒 1 个）
+    assert [limiter.acquire("a")[0] for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = limiter.acquire("a")
+    assert not allowed and abs(retry_after - 10.0) < 1e-6
+    assert limiter.acquire("b")[0]  # 其他用户不受影响
+
+    clock.now += 10
+    assert limiter.acquire("a")[0]
+    assert not limiter.acquire("a")[0]
+
+    # 批量按全额扣减，超过容量的消耗直接报错（不会被截断为容量）
+    clock.now += 30
+    assert limiter.acquire("a", cost=3)[0]
+    assert not limiter.acquire("a")[0]
+    try:
+        limiter.acquire("c", cost=4)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("cost above capacity should be rejected")
+    assert limiter.acquire("c", cost=3)[0]
+    return limiter, clock
+
+
+def test_memory_token_bucket():
+    """令牌按速率补充，拒绝时给出等待时间"""
+    _exercise_bucket(lambda clock: MemoryRateLimiter(6, burst=3, clock=clock))
+
+
+def test_memory_idle_eviction():
+    """空闲 key 被清理，但不会早于桶补满的时间"""
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(60, burst=5, idle_ttl=1.0, clock=clock)
+    assert limiter.idle_ttl == 5.0  # 不小于从空到满的时间
+    for i in range(100):
+        limiter.acquire(f"user_{i}")
+    assert limiter.get_stats()["active_keys"] == 100
+    clock.now += 6
+    limiter.acquire("fresh")
+    assert limiter.get_stats()["active_keys"] == 1
+
+    capped = MemoryRateLimiter(60, max_keys=10, clock=clock)
+    for i in range(50):
+        capped.acquire(f"user_{i}")
+    assert capped.get_stats()["active_keys"] == 10
+
+
+def test_sqlite_token_bucket_shared():
+    """两个实例（相当于两个 worker）共享同一个数据库文件里的限额"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "rate.db")
+        limiter, clock = _exercise_bucket(lambda clock: SQLiteRateLimiter(path, 6, burst=3, clock=clock))
+        other = SQLiteRateLimiter(path, 6, burst=3, clock=clock)
+        assert not other.acquire("a")[0]
+        clock.now += 600
+        assert other.acquire("a")[0]
+        limiter.close()
+        other.close()
+
+
+def test_sqlite_concurrent_acquire_is_atomic():
+    """并发扣减不会超发"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "rate.db")
+        clock = FakeClock()
+        limiters = [SQLiteRateLimiter(path, 60, burst=50, busy_timeout=5.0, clock=clock) for _ in range(4)]
+        results = []
+
+        def worker(limiter):
+            for _ in range(40):
+                results.append(limiter.acquire("shared")[0])
+
+        threads = [threading.Thread(target=worker, args=(limiter,)) for limiter in limiters]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results.count(True) == 50
+        for limiter in limiters:
+            limiter.close()
+
+
+def test_divine_returns_429_with_retry_after():
+    """超出限额时返回 429 和 Retry-After"""
+    init_rate_limiter(1, backend="memory", burst=1)
+    try:
+        assert asyncio.run(_rate_limited("user_x", "zh")) is None
+        response = asyncio.run(_rate_limited("user_x", "en"))
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) == 60
+        body = json.loads(response.body)
+        assert body["success"] is False and body["error"] == "RATE_LIMITED"
+    finally:
+        close_rate_limiter()
+    assert asyncio.run(_rate_limited("user_x", "zh")) is None  # 未启用时不限流
+
+
+def test_batch_larger_than_bucket_is_refused():
+    """批量请求的问题数超过桶容量时整批拒绝，不会只扣容量那么多令牌"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import divine
+
+    app = FastAPI()
+    app.include_router(divine.router, prefix="/api/v1")
+    limiter = init_rate_limiter(10, backend="memory")
+    try:
+        response = TestClient(app).post(
+            "/api/v1/divine/batch", json={"questions": ["问题"] * 11, "language": "zh"}
+        )
+        body = response.json()
+        assert body["success"] is False and body["error"] == "BATCH_TOO_LARGE"
+        assert "10" in body["message"]
+        assert limiter.get_stats()["allowed"] == 0
+    finally:
+        close_rate_limiter()
+
+
+def test_sqlite_acquire_does_not_block_event_loop():
+    """sqlite 后端等待写锁时，事件循环上的其他任务照常运行"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "rate.db")
+        limiter = SQLiteRateLimiter(path, 60, burst=5, busy_timeout=5.0)
+        blocker = SQLiteRateLimiter(path, 60, burst=5)
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.ensure_future(ticker())
+            blocker._conn.execute("BEGIN IMMEDIATE")  # 另一个 worker 持有写锁
+            pending = asyncio.ensure_future(limiter.acquire_async("a"))
+            await asyncio.sleep(0.2)
+            blocker._conn.execute("COMMIT")
+            result = await pending
+            task.cancel()
+            return ticks, result
+
+        ticks, result = asyncio.run(run())
+        assert result == (True, 0.0)
+        assert ticks >= 5
+        limiter.close()
+        blocker.close()
+
+
+def test_zero_rate_disables_limiter():
+    """RATE_LIMIT_PER_MINUTE=0 时不限流，直接构造限流器则报错"""
+    assert init_rate_limiter(0, backend="memory") is None
+    assert asyncio.run(_rate_limited("user_x", "zh")) is None
+    for make in (lambda: MemoryRateLimiter(0), lambda: SQLiteRateLimiter(":memory:", 0)):
+        try:
+            make()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("zero rate should be rejected")
+
+
+if __name__ == "__main__":
+    test_memory_token_bucket()
+    test_memory_idle_eviction()
+    test_sqlite_token_bucket_shared()
+    test_sqlite_concurrent_acquire_is_atomic()
+    test_divine_returns_429_with_retry_after()
+    test_batch_larger_than_bucket_is_refused()
+    test_sqlite_acquire_does_not_block_event_loop()
+    test_zero_rate_disables_limiter()
+    print("All rate limiter tests passed")
@@ -0,0 +1,191 @@
+"""
+分享结果缓存测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.user_interaction import UserInteraction
+from app.services.async_database import AsyncDatabaseService
+from app.services.database_service import DatabaseService
+from app.services.share_cache import BloomFilter, ShareResultCache
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _interaction(result_id: str) -> UserInteraction:
+    return UserInteraction(
+        user_id="user_test",
+        session_id=None,
+        question="我该怎么办？",
+        question_hash="hash",
+        result=f"判词-{result_id}",
+        language="zh",
+        category="general",
+        is_night=False,
+        timestamp=datetime.now(),
+        response_time_ms=10,
+        llm_model="fortune_agent",
+        result_id=result_id
+    )
+
+
+def test_bloom_filter():
+    """已加入的元素一定命中，误判率接近设定值"""
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"id-{i}")
+    assert all(f"id-{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_hits_negative_cache_and_coalescing():
+    """命中不查库；不存在的ID短时间内不重复查库；并发查询只查一次"""
+    async def run():
+        clock = FakeClock()
+        cache = ShareResultCache(negative_ttl=60, clock=clock)
+        calls = []
+
+        def loader_for(value):
+            async def loader():
+                calls.append(value)
+                await asyncio.sleep(0.01)
+                return value
+            return loader
+
+        # 写入后直接命中
+        cache.put("aaaa1111", {"text": "写入"})
+        assert await cache.get("aaaa1111", loader_for("db")) == {"text": "写入"}
+        assert calls == []
+
+        # 并发查询合并
+        results = await asyncio.gather(*(cache.get("bbbb2222", loader_for({"text": "库"})) for _ in range(10)))
+        assert results == [{"text": "库"}] * 10
+        assert len(calls) == 1
+
+        # 负缓存及过期
+        assert await cache.get("missing1", loader_for(None)) is None
+        assert await cache.get("missing1", loader_for(None)) is None
+        assert len(calls) == 2
+        clock.now += 61
+        assert await cache.get("missing1", loader_for(None)) is None
+        assert len(calls) == 3
+
+        # 加载出错不做负缓存
+        async def failing():
+            raise RuntimeError("db down")
+
+        for _ in range(2):
+            try:
+                await cache.get("cccc3333", failing)
+            except RuntimeError:
+                pass
+        assert "cccc3333" not in cache._negative
+
+    asyncio.run(run())
+
+
+def test_bloom_filter_rejects_unknown_ids_and_syncs_new_ones():
+    """布隆过滤器拒绝不存在的ID；其他进程新写入的ID在增量同步后可以查到"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = DatabaseService(os.path.join(tmpdir, "test.db"))
+            db.save_interaction(_interaction("exist001"))
+            clock = FakeClock()
+            async_db = AsyncDatabaseService(db, readers=2)
+            cache = ShareResultCache(async_db, bloom_capacity=4, sync_interval=1.0, clock=clock)
+            assert await cache.sync() == 1
+
+            calls = []
+
+            def db_loader(share_id):
+                async def loader():
+                    calls.append(share_id)
+                    return await async_db.get_interaction_by_result_id(share_id)
+                return loader
+
+            assert (await cache.get("exist001", db_loader("exist001")))["result"] == "判词-exist001"
+            # 枚举的随机ID不查库
+            for i in range(50):
+                assert await cache.get(f"rand{i:04d}", db_loader(f"rand{i:04d}")) is None
+            assert calls == ["exist001"]
+            assert cache.stats["bloom_rejects"] == 50
+
+            # 另一个进程写入（不经过本进程的 put），同步间隔过后可以查到；超过容量时自动扩容
+            for i in range(5):
+                db.save_interaction(_interaction(f"new{i:05d}"))
+            clock.now += 1.5
+            assert (await cache.get("new00004", db_loader("new00004")))["result"] == "判词-new00004"
+            assert cache.bloom_capacity >= 12
+            assert all(f"new{i:05d}" in cache._bloom for i in range(5))
+            async_db.close()
+            db.close()
+
+    asyncio.run(run())
+
+
+class PagedIds:
+    """按主键分页返回分享ID的假数据库，记录每次请求的 (last_id, limit)"""
+
+    def __init__(self, count: int):
+        self.rows = [(i, f"id{i:06d}") for i in range(1, count + 1)]
+        self.requests = []
+        self.fail_after = None
+
+    async def get_result_ids_since(self, last_id=0, limit=None):
+        self.requests.append((last_id, limit))
+        if self.fail_after is not None and len(self.requests) > self.fail_after:
+            raise RuntimeError("database is locked")
+        rows = [row for row in self.rows if row[0] > last_id]
+        return rows[:limit] if limit is not None else rows
+
+
+def test_sync_pages_through_ids():
+    """同步按固定大小分页读取ID，超出容量时重建；重建中途失败继续使用旧过滤器"""
+    async def run():
+        db = PagedIds(25)
+        cache = ShareResultCache(db, bloom_capacity=100, sync_batch_size=10)
+        assert await cache.sync() == 25
+        assert db.requests == [(0, 10), (10, 10), (20, 10)]
+        assert all(f"id{i:06d}" in cache._bloom for i in range(1, 26))
+
+        # 增量同步超出容量：从头分页重建
+        db.rows += [(i, f"id{i:06d}") for i in range(26, 121)]
+        db.requests.clear()
+        assert await cache.sync() == 120
+        assert db.requests[0] == (25, 10)
+        assert (0, 10) in db.requests
+        assert all(limit == 10 for _, limit in db.requests)
+        assert cache._bloom.capacity >= 200 and cache._last_id == 120
+
+        # 重建中途失败：保留旧过滤器和同步位置
+        old_bloom = cache._bloom
+        db.rows += [(i, f"id{i:06d}") for i in range(121, 400)]
+        db.requests.clear()
+        db.fail_after = 12  # 前 9 页增量同步后超出容量，开始重建
+        assert await cache.sync() == 0
+        assert (0, 10) in db.requests
+        assert cache._bloom is old_bloom and cache._last_id == 120
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_bloom_filter()
+    test_hits_negative_cache_and_coalescing()
+    test_bloom_filter_rejects_unknown_ids_and_syncs_new_ones()
+    test_sync_pages_through_ids()
+    print("All share cache tests passed")
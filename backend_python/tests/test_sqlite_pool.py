@@ -0,0 +1,125 @@
+"""
+SQLite 连接管理测试
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.user_interaction import UserInteraction, UserSession
+from app.services.database_service import DatabaseService
+from app.services.sqlite_pool import SQLiteConnectionManager
+
+
+def test_wal_and_connection_reuse():
+    """WAL 模式、连接参数生效，多次调用复用同一批连接"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DatabaseService(os.path.join(tmpdir, "test.db"), readers=2, mmap_size_mb=16, cache_size_kb=4096)
+        now = datetime.now()
+        for i in range(20):
+            db.save_or_update_session(UserSession(
+                user_id="user_a", ip_hash="h", first_visit=now, last_visit=now,
+                visit_count=1, user_agent=None, language="zh"
+            ))
+            db.save_interaction(UserInteraction(
+                user_id="user_a", session_id=None, question="q", question_hash="h",
+                result="r", language="zh", category="general", is_night=False,
+                timestamp=now, response_time_ms=5, llm_model="m", result_id=f"id{i:06d}"
+            ))
+            assert db.get_user_stats("user_a")["total_visits"] == i + 1
+
+        stats = db.get_connection_stats()
+        assert stats["journal_mode"] == "wal"
+        assert stats["readers_open"] == 1  # 串行调用只需要一个读连接
+        assert stats["writes"] >= 40
+
+        with db._db.reader() as conn:
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -4096
+            assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 16 * 1024 * 1024
+            try:
+                conn.execute("DELETE FROM user_sessions")
+            except sqlite3.OperationalError:
+                pass  # 读连接只读
+            else:
+                raise AssertionError("reader connection should be read-only")
+
+        db.close()
+        try:
+            db.get_interaction_by_result_id("id000001")
+        except sqlite3.ProgrammingError:
+            pass
+        else:
+            raise AssertionError("closed service should not be usable")
+
+
+def test_transaction_rollback_and_readers_not_blocked():
+    """事务出错时回滚；写事务进行中读连接仍可读到已提交的数据"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SQLiteConnectionManager(os.path.join(tmpdir, "pool.db"), readers=2)
+        with manager.transaction() as conn:
+            conn.execute("CREATE TABLE t (v INTEGER)")
+            conn.execute("INSERT INTO t VALUES (1)")
+
+        try:
+            with manager.transaction() as conn:
+                conn.execute("INSERT INTO t VALUES (2)")
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+
+        writing = threading.Event()
+        release = threading.Event()
+
+        def long_write():
+            with manager.transaction() as conn:
+                conn.execute("INSERT INTO t VALUES (3)")
+                writing.set()
+                release.wait(5)
+
+        writer = threading.Thread(target=long_write)
+        writer.start()
+        writing.wait(5)
+        with manager.reader() as conn:
+            assert [row[0] for row in conn.execute("SELECT v FROM t ORDER BY v")] == [1]
+        release.set()
+        writer.join()
+
+        with manager.reader() as conn:
+            assert [row[0] for row in conn.execute("SELECT v FROM t ORDER BY v")] == [1, 3]
+        manager.close()
+
+
+def test_reader_pool_is_bounded():
+    """并发读取不超过读连接上限，多出的调用等待归还"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manager = SQLiteConnectionManager(os.path.join(tmpdir, "pool.db"), readers=2)
+        barrier = threading.Barrier(4)
+
+        def read():
+            barrier.wait(5)
+            for _ in range(50):
+                with manager.reader() as conn:
+                    conn.execute("SELECT 1").fetchone()
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = manager.get_stats()
+        assert stats["readers_open"] <= 2 and stats["reads"] == 200
+        manager.close()
+
+
+if __name__ == "__main__":
+    test_wal_and_connection_reuse()
+    test_transaction_rollback_and_readers_not_blocked()
+    test_reader_pool_is_bounded()
+    print("All SQLite connection tests passed")
@@ -0,0 +1,55 @@
+"""
+运行状态接口测试
+"""
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import stats
+from app.config.settings import get_settings
+from app.services.llm_service import init_llm_service
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.include_router(stats.router, prefix="/api/v1")
+    return TestClient(app)
+
+
+def test_llm_stats_only_reports_llm_metrics():
+    """/stats/llm 只返回 LLM 相关统计，不需要密钥"""
+    init_llm_service({"default_model": "primary", "fallback_model": "backup"})
+    response = _client().get("/api/v1/stats/llm")
+    assert response.status_code == 200
+    assert set(response.json()["data"]) == {"breakers", "hedging", "single_flight", "http_pool"}
+
+
+def test_system_stats_requires_api_key():
+    """/stats/system 需要 X-API-Key；未配置密钥时不可用"""
+    settings = get_settings()
+    client = _client()
+    previous = settings.STATS_API_KEY
+    try:
+        settings.STATS_API_KEY = None
+        assert client.get("/api/v1/stats/system", headers={"X-API-Key": "anything"}).status_code == 403
+
+        settings.STATS_API_KEY = "secret"
+        assert client.get("/api/v1/stats/system").status_code == 401
+        assert client.get("/api/v1/stats/system", headers={"X-API-Key": "wrong"}).status_code == 401
+        response = client.get("/api/v1/stats/system", headers={"X-API-Key": "secret"})
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert "write_behind" in data and "logging" in data and "breakers" not in data
+    finally:
+        settings.STATS_API_KEY = previous
+
+
+if __name__ == "__main__":
+    test_llm_stats_only_reports_llm_metrics()
+    test_system_stats_requires_api_key()
+    print("All stats API tests passed")
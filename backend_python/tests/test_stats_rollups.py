@@ -0,0 +1,155 @@
+"""
+统计汇总表测试
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.user_interaction import UserSession, UserInteraction
+from app.services import db_admin
+from app.services.database_service import DatabaseService
+
+
+def _session(user_id: str) -> UserSession:
+    now = datetime.now()
+    return UserSession(
+        user_id=user_id,
+        ip_hash="hash",
+        first_visit=now,
+        last_visit=now,
+        visit_count=1,
+        user_agent="test",
+        language="zh"
+    )
+
+
+def _interaction(user_id: str, result_id: str, language: str = "zh", category=None, days_ago: int = 0) -> UserInteraction:
+    return UserInteraction(
+        user_id=user_id,
+        session_id=None,
+        question="我该怎么办？",
+        question_hash="hash",
+        result=f"判词-{result_id}",
+        language=language,
+        category=category,
+        is_night=False,
+        timestamp=datetime.utcnow() - timedelta(days=days_ago),
+        response_time_ms=10,
+        llm_model="fortune_agent",
+        result_id=result_id
+    )
+
+
+def _full_scan_stats(path: str) -> dict:
+    """直接扫描明细表得到的全局统计（汇总表引入前的算法）"""
+    conn = sqlite3.connect(path)
+    try:
+        def scalar(sql):
+            return conn.execute(sql).fetchone()[0]
+
+        return {
+            'total_users': scalar("SELECT COUNT(*) FROM user_sessions"),
+            'total_interactions': scalar("SELECT COUNT(*) FROM user_interactions"),
+            'today_interactions': scalar(
+                "SELECT COUNT(*) FROM user_interactions WHERE DATE(timestamp) = DATE('now')"
+            ),
+            'language_distribution': dict(conn.execute(
+                "SELECT language, COUNT(*) FROM user_interactions GROUP BY language"
+            ).fetchall()),
+            'category_distribution': dict(conn.execute(
+                "SELECT category, COUNT(*) FROM user_interactions GROUP BY category"
+            ).fetchall()),
+        }
+    finally:
+        conn.close()
+
+
+def _populate(db: DatabaseService):
+    for i in range(4):
+        db.save_or_update_session(_session(f"user_{i}"))
+    db.save_or_update_session(_session("user_0"))
+    db.save_interaction(_interaction("user_0", "a0000001"))
+    db.save_interaction(_interaction("user_1", "a0000002", language="en", category="career"))
+    db.save_many(
+        [_session("user_4"), _session("user_1")],
+        [_interaction("user_2", f"b{i:07d}", days_ago=i % 3) for i in range(9)]
+    )
+
+
+def test_rollups_follow_writes():
+    """每次写入会话和交互后，汇总表得到的统计与扫描明细表一致"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        db = DatabaseService(path)
+        assert db.get_global_stats()['total_interactions'] == 0
+
+        _populate(db)
+        stats = db.get_global_stats()
+        assert stats == _full_scan_stats(path)
+        assert stats['total_users'] == 5
+        assert stats['total_interactions'] == 11
+        assert stats['today_interactions'] == 5
+        assert stats['category_distribution'] == {None: 10, 'career': 1}
+
+        # 删除明细时汇总表同步扣减
+        with db._db.transaction() as conn:
+            conn.execute("DELETE FROM user_interactions WHERE language = 'en'")
+            conn.execute("DELETE FROM user_sessions WHERE user_id = 'user_3'")
+        assert db.get_global_stats() == _full_scan_stats(path)
+        db.close()
+
+
+def test_backfill_existing_database_and_rebuild():
+    """已有数据的旧库首次启动时回填汇总表；手动重建修复不一致的汇总表"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        db = DatabaseService(path)
+        _populate(db)
+        # 模拟汇总表引入前的旧库
+        with db._db.transaction() as conn:
+            for trigger in ("trg_interactions_rollup_insert", "trg_interactions_rollup_delete",
+                            "trg_sessions_rollup_insert", "trg_sessions_rollup_delete"):
+                conn.execute(f"DROP TRIGGER {trigger}")
+            conn.execute("DROP TABLE stats_daily")
+            conn.execute("DROP TABLE stats_totals")
+        db.close()
+
+        db = DatabaseService(path)
+        assert db.get_global_stats() == _full_scan_stats(path)
+
+        with db._db.transaction() as conn:
+            conn.execute("UPDATE stats_daily SET interactions = interactions + 100")
+        assert db.get_global_stats() != _full_scan_stats(path)
+        assert db.rebuild_stats_rollups() == 4
+        assert db.get_global_stats() == _full_scan_stats(path)
+        db.close()
+
+
+def test_rebuild_stats_command():
+    """命令行 rebuild-stats 修正被改动的汇总表"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.db")
+        db = DatabaseService(path)
+        _populate(db)
+        with db._db.transaction() as conn:
+            conn.execute("UPDATE stats_daily SET interactions = 0")
+        db.close()
+
+        db_admin.main(["--db", path, "rebuild-stats"])
+
+        db = DatabaseService(path)
+        assert db.get_global_stats() == _full_scan_stats(path)
+        db.close()
+
+
+if __name__ == "__main__":
+    test_rollups_follow_writes()
+    test_backfill_existing_database_and_rebuild()
+    test_rebuild_stats_command()
+    print("All stats rollup tests passed")
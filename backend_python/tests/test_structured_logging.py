@@ -0,0 +1,99 @@
+"""
+结构化日志测试
+"""
+import io
+import json
+import logging
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.utils import structured_logging
+from app.utils.structured_logging import (
+    SamplingFilter,
+    lazy,
+    log_fields,
+    parse_sample_rates,
+    setup_logging,
+    shutdown_logging,
+)
+
+
+def _with_logging(run, **options):
+    """在临时的日志配置下运行 run(stream)，结束后恢复根 logger"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    stream = io.StringIO()
+    setup_logging(stream=stream, **options)
+    try:
+        run()
+    finally:
+        shutdown_logging()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+    return stream.getvalue()
+
+
+def test_json_output_with_fields():
+    """JSON 格式包含消息、结构化字段和惰性字段"""
+    logger = logging.getLogger("test.json")
+
+    def run():
+        logger.info("Fortune %s", "generated", extra=log_fields(user_id="u1", ms=lazy(lambda: 12)))
+
+    line = _with_logging(run, fmt="json").strip()
+    entry = json.loads(line)
+    assert entry["msg"] == "Fortune generated"
+    assert entry["logger"] == "test.json"
+    assert entry["user_id"] == "u1"
+    assert entry["ms"] == 12
+
+
+def test_lazy_values_skipped_when_not_emitted():
+    """级别未开启或被采样掉时惰性值不会被计算"""
+    calls = []
+    value = lazy(lambda: calls.append(1) or "x")
+
+    def run():
+        logging.getLogger("test.lazy").debug("debug %s", value)
+        logging.getLogger("test.sampled").info("info %s", value)
+        logging.getLogger("test.kept").info("info %s", value)
+
+    output = _with_logging(run, level="INFO", sample_rates={"test.sampled": 0.0})
+    assert calls == [1]
+    assert output.count("info x") == 1
+
+
+def test_sampling_rates_by_prefix():
+    """最长前缀匹配，WARNING 及以上不采样"""
+    sampler = SamplingFilter(parse_sample_rates("app=0.0, app.api.divine=1.0"))
+    record = logging.makeLogRecord({"name": "app.api.divine", "levelno": logging.INFO})
+    assert sampler.filter(record)
+    record = logging.makeLogRecord({"name": "app.agents.fortune_agent", "levelno": logging.INFO})
+    assert not sampler.filter(record)
+    record = logging.makeLogRecord({"name": "app.agents.fortune_agent", "levelno": logging.ERROR})
+    assert sampler.filter(record)
+    assert sampler.dropped == 1
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """队列满时丢弃并计数"""
+    def run():
+        # 后台线程停下来，让队列积压
+        structured_logging._listener.stop()
+        for i in range(10):
+            logging.getLogger("test.queue").warning("line %d", i)
+        assert structured_logging.get_logging_stats()["queue_dropped"] == 7
+        structured_logging._listener = None
+
+    _with_logging(run, queue_size=3)
+
+
+if __name__ == "__main__":
+    test_json_output_with_fields()
+    test_lazy_values_skipped_when_not_emitted()
+    test_sampling_rates_by_prefix()
+    test_full_queue_drops_instead_of_blocking()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,79 @@
+"""
+按用户分片的 Agent 记忆测试
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import FortuneAgent
+from app.agents.user_memory import UserMemoryStore
+
+
+class SlowLLM:
+    """模拟慢速 LLM，让并发请求交错执行"""
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        await asyncio.sleep(0.01)
+        return "判词"
+
+
+def test_attempts_are_per_user():
+    """不同用户的次数互不影响"""
+    store = UserMemoryStore()
+    assert store.begin_attempt("a") == 0
+    assert store.begin_attempt("a") == 1
+    assert store.begin_attempt("b") == 0
+
+
+def test_ring_buffer_and_total_cap():
+    """单用户记录数和总记录数都有上限"""
+    store = UserMemoryStore(max_entries_per_user=3, max_total_entries=5)
+    for i in range(10):
+        store.record("a", {"i": i})
+    assert [e["i"] for e in store.get("a")] == [7, 8, 9]
+
+    for i in range(3):
+        store.record("b", {"i": i})
+    stats = store.get_stats()
+    assert stats["entries"] <= 5
+    assert store.get("a") == []  # 最久未访问的用户被淘汰
+
+
+def test_lru_user_eviction():
+    """超过用户数上限时淘汰最久未访问的用户"""
+    store = UserMemoryStore(max_users=2)
+    store.begin_attempt("a")
+    store.begin_attempt("b")
+    store.begin_attempt("a")
+    store.begin_attempt("c")
+    assert store.get_stats()["users"] == 2
+    assert store.begin_attempt("b") == 0  # b 已被淘汰，重新计数
+    assert store.begin_attempt("a") == 0  # 插入 b 时 a 成为最久未访问
+
+
+def test_concurrent_requests_get_distinct_attempts():
+    """同一用户的并发请求拿到递增的次数"""
+    agent = FortuneAgent(SlowLLM())
+
+    async def run():
+        return await asyncio.gather(*(
+            agent.execute("在吗", "zh", enable_reasoning=True, user_id="u1")
+            for _ in range(5)
+        ))
+
+    results = asyncio.run(run())
+    attempts = sorted(r["reasoning"]["features"]["attempt_count"] for r in results)
+    assert attempts == [1, 2, 3, 4, 5]
+    assert len(agent.get_memory(limit=10, user_id="u1")) == 5
+    assert agent.get_memory(user_id="u2") == []
+
+
+if __name__ == "__main__":
+    test_attempts_are_per_user()
+    test_ring_buffer_and_total_cap()
+    test_lru_user_eviction()
+    test_concurrent_requests_get_distinct_attempts()
+    print("✓ 所有测试通过！")
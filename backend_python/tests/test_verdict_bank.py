@@ -0,0 +1,67 @@
+"""
+判词变体库测试
+"""
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import FortuneAgent
+from app.agents.verdict_bank import VerdictBank, build_verdict_bank, iter_bank_keys, write_verdict_bank
+
+
+class EchoLLM:
+    """返回固定格式变体的假 LLM 服务"""
+
+    default_model = "echo"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        self.calls += 1
+        return f"变体{self.calls % 2}\n多余的第二行"
+
+
+def test_round_trip():
+    """写入后按母句和分桶读回"""
+    entries = [
+        (language, mother, [f"{mother}|{hb}|{ab}"])
+        for _, language, _, mother, hb, ab in iter_bank_keys()
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bank.bin")
+        write_verdict_bank(path, entries, variants_per_entry=2)
+
+        bank = VerdictBank(path)
+        language, mother = entries[0][0], entries[0][1]
+        assert bank.get_variants(mother, language, "evening", "many") == [f"{mother}|evening|many"]
+        assert bank.get_variants("不存在的母句", language, "evening", "many") == []
+        bank.close()
+
+
+def test_agent_serves_from_bank_without_llm():
+    """bank 模式下命中时不调用 LLM"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bank.bin")
+        builder_llm = EchoLLM()
+        stats = asyncio.run(build_verdict_bank(builder_llm, path, variants_per_entry=2))
+        assert stats["failures"] == 0
+
+        bank = VerdictBank(path)
+        live_llm = EchoLLM()
+        agent = FortuneAgent(live_llm, verdict_bank=bank)
+        result = asyncio.run(agent.execute("今天运气如何", "zh", enable_reasoning=True))
+        assert result["reasoning"]["perturbation"] == "bank"
+        assert result["result"] in {"变体0", "变体1"}
+        assert live_llm.calls == 0
+        bank.close()
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_agent_serves_from_bank_without_llm()
+    print("✓ 所有测试通过！")
@@ -0,0 +1,227 @@
+"""
+判词包测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.agents.fortune_agent import (
+    DestinyState,
+    InputFeatures,
+    VerdictPool,
+    classify,
+    determine_state_by_rules,
+    install_verdict_pools,
+    verdict_residue_by_rules,
+)
+from app.agents import verdict_packs
+from app.agents.verdict_packs import VerdictPack, VerdictPoolStore, write_verdict_pack
+
+
+def _verdicts(prefix: str, per_state: int):
+    return {
+        state: [f"{prefix}-{state.value}-{i}" for i in range(per_state)]
+        for state in DestinyState
+    }
+
+
+def _restore_builtin():
+    VerdictPool._lazy_loader = None
+    install_verdict_pools(VerdictPool.builtin_pools())
+
+
+def test_roundtrip_and_validation():
+    """写入的判词包可读回；损坏、缺状态、多行判词都会被拒绝"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "zh.pack")
+        write_verdict_pack(path, "zh", _verdicts("zh", 3), version=7)
+        pack = VerdictPack(path, "zh")
+        assert pack.version == 7
+        assert pack[DestinyState.REPEATED] == ["zh-repeated-0", "zh-repeated-1", "zh-repeated-2"]
+        pack.close()
+
+        # 语言不匹配
+        try:
+            VerdictPack(path, "en")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("language mismatch should be rejected")
+
+        # 截断 / 翻转一个字节
+        data = Path(path).read_bytes()
+        for corrupted in (data[:-3], data[:-5] + bytes([data[-5] ^ 0xFF]) + data[-4:]):
+            Path(path).write_bytes(corrupted)
+            try:
+                VerdictPack(path, "zh")
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("corrupted pack should be rejected")
+
+        # 内容不合法的包写不出来
+        missing = _verdicts("zh", 2)
+        missing[DestinyState.EMPTY_HEART] = []
+        multiline = _verdicts("zh", 2)
+        multiline[DestinyState.HESITATING] = ["第一行\n第二行"]
+        for bad in (missing, multiline):
+            try:
+                write_verdict_pack(os.path.join(tmpdir, "bad.pack"), "zh", bad, version=1)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("invalid verdicts should be rejected")
+        assert not os.path.exists(os.path.join(tmpdir, "bad.pack"))
+
+
+def test_hot_swap_recompiles_decision_table():
+    """文件变化后整体替换判词池，决策表按新池长度重新编译"""
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = VerdictPoolStore(tmpdir, ["zh", "en"])
+            assert store.reload() is False  # 目录为空，继续用内置判词
+            assert VerdictPool.get_verdicts(DestinyState.FIRST_TIME, "zh") == \
+                VerdictPool.VERDICTS_ZH[DestinyState.FIRST_TIME]
+
+            write_verdict_pack(os.path.join(tmpdir, "zh.pack"), "zh", _verdicts("v1", 7), version=1)
+            assert store.reload() is True
+            assert store.reload() is False  # 文件未变化
+
+            features = InputFeatures.from_input("我该怎么办？", history_count=4, hour=2)
+            state, index = classify(features, "zh")
+            assert state == determine_state_by_rules(features)
+            assert index == verdict_residue_by_rules(features, 7)
+            assert VerdictPool.get_verdicts(state, "zh")[index].startswith("v1-")
+            # 英文仍为内置判词
+            assert VerdictPool.get_verdicts(state, "en") == VerdictPool.VERDICTS_EN[state]
+
+            # 无效的新文件不会生效
+            Path(tmpdir, "zh.pack").write_bytes(b"DVPL garbage")
+            assert store.reload() is False
+            assert store.rejected == 1
+            assert VerdictPool.get_verdicts(state, "zh")[0].startswith("v1-")
+
+            write_verdict_pack(os.path.join(tmpdir, "zh.pack"), "zh", _verdicts("v2", 3), version=2)
+            assert store.reload() is True
+            assert store.get_stats()["packs"] == {"zh": 2}
+            assert classify(features, "zh")[1] == verdict_residue_by_rules(features, 3)
+    finally:
+        _restore_builtin()
+
+
+def test_mixed_size_packs_and_compile_failure():
+    """判词池长度的最小公倍数很大时正常加载；决策表编译失败时计入拒绝且文件不变时不再重试"""
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_verdict_pack(os.path.join(tmpdir, "zh.pack"), "zh", _verdicts("zh", 7 * 11 * 13), version=1)
+            write_verdict_pack(os.path.join(tmpdir, "en.pack"), "en", _verdicts("en", 16), version=1)
+            store = VerdictPoolStore(tmpdir, ["zh", "en"])
+            assert store.reload() is True
+            features = InputFeatures.from_input("我该怎么办？", history_count=4, hour=2)
+            assert classify(features, "zh")[1] == verdict_residue_by_rules(features, 7 * 11 * 13)
+            assert classify(features, "en")[1] == verdict_residue_by_rules(features, 16)
+
+            original = verdict_packs.build_decision_table
+
+            def failing(pools):
+                raise OverflowError("unsigned short is greater than maximum")
+
+            verdict_packs.build_decision_table = failing
+            try:
+                write_verdict_pack(os.path.join(tmpdir, "zh.pack"), "zh", _verdicts("v2", 5), version=2)
+                assert store.reload() is False
+                assert store.rejected == 1
+                assert store.reload() is False
+                assert store.rejected == 1
+            finally:
+                verdict_packs.build_decision_table = original
+            assert store.get_stats()["packs"] == {"zh": 1, "en": 1}
+    finally:
+        _restore_builtin()
+
+
+def test_lazy_language_pack():
+    """未预加载的语言在首次请求时加载，不存在的语言回退英文且不反复探测"""
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_verdict_pack(os.path.join(tmpdir, "ja.pack"), "ja", _verdicts("ja", 11), version=1)
+            store = VerdictPoolStore(tmpdir, ["zh", "en"])
+            store.reload()
+
+            async def run():
+                store.start(0)
+                try:
+                    features = InputFeatures.from_input("どうすればいい", history_count=1, hour=14)
+                    state, index = classify(features, "ja")
+                    # 11 不整除当前 modulus，按规则原文计算索引
+                    assert index == verdict_residue_by_rules(features, 11)
+                    assert VerdictPool.get_verdicts(state, "ja")[index].startswith("ja-")
+                    assert store.lazy_loads == 1
+
+                    assert VerdictPool.get_verdicts(state, "fr") == VerdictPool.VERDICTS_EN[state]
+                    assert VerdictPool.get_verdicts(state, "../zh") == VerdictPool.VERDICTS_EN[state]
+                    assert "fr" in store._missing
+                finally:
+                    await store.stop()
+
+            asyncio.run(run())
+            assert VerdictPool._lazy_loader is None
+    finally:
+        _restore_builtin()
+
+
+class FailingLLM:
+    """调用总是失败的假 LLM 服务（微扰回退母句）"""
+
+    async def generate(self, prompt, language='zh', **kwargs):
+        raise RuntimeError("upstream down")
+
+    def observed_latency(self):
+        return None
+
+
+def test_divine_serves_lazily_loaded_language():
+    """接口接受判词包目录中的新语言，没有判词池的语言回退中文"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.agents.fortune_agent import init_fortune_agent
+    from app.api import divine
+
+    app = FastAPI()
+    app.include_router(divine.router, prefix="/api/v1")
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_verdict_pack(os.path.join(tmpdir, "ja.pack"), "ja", _verdicts("ja", 11), version=1)
+            store = VerdictPoolStore(tmpdir, ["zh", "en"])
+            store.reload()
+            store.start(0)
+            init_fortune_agent(FailingLLM())
+            client = TestClient(app)
+
+            data = client.post("/api/v1/divine", json={"question": "どうすればいい", "language": "ja"}).json()["data"]
+            assert data["language"] == "ja" and data["text"].startswith("ja-")
+            assert data["shareText"] == divine.SHARE_TEXTS["zh"]
+            assert store.lazy_loads == 1
+
+            batch = client.post("/api/v1/divine/batch", json={"questions": ["一", "二"], "language": "ja"}).json()
+            assert [r["text"][:3] for r in batch["data"]] == ["ja-", "ja-"]
+
+            data = client.post("/api/v1/divine", json={"question": "?", "language": "fr"}).json()["data"]
+            assert data["language"] == "zh"
+            asyncio.run(store.stop())
+    finally:
+        _restore_builtin()
+
+
+if __name__ == "__main__":
+    test_roundtrip_and_validation()
+    test_hot_swap_recompiles_decision_table()
+    test_mixed_size_packs_and_compile_failure()
+    test_lazy_language_pack()
+    test_divine_serves_lazily_loaded_language()
+    print("All verdict pack tests passed")
@@ -0,0 +1,197 @@
+"""
+写缓冲测试
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.user_interaction import UserSession, UserInteraction
+from app.services.async_database import AsyncDatabaseService
+from app.services.database_service import DatabaseService
+from app.services.write_behind import WriteBehindQueue
+
+
+def _session(user_id: str) -> UserSession:
+    now = datetime.now()
+    return UserSession(
+        user_id=user_id,
+        ip_hash="hash",
+        first_visit=now,
+        last_visit=now,
+        visit_count=1,
+        user_agent="test",
+        language="zh"
+    )
+
+
+def _interaction(user_id: str, result_id: str) -> UserInteraction:
+    return UserInteraction(
+        user_id=user_id,
+        session_id=None,
+        question="我该怎么办？",
+        question_hash="hash",
+        result=f"判词-{result_id}",
+        language="zh",
+        category="general",
+        is_night=False,
+        timestamp=datetime.now(),
+        response_time_ms=10,
+        llm_model="fortune_agent",
+        result_id=result_id
+    )
+
+
+class SlowDatabase:
+    """记录每次批量写入的假数据库，可设置写入耗时和写不进去的记录"""
+
+    def __init__(self, delay: float = 0.0, bad_ids=()):
+        self.delay = delay
+        self.bad_ids = set(bad_ids)
+        self.batches = []
+
+    async def save_many(self, sessions, interactions):
+        await asyncio.sleep(self.delay)
+        if any(i.result_id in self.bad_ids for i in interactions):
+            raise ValueError("UNIQUE constraint failed")
+        self.batches.append((list(sessions), list(interactions)))
+        return len(interactions)
+
+
+def test_batches_writes_and_drains_on_stop():
+    """并发请求的记录合并为少数几个事务写入，关闭时写完队列"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = DatabaseService(os.path.join(tmpdir, "test.db"))
+            async_db = AsyncDatabaseService(db, readers=2)
+            queue = WriteBehindQueue(async_db, batch_size=100, flush_interval=0.05)
+            queue.start()
+            writes_before = db.get_connection_stats()["writes"]
+
+            async def request(i):
+                await queue.save_or_update_session(_session(f"user_{i % 5}"))
+                await queue.save_interaction(_interaction(f"user_{i % 5}", f"id{i:06d}"))
+
+            await asyncio.gather(*(request(i) for i in range(150)))
+            await queue.stop()
+
+            assert db.get_global_stats()["total_interactions"] == 150
+            assert db.get_user_stats("user_0")["total_visits"] == 30
+            transactions = db.get_connection_stats()["writes"] - writes_before
+            assert transactions <= 5
+            # 150 条交互 + 5 个新用户随第一条交互写入的会话 + 关闭时合并写入的 5 行会话
+            assert queue.stats["written"] == 160
+
+            # 停止后直接写入
+            await queue.save_interaction(_interaction("user_0", "late0001"))
+            assert db.get_interaction_by_result_id("late0001") is not None
+            async_db.close()
+            db.close()
+
+    asyncio.run(run())
+
+
+def test_session_visits_coalesced_per_user():
+    """同一用户的多次访问合并为一行写入，访问次数跨周期累加，最后访问时间取最新"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = DatabaseService(os.path.join(tmpdir, "test.db"))
+            async_db = AsyncDatabaseService(db, readers=2)
+            queue = WriteBehindQueue(async_db, session_interval=3600)
+            queue.start()
+
+            sessions = [_session("user_repeat") for _ in range(20)]
+            latest = sessions[-1].last_visit
+            for session in reversed(sessions):
+                await queue.save_or_update_session(session)
+            assert queue.stats["session_rows"] == 0
+            await queue.flush_sessions()
+            assert queue.stats["session_rows"] == 1
+
+            for _ in range(5):
+                await queue.save_or_update_session(_session("user_repeat"))
+            await queue.stop()
+
+            stats = db.get_user_stats("user_repeat")
+            assert stats["total_visits"] == 25
+            assert queue.stats["session_rows"] == 2
+            assert stats["last_visit"] >= latest.isoformat()
+            async_db.close()
+            db.close()
+
+    asyncio.run(run())
+
+
+def test_backpressure_when_queue_full():
+    """队列写满时入队等待，写入跟上后继续"""
+    async def run():
+        db = SlowDatabase(delay=0.02)
+        queue = WriteBehindQueue(db, max_size=5, batch_size=5, flush_interval=0.0)
+        queue.start()
+        for i in range(30):
+            await queue.save_interaction(_interaction("user", f"id{i:06d}"))
+            assert queue._queue.qsize() <= 5
+        await queue.stop()
+        assert queue.stats["blocked_puts"] > 0
+        assert sum(len(interactions) for _, interactions in db.batches) == 30
+
+    asyncio.run(run())
+
+
+def test_failed_batch_only_drops_bad_records():
+    """整批失败时逐条写入，只丢弃写不进去的记录"""
+    async def run():
+        db = SlowDatabase(bad_ids={"bad00001"})
+        queue = WriteBehindQueue(db, batch_size=10, flush_interval=0.05, retry_delay=0.0)
+        queue.start()
+        await queue.save_batch(
+            _session("user"),
+            [_interaction("user", "good0001"), _interaction("user", "bad00001"), _interaction("user", "good0002")]
+        )
+        await queue.stop()
+        written = [i.result_id for _, interactions in db.batches for i in interactions]
+        assert written == ["good0001", "good0002"]
+        assert sum(len(sessions) for sessions, _ in db.batches) == 1
+        assert queue.stats["dropped"] == 1
+        assert queue.stats["retries"] == 1
+
+    asyncio.run(run())
+
+
+def test_new_user_session_written_with_first_interaction():
+    """新用户的会话和第一条交互记录同批写入，之后的访问照常合并"""
+    async def run():
+        db = SlowDatabase()
+        queue = WriteBehindQueue(db, flush_interval=0.01, session_interval=3600)
+        queue.start()
+        await queue.save_or_update_session(_session("newcomer"))
+        await queue.save_interaction(_interaction("newcomer", "first001"))
+        await asyncio.sleep(0.05)
+        sessions, interactions = db.batches[0]
+        assert [s.user_id for s in sessions] == ["newcomer"]
+        assert [i.result_id for i in interactions] == ["first001"]
+
+        for i in range(3):
+            await queue.save_or_update_session(_session("newcomer"))
+            await queue.save_interaction(_interaction("newcomer", f"next{i:04d}"))
+        await asyncio.sleep(0.05)
+        assert sum(len(sessions) for sessions, _ in db.batches) == 1
+        assert queue.get_stats()["pending_sessions"] == 1
+        await queue.stop()
+        assert sum(s.visit_count for sessions, _ in db.batches for s in sessions) == 4
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_batches_writes_and_drains_on_stop()
+    test_session_visits_coalesced_per_user()
+    test_backpressure_when_queue_full()
+    test_failed_batch_only_drops_bad_records()
+    test_new_user_session_written_with_first_interaction()
+    print("All write-behind tests passed")
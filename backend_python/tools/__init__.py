@@ -0,0 +1,3 @@
+"""
+开发与压测工具（不随应用部署）
+"""
@@ -0,0 +1,369 @@
+"""
+本地 Mock LLM 服务 - OpenAI chat-completions 兼容，支持延迟和故障注入
+
+把 LLM_BASE_URL 指向它即可离线压测、复现长尾延迟：
+- 延迟分布：首字延迟按分布采样，之后按 token 速率输出
+- 故障注入：按比例返回 5xx / 429，或挂起直到客户端超时
+- 输出：从提示词中找到母句（"母句：" / "Mother verdict: "），做确定性的微扰
+
+用法：
+    python -m tools.mock_llm_server --port 8900 --latency lognormal:0.4,0.5 --error-rate 0.02
+    LLM_BASE_URL=http://127.0.0.1:8900/v1 uvicorn app.main:app
+
+延迟分布格式：
+    fixed:0.2 | uniform:0.1,0.5 | normal:0.3,0.1 | lognormal:0.3,0.5（中位数,sigma）| exp:0.3（均值）
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+MOTHER_VERDICT_PATTERN = re.compile(r"^(?:母句：|Mother verdict: )(.+)$", re.MULTILINE)
+
+# 确定性微扰：只调整语气和停顿，与提示词的约束一致
+ZH_PREFIXES = ("", "记住，", "听好，", "说白了，")
+EN_PREFIXES = ("", "Listen: ", "Remember, ", "Plainly, ")
+
+
+class LatencyDistribution:
+    """延迟分布（秒）"""
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exp")
+
+    def __init__(self, kind: str = "fixed", params: Optional[List[float]] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.params = list(params or [0.0])
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """解析 "kind:a,b" 格式"""
+        kind, _, raw = spec.partition(":")
+        params = [float(p) for p in raw.split(",") if p.strip()] if raw else [0.0]
+        return cls(kind.strip(), params)
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1] if len(p) > 1 else 0.0)
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(max(p[0], 1e-6)), p[1] if len(p) > 1 else 0.0)
+        else:
+            value = rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+        return max(0.0, value)
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(str(x) for x in self.params)}"
+
+
+class MockLLMConfig:
+    """Mock 服务行为配置（运行时可通过 /_mock/config 修改）"""
+
+    def __init__(
+        self,
+        latency: Optional[LatencyDistribution] = None,
+        tokens_per_second: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        hang_seconds: float = 120.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            latency: 首字延迟分布
+            tokens_per_second: token 输出速率，0 表示不限速
+            error_rate: 返回 500 的比例
+            rate_limit_rate: 返回 429 的比例
+            timeout_rate: 挂起不响应的比例（用于触发客户端超时）
+            hang_seconds: 挂起时长（秒）
+            seed: 随机种子（延迟和故障采样可复现）
+        """
+        self.latency = latency or LatencyDistribution()
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.seed = seed
+
+    def update(self, values: Dict[str, Any]):
+        for key, value in values.items():
+            if key == "latency":
+                value = LatencyDistribution.parse(value) if isinstance(value, str) else value
+            elif not hasattr(self, key):
+                raise ValueError(f"Unknown mock option: {key}")
+            setattr(self, key, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": repr(self.latency),
+            "tokens_per_second": self.tokens_per_second,
+            "error_rate": self.error_rate,
+            "rate_limit_rate": self.rate_limit_rate,
+            "timeout_rate": self.timeout_rate,
+            "hang_seconds": self.hang_seconds,
+            "seed": self.seed,
+        }
+
+
+def extract_mother_verdict(prompt: str) -> Optional[str]:
+    """从微扰提示词中取出母句"""
+    match = MOTHER_VERDICT_PATTERN.search(prompt)
+    return match.group(1).strip() if match else None
+
+
+def perturb_verdict(mother_verdict: str, prompt: str) -> str:
+    """
+    确定性微扰：同一提示词总是得到同一结果
+
+    只加语气前缀或调整停顿，不改变母句内容，方便压测时校验输出
+    """
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    is_zh = any("一" <= ch <= "鿿" for ch in mother_verdict)
+    prefixes = ZH_PREFIXES if is_zh else EN_PREFIXES
+    text = prefixes[digest[0] % len(prefixes)] + mother_verdict
+    if digest[1] % 2:
+        text = text.replace("，", "。", 1) if is_zh else text.replace(", ", ". ", 1)
+    return text
+
+
+def tokenize(text: str) -> List[str]:
+    """粗略切分 token：中文按字，英文按词（保留空格）"""
+    return re.findall(r"\s*[A-Za-z0-9']+|\s*[^\sA-Za-z0-9']", text)
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = "".join(c.get("text", "") for c in content if isinstance(c, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+def _error(status: int, message: str, error_type: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": message, "type": error_type, "code": status}}
+    )
+
+
+def create_app(config: Optional[MockLLMConfig] = None) -> FastAPI:
+    """创建 Mock 服务应用（可直接在测试或压测进程内使用）"""
+    config = config or MockLLMConfig()
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0, "hangs": 0, "completed": 0}
+
+    app = FastAPI(title="Mock LLM")
+    app.state.config = config
+    app.state.stats = stats
+
+    def reply_for(prompt: str, max_tokens: Optional[int]) -> List[str]:
+        mother = extract_mother_verdict(prompt)
+        text = perturb_verdict(mother, prompt) if mother else "Mock reply."
+        tokens = tokenize(text)
+        return tokens[:max_tokens] if max_tokens else tokens
+
+    async def inject_faults() -> Optional[JSONResponse]:
+        """按配置注入故障，返回 None 表示正常处理"""
+        roll = rng.random()
+        if roll < config.timeout_rate:
+            stats["hangs"] += 1
+            await asyncio.sleep(config.hang_seconds)
+            return _error(504, "Mock upstream hang", "timeout")
+        roll -= config.timeout_rate
+        if roll < config.error_rate:
+            stats["errors"] += 1
+            return _error(500, "Mock upstream failure", "server_error")
+        roll -= config.error_rate
+        if roll < config.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return _error(429, "Mock rate limit", "rate_limit_exceeded")
+        return None
+
+    def token_delay() -> float:
+        return 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    @app.get("/v1/models")
+    @app.get("/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        model = body.get("model", "mock")
+        prompt = _prompt_text(body.get("messages", []))
+        tokens = reply_for(prompt, body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        failure = await inject_faults()
+        if failure is not None:
+            return failure
+
+        await asyncio.sleep(config.latency.sample(rng))
+
+        if body.get("stream"):
+            stats["streams"] += 1
+
+            async def events() -> AsyncIterator[str]:
+                delay = token_delay()
+                first = {"role": "assistant", "content": ""}
+                for index, delta in enumerate([first] + [{"content": t} for t in tokens]):
+                    if index > 1 and delay:
+                        await asyncio.sleep(delay)
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+                stats["completed"] += 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        if token_delay():
+            await asyncio.sleep(token_delay() * len(tokens))
+        stats["completed"] += 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(tokenize(prompt)),
+                "completion_tokens": len(tokens),
+                "total_tokens": len(tokenize(prompt)) + len(tokens),
+            },
+        }
+
+    @app.get("/_mock/stats")
+    async def get_stats():
+        return {"config": config.to_dict(), "stats": stats}
+
+    @app.post("/_mock/config")
+    async def update_config(request: Request):
+        try:
+            config.update(await request.json())
+        except ValueError as e:
+            return _error(400, str(e), "invalid_request_error")
+        return {"config": config.to_dict()}
+
+    return app
+
+
+class MockLLMServer:
+    """在后台线程中运行 Mock 服务（测试和压测用）"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.app = create_app(config)
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self, timeout: float = 10.0) -> "MockLLMServer":
+        import threading
+        import uvicorn
+
+        self._server = uvicorn.Server(uvicorn.Config(
+            self.app, host=self.host, port=self.port, log_level="warning", lifespan="off"
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Mock LLM server failed to start")
+            time.sleep(0.01)
+        # port=0 时取实际绑定的端口
+        self.port = self._server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+            self._server = None
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default="fixed:0.0", help="首字延迟分布，例如 lognormal:0.4,0.5")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="输出速率，0 表示不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="挂起不响应的比例")
+    parser.add_argument("--hang-seconds", type=float, default=120.0, help="挂起时长（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockLLMConfig(
+        latency=LatencyDistribution.parse(args.latency),
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        seed=args.seed
+    )
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Mock LLM listening on http://{args.host}:{args.port}/v1 with {config.to_dict()}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()